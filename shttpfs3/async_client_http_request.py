@@ -0,0 +1,171 @@
+import os, json, asyncio
+from typing import Dict, List, Tuple, Callable, Awaitable, Optional, Any
+
+from shttpfs3.async_http_client import AsyncHTTPClient
+from shttpfs3.client_http_request import parse_server_url, idempotent_requests
+
+class async_client_http_request:
+    """ Equivalent of client_http_request for use from asyncio, allowing many requests to
+    be made concurrently from a single thread. At most 'max_connections' requests are in
+    progress at once, further requests wait for a connection to become free. Idle
+    connections are kept for reuse, and if a task making a request is cancelled its
+    connection is closed and the slot is released. """
+
+############################################################################################
+    def __init__(self, server_base_url: str, max_connections: int = 8):
+        "Configure the servers base URL, connections are opened when first needed"
+
+        self.server_base_url, self.port, self.tls = parse_server_url(server_base_url)
+        self.max_connections = max_connections
+        self.idle: List[AsyncHTTPClient] = []
+
+        # Created on first use as it must belong to the running event loop
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+############################################################################################
+    async def connect(self) -> AsyncHTTPClient:
+        c = AsyncHTTPClient()
+        await c.connect( self.server_base_url,
+                         port = self.port,
+                         tls  = self.tls)
+        return c
+
+############################################################################################
+    async def acquire(self) -> AsyncHTTPClient:
+        """ Wait for a free slot, then take an idle connection from the pool, discarding
+        any which the server has closed, or open a new one if there are none """
+
+        if self.semaphore is None: self.semaphore = asyncio.Semaphore(self.max_connections)
+        await self.semaphore.acquire()
+
+        try:
+            while self.idle != []:
+                conn = self.idle.pop()
+                if not await conn.is_stale(): return conn
+                conn.close()
+
+            return await self.connect()
+        except BaseException:
+            self.semaphore.release(); raise
+
+############################################################################################
+    def release(self, conn: AsyncHTTPClient, headers: Optional[Dict[str, str]] = None):
+        """ Return a connection to the pool once its responce has been read completely, or
+        close it if headers are not given, and free its slot """
+
+        if headers is not None and headers.get('connection', '').lower() != 'close' and len(self.idle) < self.max_connections:
+            self.idle.append(conn)
+        else:
+            conn.close()
+
+        if self.semaphore is not None: self.semaphore.release()
+
+############################################################################################
+    def close(self):
+        """ Close all idle connections """
+
+        idle, self.idle = self.idle, []
+        for conn in idle: conn.close()
+
+############################################################################################
+    async def begin(self, conn: AsyncHTTPClient, url: str, body_length: int, add_headers: Dict[str, str], content_type: str):
+        headers = {
+            'Accept-Encoding': 'identity',
+            'Host'           : self.server_base_url,
+            'Content-Type'   : content_type,
+            'Content-length' : str(body_length),
+            'User-Agent'     : 'SHTTPFS' }
+
+        for k, v in add_headers.items(): headers[k] = v
+
+        # ==
+        await conn.send_headers('/' + url, headers)
+
+############################################################################################
+    async def send_request(self, url: str, headers: Dict[str, str], content_type: str, body_length: int,
+                           send_body: Callable[[AsyncHTTPClient], Awaitable[None]], gen: bool = False) -> Tuple[AsyncHTTPClient, Dict[str, str], Any]:
+        """ Send a request and read the responce. Unless gen is set the body is read and the
+        connection returned to the pool, otherwise the body reader is returned and the caller
+        must release the connection once it has read it. The body of a responce whose status
+        is not ok is always read, as callers do not read it. """
+
+        retry = url in idempotent_requests
+        while True:
+            conn = await self.acquire()
+            try:
+                await self.begin(conn, url, body_length, headers, content_type)
+                await send_body(conn)
+                parsed_preamble, body = await conn.read_responce()
+                read_now = not gen or parsed_preamble['headers'].get('status') != 'ok'
+                if read_now: body = await body.read_all()
+                break
+
+            except OSError:
+                self.release(conn)
+                if not retry: raise
+                retry = False
+
+            except BaseException:
+                self.release(conn); raise
+
+        if read_now: self.release(conn, parsed_preamble['headers'])
+        return conn, parsed_preamble['headers'], body
+
+############################################################################################
+    async def request(self, url, headers, data = None, gen = False):
+        """ If gen is set the returned writer must be awaited, as the connection
+        slot is held until the body has been read, unless the status is not ok """
+
+        # Bytes are sent as they are, anything else as JSON
+        if isinstance(data, bytes): jsn, content_type = data, 'application/octet-stream'
+        else:                       jsn, content_type = (json.dumps(data) if data is not None else '{}').encode('utf8'), 'application/json'
+
+        conn, responce_headers, body = await self.send_request(url, headers, content_type, len(jsn),
+                                                               lambda conn: conn.send(jsn), gen)
+
+        if gen is False:
+            return body, responce_headers
+
+        else:
+            async def writer(dest, append = False):
+                """ Write the body to the file at path 'dest', or pass it to 'dest' in pieces if it is callable """
+                async def copy(write):
+                    while True:
+                        chunk = await body.read(1000 * 1000)
+                        if chunk is None: break
+                        write(chunk)
+
+                if isinstance(body, (bytes, bytearray)): # already read, and the connection released
+                    if callable(dest): dest(body)
+                    else:
+                        with open(dest, 'ab' if append else 'wb') as f: f.write(body)
+                    return
+
+                try:
+                    if callable(dest): await copy(dest)
+                    else:
+                        with open(dest, 'ab' if append else 'wb') as f: await copy(f.write)
+                except BaseException:
+                    self.release(conn); raise
+                self.release(conn, responce_headers)
+
+            return writer, responce_headers
+
+############################################################################################
+    async def send_file(self, url, headers, file_path, offset = 0):
+        """ Send the contents of a file from 'offset' onwards as the request body """
+
+        size = os.stat(file_path).st_size - offset
+
+        async def send_body(conn):
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                remaining = size
+                while remaining > 0:
+                    chunk = f.read(min(1000 * 1000, remaining))
+                    if chunk == b'': raise IOError('File was truncated while being sent: ' + file_path)
+                    remaining -= len(chunk)
+                    await conn.send(chunk)
+
+        _, responce_headers, body = await self.send_request(url, headers, 'application/octet-stream', size, send_body)
+        return body, responce_headers
@@ -0,0 +1,101 @@
+import asyncio, ssl
+from typing import Dict, Optional, Tuple
+
+from shttpfs3.http_common import read_body, generate_headers, parse_http_responce_preamble, httpResponcePreamble, max_preamble_size
+
+#=====================================================================
+class async_read_body:
+    """ Equivalent of read_body for an asyncio stream """
+
+    def __init__ (self, reader: asyncio.StreamReader, body_length: int):
+        self.reader      = reader
+        self.body_length = body_length
+        self.have_read   = 0
+
+    async def read(self, length = None) -> Optional[bytes]:
+        if self.have_read >= self.body_length: return None
+
+        if length is None or length > self.body_length - self.have_read:
+            length = self.body_length - self.have_read
+
+        retbuffer = await self.reader.read(length)
+        if retbuffer == b'': raise ConnectionError('Connection closed before the body was received')
+
+        self.have_read += len(retbuffer)
+        return retbuffer
+
+    async def read_all(self) -> bytearray:
+        """ Read the rest of the body into a bytearray, which is allocated once as in
+        read_body.read_all, and is extended only if the length was wrong """
+
+        buf = bytearray(min(self.body_length - self.have_read, read_body.max_preallocate))
+        filled = 0
+
+        while True:
+            chunk = await self.read(1000 * 1000)
+            if chunk is None: break
+            buf[filled : filled + len(chunk)] = chunk
+            filled += len(chunk)
+
+        return buf
+
+    async def dump(self):
+        """ Read whole body and discard it """
+
+        while True:
+            res = await self.read(10000)
+            if res is None: break
+
+#=====================================================================
+class AsyncHTTPClient:
+    """ Equivalent of HTTPClient using asyncio streams """
+
+    async def connect(self, host: str, port: int, tls: bool = False):
+        self.reader, self.writer = await asyncio.open_connection(
+            host, port, ssl = ssl.create_default_context() if tls else None, limit = max_preamble_size)
+
+    async def send(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def send_headers(self, uri: str, headers: Dict[str, str]):
+        msg = b"POST " + uri.encode('utf8') + b" HTTP/1.1\r\n"
+        await self.send(
+            msg +
+            generate_headers(headers) +
+            b"\r\n"
+        )
+
+    async def read_responce(self) -> Tuple[httpResponcePreamble, async_read_body]:
+        parsed_preamble = await self.read_headers()
+        body = async_read_body(self.reader, int(parsed_preamble['headers']['content-length']))
+        return parsed_preamble, body
+
+    async def read_headers(self) -> httpResponcePreamble:
+        try: data = await self.reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            raise ConnectionError('Connection closed before the responce was received')
+        except asyncio.LimitOverrunError:
+            raise ValueError('Headers are too large')
+
+        return parse_http_responce_preamble(data[:-4])
+
+    async def is_stale(self) -> bool:
+        """ Nothing should be readable from an idle connection, if the server has closed it or
+        sent something unexpected it cannot be used. A read is given one pass of the event
+        loop, which is only enough for it to complete if something has been received. """
+
+        if self.writer.is_closing(): return True
+
+        read = asyncio.ensure_future(self.reader.read(1))
+        await asyncio.sleep(0)
+        if read.done():
+            read.exception() # the connection is discarded whether or not the read failed
+            return True
+
+        read.cancel()
+        await asyncio.wait([read]) # the reader can only be used once the read has finished
+        return False
+
+    def close(self):
+        self.writer.close()
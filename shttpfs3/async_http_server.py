@@ -0,0 +1,132 @@
+import asyncio, os, socket, traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from shttpfs3.http_common import read_body, parse_http_request_preamble, max_preamble_size
+from shttpfs3.http_server import Request, Responce, ServeFile, responce_preamble, bind_socket, listen_socket, prefork
+
+#=============================================
+# Equivalent of HTTPServer which handles connections on an asyncio event loop, so
+# that idle persistent connections do not each hold a thread. Only the handling of
+# requests, which is blocking, runs on a pool of threads. The handler reads the
+# request body from the event loop through read_body as it does in HTTPServer.
+#=============================================
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, connection_handler,
+                            executor: ThreadPoolExecutor, max_requests: int = 0, keep_alive_timeout: Optional[float] = None,
+                            request_timeout: Optional[float] = None):
+    """ Serve requests from a persistent connection, see http_server.handle_connection """
+
+    loop = asyncio.get_event_loop()
+    addr = writer.get_extra_info('peername')
+
+    def recv(length: int) -> bytes:
+        """ Read from the connection, called from the thread running the handler """
+        try: return asyncio.run_coroutine_threadsafe(asyncio.wait_for(reader.read(length), request_timeout), loop).result()
+        except asyncio.TimeoutError: raise socket.timeout('timed out reading the request body')
+
+    def handle(rq: Request, body_reader: read_body) -> Responce:
+        rsp: Responce = connection_handler(rq)
+        body_reader.dump() # as we are using persistant connections, we need to read any
+                           # body from the socket
+        return rsp
+
+    try:
+        requests = 0
+        while True:
+            # read request preamble
+            try: data = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), keep_alive_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError): return
+            except asyncio.LimitOverrunError:
+                print('request headers too large')
+                return
+
+            # parse the header
+            request = parse_http_request_preamble(data[:-4])
+
+            if request['method'].lower() != 'post':
+                print('error parsing request')
+                return
+
+            request_headers = {k.lower() : v for k,v in dict(request['headers']).items()}
+
+            # handle the request
+            print('Connecction from:', addr[0], ':', addr[1],' ', request['path'])
+
+            body_length = int(request_headers['content-length'])
+            body_reader = read_body(recv, body_length, b'')
+            rq = Request(addr[0], addr[1], request['path'], request_headers, body_reader)
+            rsp = await loop.run_in_executor(executor, handle, rq, body_reader)
+
+            # generate client responce
+            requests += 1
+            keep_alive = max_requests == 0 or requests < max_requests
+            responce_headers, parts = responce_preamble(rsp, keep_alive)
+            writer.write(responce_headers)
+
+            try:
+                for part in parts:
+                    if isinstance(part, ServeFile):
+                        with open(part.path, 'rb') as f:
+                            await send_file(writer, f, part.offset, part.get_length())
+                    else:
+                        writer.write(part)
+                await writer.drain()
+            finally:
+                for part in parts:
+                    if isinstance(part, ServeFile) and part.delete: os.remove(part.path)
+
+            if not keep_alive: return
+
+    except OSError: pass # the connection failed
+    except Exception: traceback.print_exc() # pylint: disable=broad-except
+    finally:
+        writer.close()
+
+#=============================================
+async def send_file(writer: asyncio.StreamWriter, f, offset: int, length: int):
+    """ Send part of a file, with sendfile where the event loop supports it """
+
+    await writer.drain()
+    loop = asyncio.get_event_loop()
+    if hasattr(loop, 'sendfile'): # python 3.7 onwards
+        await loop.sendfile(writer.transport, f, offset, length)
+        return
+
+    f.seek(offset)
+    remaining = length
+    while remaining > 0:
+        chunk = f.read(min(1000 * 1000, remaining))
+        if chunk == b'': raise IOError('File was truncated while being sent')
+        writer.write(chunk); remaining -= len(chunk)
+        await writer.drain()
+
+#=============================================
+def serve_async(s: socket.socket, connection_handler, threads: int = 32, max_requests: int = 1000,
+                keep_alive_timeout: Optional[float] = 15, request_timeout: Optional[float] = 60):
+    """ Accept connections from a listening socket and serve them on an event loop, with
+    requests handled by a pool of 'threads'. Unlike serve() the number of connections is
+    not limited, as connections which are waiting for a request cost very little. """
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ThreadPoolExecutor(threads)
+
+    def on_connection(reader, writer):
+        return handle_connection(reader, writer, connection_handler, executor, max_requests, keep_alive_timeout, request_timeout)
+
+    try:
+        loop.run_until_complete(asyncio.start_server(on_connection, sock = s, limit = max_preamble_size))
+        loop.run_forever()
+    finally:
+        s.close(); loop.close(); executor.shutdown(wait = False)
+
+#=============================================
+def AsyncHTTPServer(host, port, connection_handler, backlog: int = 128, workers: int = 0, **options):
+    """ Listen on host and port and serve connections, see serve_async() for the options.
+    If 'workers' is given they are served by that many processes, see prefork(). """
+
+    if workers > 0:
+        prefork(bind_socket(host, port, reuse_port = True), workers,
+                lambda s: serve_async(s, connection_handler, **options), backlog)
+    else:
+        serve_async(listen_socket(host, port, backlog), connection_handler, **options)
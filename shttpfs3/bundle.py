@@ -0,0 +1,64 @@
+import struct, json
+from typing import Callable, Optional
+
+#===============================================================================
+# A simple tar like format for sending many files in one responce. Each file is
+# a record header, holding the length of the file info JSON and of the file, then
+# the file info and the contents of the file. A header with an info length of
+# zero marks the end of the bundle.
+#===============================================================================
+record_header = struct.Struct('>IQ')
+end_marker    = record_header.pack(0, 0)
+
+#===============================================================================
+def pack_record_header(file_info: dict, length: int) -> bytes:
+    """ Header and file info of a record, the contents of the file follow it """
+
+    info = json.dumps(file_info).encode('utf8')
+    return record_header.pack(len(info), length) + info
+
+#===============================================================================
+class unpacker:
+    """ Splits a bundle into files as it is received. For each record 'open_file'
+    is called with the file info and returns the function which the contents
+    are written to, and 'close_file' is called once all of them have been. """
+
+    def __init__(self, open_file: Callable[[dict], Callable[[bytes], None]], close_file: Callable[[dict], None]):
+        self.open_file  = open_file
+        self.close_file = close_file
+        self.buf        = bytearray()
+        self.file_info: Optional[dict] = None
+        self.write: Optional[Callable[[bytes], None]] = None
+        self.remaining  = 0
+        self.done       = False
+
+    def feed(self, data: bytes):
+        self.buf += data
+        while True:
+            if self.file_info is not None:
+                n = min(self.remaining, len(self.buf))
+                if n > 0:
+                    self.write(bytes(self.buf[:n])); del self.buf[:n] # type: ignore
+                    self.remaining -= n
+                if self.remaining > 0: return
+
+                self.close_file(self.file_info)
+                self.file_info = None
+
+            elif self.done:
+                if len(self.buf) > 0: raise ValueError('Data after the end of the bundle')
+                return
+
+            else:
+                if len(self.buf) < record_header.size: return
+                info_length, self.remaining = record_header.unpack_from(self.buf)
+                if info_length == 0: del self.buf[:record_header.size]; self.done = True; continue
+
+                if len(self.buf) < record_header.size + info_length: return
+                self.file_info = json.loads(self.buf[record_header.size : record_header.size + info_length].decode('utf8'))
+                del self.buf[:record_header.size + info_length]
+                self.write = self.open_file(self.file_info) # type: ignore
+
+    def finish(self):
+        """ Check that the whole bundle has been received """
+        if not self.done: raise ValueError('Bundle is incomplete')
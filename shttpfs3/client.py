@@ -1,16 +1,25 @@
 from pprint import pprint
-import os, sys, time, json, base64, fnmatch, shutil, fcntl, errno, urllib.parse
+import os, sys, time, json, base64, shutil, fcntl, errno, hashlib, tempfile, threading, urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Set, Tuple, Optional, Iterator, Iterable, Callable, TypeVar, BinaryIO, Union
 from typing_extensions import TypedDict
 
 import pysodium #type: ignore
 
 #=================================================
-from shttpfs3.common import (cpjoin, get_file_list, find_manifest_changes, make_dirs_if_dont_exist, manifestFileDetails,
-                             get_single_file_info, file_or_default, file_put_contents, file_get_contents, ignore)
+from shttpfs3.common import (cpjoin, get_file_list, get_dirty_file_list, find_manifest_changes, make_dirs_if_dont_exist,
+                             manifestFileDetails, path_filter, get_single_file_info, file_or_default, file_put_contents, file_get_contents, ignore,
+                             hashing_writer)
 from shttpfs3.client_http_request import client_http_request
 from shttpfs3.plain_storage import plain_storage
+from shttpfs3.hash_cache import hash_cache
+from shttpfs3.inotify import tree_watcher
+from shttpfs3.delta import signature, make_delta, patcher, block_size_for
+from shttpfs3.compression import worth_compressing, compress_file, inflater
+from shttpfs3.bundle import pack_record_header, end_marker, unpacker
 import shttpfs3.crypto as crypto
 
 #===============================================================================
@@ -22,17 +31,34 @@ class clientConfiguration(TypedDict, total=False):
     ignore_filters:      List[str]
     pull_ignore_filters: List[str]
     data_dir:            str
+    scan_workers:        int # number of threads used to scan the working copy
+    update_batch_size:   int # maximum number of files in each update transaction
+    pull_workers:        int # number of files downloaded concurrently
+    push_workers:        int # number of files uploaded concurrently
+    push_retries:        int # number of times an upload is resumed if the connection fails
+    push_batch_size:     int # maximum number of files uploaded in a single request
+    push_batch_max_size: int # files larger than this are uploaded individually
+    pull_retries:        int # number of times a download is resumed if the connection fails
+    pull_batch_size:     int # maximum number of files downloaded in a single request
+    pull_batch_max_size: int # files larger than this are downloaded individually
+    delta_min_size:      int # changed files at least this large are transferred as deltas
+    compression:         bool # compress file transfers if the server supports it
+
+T = TypeVar('T'); R = TypeVar('R')
 
 #===============================================================================
-config:            clientConfiguration
-data_store:        plain_storage
-server_connection: client_http_request
+config:             clientConfiguration
+data_store:         plain_storage
+file_hashes:        hash_cache
+ignore_filter:      path_filter
+pull_ignore_filter: path_filter
+server_connection:  client_http_request
 
 working_copy_base_path: str = os.getcwd() + '/'
 
 #===============================================================================
 def init(unlocked = False):
-    global data_store, server_connection, config
+    global data_store, file_hashes, server_connection, config, ignore_filter, pull_ignore_filter
     try: config = json.loads(file_get_contents(cpjoin(working_copy_base_path, '.shttpfs', 'client_configuration.json')))
     except IOError:    raise SystemExit('No shttpfs configuration found')
     except ValueError: raise SystemExit('Configuration file syntax error')
@@ -52,9 +78,13 @@ def init(unlocked = False):
     config['pull_ignore_filters']: List[str] = pull_ignore_filters.splitlines()
     config['data_dir']:            str       = working_copy_base_path
 
+    ignore_filter      = path_filter(config['ignore_filters'])
+    pull_ignore_filter = path_filter(config['pull_ignore_filters'])
+
     if not unlocked: config["private_key"] = crypto.unlock_private_key(config["private_key"])
 
     data_store = plain_storage(config['data_dir'])
+    file_hashes = hash_cache(cpjoin(working_copy_base_path, '.shttpfs', 'hash_cache.db'))
     server_connection = client_http_request(config['server_domain'])
 
 
@@ -87,20 +117,468 @@ def authenticate(previous_token: str = None) -> str:
 
 
 #===============================================================================
-def find_local_changes() -> Tuple[dict, Dict[str, manifestFileDetails]]:
-    """ Find things that have changed since the last run, applying ignore filters """
+def find_local_changes(dirty_paths: Optional[Set[str]] = None) -> Tuple[dict, Dict[str, manifestFileDetails]]:
+    """ Find things that have changed since the last run, applying ignore filters. If
+    'dirty_paths' is given only these paths are looked at, everything else is assumed
+    to match the manifest. """
 
     manifest = data_store.read_local_manifest()
     old_state = manifest['files']
-    current_state = get_file_list(config['data_dir'])
-    current_state = [fle for fle in current_state if not
-                     next((True for flter in config['ignore_filters']
-                           if fnmatch.fnmatch(fle['path'], flter)), False)]
-    return manifest, find_manifest_changes(current_state, old_state)
+    workers = config.get('scan_workers', 1)
+    if dirty_paths is None: current_state = get_file_list(config['data_dir'], workers, ignore_filter)
+    else:                   current_state = get_dirty_file_list(config['data_dir'], dirty_paths, old_state, workers, ignore_filter)
+    changes = find_manifest_changes(current_state, old_state)
+
+    # Tools such as 'rsync -t' or backup restores often change the times of a file without
+    # changing its contents. If the hash of a changed file matches the hash in the manifest
+    # it has not really changed, and only its manifest entry needs to be updated.
+    touched: List[manifestFileDetails] = []
+    for fle in changes.values():
+        if fle['status'] == 'changed' and 'hash' in old_state[fle['path']]:
+            try: file_hash = file_hashes.get(cpjoin(config['data_dir'], fle['path']))
+            except OSError: continue
+            if file_hash == old_state[fle['path']]['hash']: touched.append(fle)
+    file_hashes.save()
+
+    if touched != []:
+        data_store.begin()
+        for fle in touched:
+            del changes[fle['path']]
+            manifest['files'][fle['path']] = {'path'     : fle['path'],
+                                              'created'  : fle['created'],
+                                              'last_mod' : fle['last_mod'],
+                                              'hash'     : old_state[fle['path']]['hash']}
+            data_store.set_manifest_entry(manifest['files'][fle['path']])
+        data_store.commit()
+
+    return manifest, changes
+
+
+#===============================================================================
+def map_concurrently(func: Callable[[T], R], items: Iterable[T], workers: int) -> Iterator[R]:
+    """ Call func(item) for each item, yielding the results in the order of the items. If
+    workers is greater than one the calls run concurrently on a thread pool, sharing the
+    connection pool of server_connection, and a bounded number of calls run ahead of the
+    result being yielded. Calls which have not started are cancelled if the generator is closed. """
+
+    if workers <= 1:
+        for item in items: yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        todo = iter(items)
+        pending = deque(executor.submit(func, item) for item in islice(todo, workers * 2))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                pending += [executor.submit(func, item) for item in islice(todo, 1)]
+                yield result
+        finally:
+            for future in pending: future.cancel()
+
+
+#===============================================================================
+def pull_file(session_token: str, path: str, dest: str) -> bool:
+    """ Download a file from the server to 'dest', returns false if the server refused.
+    Should the connection fail the download is resumed from the end of the part already
+    written to 'dest', up to 'pull_retries' times, provided the file has not changed
+    on the server in the mean time. If 'compression' is enabled the server may send the
+    file compressed. The file is hashed as it is written, and downloaded again if it does
+    not match the hash of the file on the server. """
+
+    retries   = config.get('pull_retries', 5)
+    file_hash = None
+
+    for attempt in range(retries + 1):
+        request_headers = {
+            'session_token' : session_token,
+            'repository'    : config['repository'],
+            'path'          : path}
+
+        if file_hash is not None and os.path.isfile(dest):
+            request_headers['range']    = 'bytes=' + str(os.path.getsize(dest)) + '-'
+            request_headers['if-range'] = file_hash
+
+        if config.get('compression', True): request_headers['Accept-Encoding'] = 'deflate'
+
+        try:
+            req_result, headers = server_connection.request("pull_file", request_headers, gen = True)
+            if headers['status'] != 'ok': return False
+
+            file_hash = json.loads(headers['file_info_json'])['hash']
+            with open(dest, 'ab' if 'content-range' in headers else 'wb') as f:
+                writer = hashing_writer(f)
+                if 'content-range' in headers:
+                    with open(dest, 'rb') as prefix:
+                        for chunk in iter(lambda: prefix.read(1000 * 1000), b''): writer.update(chunk)
+
+                write = inflater(writer.write) if headers.get('content-encoding') == 'deflate' else writer.write
+                req_result(write)
+                if isinstance(write, inflater): write.finish()
+
+            if writer.hexdigest() == file_hash: return True
+
+        except ValueError: pass # corrupt compressed data
+        except OSError:
+            if attempt == retries: raise
+            time.sleep(min(2 ** attempt, 30)); continue
+
+        # The file was corrupted, download all of it again
+        ignore(os.remove, dest); file_hash = None
+
+    return False
+
+
+#===============================================================================
+def use_delta(f_path: str) -> bool:
+    """ Deltas are only worthwhile for files which are large enough that the signature
+    and the round trip to exchange it are small compared to the file """
+
+    try: return os.path.getsize(f_path) >= config.get('delta_min_size', 1024 * 1024)
+    except OSError: return False
+
+
+#===============================================================================
+def pull_delta(session_token: str, path: str, base_path: str, dest: str) -> Optional[bool]:
+    """ Download a file as a delta against the old version of it at 'base_path', writing the
+    result to 'dest'. Returns false if the server refused, or None if the delta could not
+    be used and the whole file should be downloaded instead. """
+
+    try:
+        with open(base_path, 'rb') as base:
+            sig = signature(base, block_size_for(os.fstat(base.fileno()).st_size))
+
+        req_result, headers = server_connection.request("pull_delta", {
+            'session_token' : session_token,
+            'repository'    : config['repository'],
+            'path'          : path}, sig, gen = True)
+
+        if headers['status'] != 'ok': return False
+
+        # The old version may be changed while this is running, so check the result
+        with open(base_path, 'rb') as base, open(dest, 'wb') as out:
+            writer = hashing_writer(out)
+            p = patcher(base, writer.write)
+            req_result(p.feed); p.finish()
+
+        return True if writer.hexdigest() == json.loads(headers['file_info_json'])['hash'] else None
+
+    except (OSError, ValueError): return None
+
+
+#===============================================================================
+def pull_batch(session_token: str, batch: List[Tuple[str, dict]]) -> Tuple[List[Tuple[dict, str]], List[Tuple[str, dict]]]:
+    """ Download many small files in a single request, 'batch' is a list of files paired
+    with the path each is to be written to. Returns the files which were received, with
+    the path each was written to, and those which were not because the server skipped
+    them as they are large, because the request failed, or because they did not match
+    their hash. """
+
+    dests = {fle['path'] : dest for dest, fle in batch}
+    received: Set[str] = set()
+    current: Dict[str, BinaryIO] = {}
+
+    def open_file(file_info):
+        current['f'] = open(dests[file_info['path']], 'wb')
+        current['writer'] = hashing_writer(current['f'])
+        return current['writer'].write
+
+    def close_file(file_info):
+        current.pop('f').close()
+        if not file_info.get('skipped', False) and current['writer'].hexdigest() == file_info['hash']:
+            received.add(file_info['path'])
+
+    try:
+        req_result, headers = server_connection.request("pull_files", {
+            'session_token' : session_token,
+            'repository'    : config['repository']
+            }, {
+                'files'    : json.dumps([fle['path'] for dest, fle in batch]),
+                'max_size' : str(config.get('pull_batch_max_size', 1024 * 1024))}, gen = True)
+
+        if headers['status'] == 'ok':
+            bundle = unpacker(open_file, close_file)
+            req_result(bundle.feed); bundle.finish()
+
+    except (OSError, ValueError, KeyError): pass
+
+    finally:
+        if 'f' in current: current.pop('f').close()
+
+    return ([(fle, dest) for dest, fle in batch if fle['path'] in received],
+            [(dest, fle) for dest, fle in batch if fle['path'] not in received])
+
+
+#===============================================================================
+def pull_files(session_token: str, files: Iterable[dict]) -> Iterator[Tuple[dict, Optional[str]]]:
+    """ Download files into temporary files, yielding each file with the path it was
+    downloaded to, or None if the download failed. Small files are downloaded in batches
+    of up to 'pull_batch_size', other files individually once the batches are done. Up
+    to 'pull_workers' batches or files are downloaded concurrently. """
+
+    download_dir = cpjoin(config['data_dir'], '.shttpfs', 'downloads')
+    ignore(shutil.rmtree, download_dir); os.makedirs(download_dir)
+    batch_size = config.get('pull_batch_size', 100)
+
+    # Files with an old version large enough to use a delta against are not batched
+    individual: List[Tuple[str, dict]] = []
+    def batches():
+        batch: List[Tuple[str, dict]] = []
+        for i, fle in enumerate(files):
+            dest = cpjoin(download_dir, str(i))
+
+            if use_delta(cpjoin(config['data_dir'], fle['path'])): individual.append((dest, fle)); continue
+            batch.append((dest, fle))
+            if len(batch) >= batch_size: yield batch; batch = []
+        if batch != []: yield batch
+
+    def download(item):
+        dest, fle = item
+
+        # If there is an old version of the file only the changes to it are downloaded
+        pulled = None
+        if use_delta(cpjoin(config['data_dir'], fle['path'])):
+            pulled = pull_delta(session_token, fle['path'], cpjoin(config['data_dir'], fle['path']), dest)
+        if pulled is None: pulled = pull_file(session_token, fle['path'], dest)
+
+        return fle, (dest if pulled else None)
+
+    results = map_concurrently(lambda batch: pull_batch(session_token, batch), batches(), config.get('pull_workers', 1))
+    try:
+        for received, remaining in results:
+            yield from received
+            individual += remaining
+    finally:
+        results.close()
+
+    downloads = map_concurrently(download, individual, config.get('pull_workers', 1))
+    try: yield from downloads
+    finally: downloads.close()
+
+
+#===============================================================================
+def compress_for_upload(f_path: str, offset: int) -> Optional[str]:
+    """ Compress a file from 'offset' onwards into a temporary file and return its path,
+    or None if the file does not compress well """
+
+    with open(f_path, 'rb') as f:
+        f.seek(offset)
+        if not worth_compressing(f): return None
+
+        fd, tmp_path = tempfile.mkstemp(dir = cpjoin(config['data_dir'], '.shttpfs'))
+        with os.fdopen(fd, 'wb') as out: compress_file(f, out)
+
+    if os.path.getsize(tmp_path) < os.path.getsize(f_path) - offset: return tmp_path
+    os.remove(tmp_path); return None
+
+
+#===============================================================================
+def push_file(session_token: str, fle: dict, compress: bool = False) -> bool:
+    """ Upload a file within the current commit, returns false if the server refused it.
+    Should the connection fail the upload is resumed from the amount of the file the
+    server has received, up to 'push_retries' times. If 'compress' is set files which
+    compress well are sent compressed. The server checks the file against fle['hash']. """
+
+    f_path  = cpjoin(config['data_dir'], fle['path'])
+    retries = config.get('push_retries', 5)
+
+    for attempt in range(retries + 1):
+        # Identifies this version of the file, so that a partial upload of a
+        # file which has since changed is never resumed
+        st = os.stat(f_path)
+        upload_id = hashlib.sha256(json.dumps([fle['path'], st.st_ino, st.st_size, st.st_mtime_ns]).encode('utf8')).hexdigest()
+
+        request_headers = {
+            'session_token' : session_token,
+            'repository'    : config['repository'],
+            'upload_id'     : upload_id}
+
+        try:
+            offset = 0
+            if attempt > 0:
+                headers = server_connection.request("upload_status", request_headers)[1]
+                if headers['status'] != 'ok': return False
+                offset = int(headers['offset'])
+
+            request_headers['path']   = fle['path']
+            request_headers['offset'] = str(offset)
+            request_headers['hash']   = fle['hash']
+
+            compressed_path = compress_for_upload(f_path, offset) if compress else None
+            if compressed_path is None:
+                headers = server_connection.send_file("push_file", request_headers, f_path, offset)[1] # Only care about headers
+            else:
+                try:
+                    headers = server_connection.send_file("push_file", dict(request_headers, **{
+                        'content-encoding' : 'deflate'}), compressed_path)[1]
+                finally:
+                    os.remove(compressed_path)
+
+            if headers['status'] == 'ok': return True
+
+            # The server has not yet noticed that the previous attempt failed
+            if headers['msg'] != 'Upload in progress' or attempt == retries: return False
+
+        except OSError:
+            if attempt == retries: raise
+
+        time.sleep(min(2 ** attempt, 30))
+
+    return False
+
+
+#===============================================================================
+def push_known_files(session_token: str, files: List[dict], batch_size: int = 1000) -> Optional[List[dict]]:
+    """ Send the hashes of files which are about to be pushed to the server, which adds those
+    it already has the contents of to the current commit. Returns the files which still need
+    to be uploaded, or None if the server refused. """
+
+    missing: List[dict] = []
+    for i in range(0, len(files), batch_size):
+        batch = files[i : i + batch_size]
+
+        req_result, headers = server_connection.request("push_known_files", {
+            'session_token' : session_token,
+            'repository'    : config['repository']
+            }, {
+                'files' : json.dumps([{'path' : fle['path'], 'hash' : fle['hash']} for fle in batch])})
+
+        if headers['status'] != 'ok': return None
+
+        need = set(json.loads(req_result)['missing'])
+        missing += [fle for fle in batch if fle['path'] in need]
+
+    return missing
+
+
+#===============================================================================
+def push_delta(session_token: str, fle: dict) -> Optional[bool]:
+    """ Upload a changed file as a delta against the version on the server. Returns false
+    if the server refused, or None if the delta could not be used or would not be much
+    smaller than the file, and the whole file should be uploaded instead. """
+
+    f_path = cpjoin(config['data_dir'], fle['path'])
+
+    try:
+        req_result, headers = server_connection.request("signature", {
+            'session_token' : session_token,
+            'repository'    : config['repository'],
+            'path'          : fle['path']})
+
+        if headers['status'] != 'ok': return None
+        base_hash = json.loads(headers['file_info_json'])['hash']
+
+        fd, delta_path = tempfile.mkstemp(dir = cpjoin(config['data_dir'], '.shttpfs'))
+        try:
+            with open(f_path, 'rb') as new, os.fdopen(fd, 'wb') as out:
+                literal_bytes = make_delta(new, req_result, out)
+            if literal_bytes > os.path.getsize(f_path) * 0.8: return None
+
+            headers = server_connection.send_file("push_delta", {
+                'session_token' : session_token,
+                'repository'    : config['repository'],
+                'path'          : fle['path'],
+                'base_hash'     : base_hash,
+                'hash'          : fle['hash'],
+            }, delta_path)[1] # Only care about headers
+
+            return headers['status'] == 'ok'
+        finally:
+            os.remove(delta_path)
+
+    except (OSError, ValueError): return None
+
+
+#===============================================================================
+def push_batch(session_token: str, batch: List[dict]) -> bool:
+    """ Upload many small files in a single request, returns false if it failed """
+
+    try:
+        parts: List[Union[bytes, Tuple[str, int]]] = []
+        for fle in batch:
+            f_path = cpjoin(config['data_dir'], fle['path'])
+            size = os.path.getsize(f_path)
+            parts += [pack_record_header({'path' : fle['path'], 'hash' : fle['hash']}, size), (f_path, size)]
+        parts.append(end_marker)
+
+        headers = server_connection.send_parts("push_files", {
+            'session_token' : session_token,
+            'repository'    : config['repository']}, parts)[1] # Only care about headers
+
+        return headers['status'] == 'ok'
+
+    except OSError: return False
+
+
+#===============================================================================
+def push_files(session_token: str, files: Iterable[dict], compress: bool = False) -> Iterator[Tuple[dict, bool]]:
+    """ Upload files within the current commit, yielding each file with whether it was
+    accepted by the server. Small files are uploaded in batches of up to 'push_batch_size',
+    other files individually once the batches are done, as are the files of any batch
+    which failed. Up to 'push_workers' batches or files are uploaded concurrently. """
+
+    batch_size = config.get('push_batch_size', 100)
+    max_size   = config.get('push_batch_max_size', 1024 * 1024)
+
+    individual: List[dict] = []
+    def batches():
+        batch: List[dict] = []
+        for fle in files:
+            f_path = cpjoin(config['data_dir'], fle['path'])
+            if (fle['status'] == 'changed' and use_delta(f_path)) or os.path.getsize(f_path) > max_size:
+                individual.append(fle); continue
+
+            batch.append(fle)
+            if len(batch) >= batch_size: yield batch; batch = []
+        if batch != []: yield batch
+
+    def upload(fle):
+        # Changed files which are large enough are sent as a delta against the version on the server
+        pushed = None
+        if fle['status'] == 'changed' and use_delta(cpjoin(config['data_dir'], fle['path'])):
+            pushed = push_delta(session_token, fle)
+        if pushed is None: pushed = push_file(session_token, fle, compress)
+
+        return fle, pushed
+
+    results = map_concurrently(lambda batch: (batch, push_batch(session_token, batch)), batches(), config.get('push_workers', 1))
+    try:
+        for batch, pushed in results:
+            if pushed: yield from ((fle, True) for fle in batch)
+            else:      individual += batch
+    finally:
+        results.close()
+
+    uploads = map_concurrently(upload, individual, config.get('push_workers', 1))
+    try: yield from uploads
+    finally: uploads.close()
 
 
 #===============================================================================
-def update(session_token: str, testing = False):
+def start_heartbeat(session_token: str, interval: float = 10) -> Callable[[], None]:
+    """ Periodically extend the commit lock on the server, which would otherwise expire
+    while large files are being transferred. Returns a function which stops the heartbeat,
+    waiting for any heartbeat request in progress to finish. """
+
+    stop = threading.Event()
+    def run():
+        while not stop.wait(interval):
+            try:
+                server_connection.request("heartbeat", {
+                    'session_token' : session_token,
+                    'repository'    : config['repository']})
+            except OSError: pass
+
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+
+    def stop_heartbeat():
+        stop.set(); thread.join()
+    return stop_heartbeat
+
+
+#===============================================================================
+def update(session_token: str, testing = False, dirty_paths: Optional[Set[str]] = None):
     """ Compare changes on the client to changes on the server and update local files
     which have changed on the server. """
 
@@ -112,7 +590,7 @@ def update(session_token: str, testing = False):
     if not all(len(c['4_resolution']) == 1 for c in conflict_resolutions): conflict_resolutions = []
 
     # Send the changes and the revision of the most recent update to the server to find changes
-    manifest, client_changes = find_local_changes()
+    manifest, client_changes = find_local_changes(dirty_paths)
 
     req_result, headers = server_connection.request("find_changed", {
         "session_token"        : session_token,
@@ -136,50 +614,66 @@ def update(session_token: str, testing = False):
         print('Nothing to update')
         return
 
-    # Pull and delete from remote to local
-    if changes['client_pull_files'] != []:
-        # Filter out pull ignore files
-        filtered_pull_files = []
-        for fle in changes['client_pull_files']:
-            if not next((True for flter in config['pull_ignore_filters'] if fnmatch.fnmatch(fle['path'], flter)), False):
-                filtered_pull_files.append(fle)
-            else: # log ignored items to give the opportunity to pull them in the future
-                with open(cpjoin(working_copy_base_path, '.shttpfs', 'pull_ignored_items'), 'a') as pull_ignore_log:
-                    pull_ignore_log.write(json.dumps((result['head'], fle)))
-                    pull_ignore_log.flush()
-
-        if filtered_pull_files != []:
-            print('Pulling files from server...')
-
-        #----------
-        for fle in filtered_pull_files:
-            print('Pulling file: ' + fle['path'])
-
-            req_result, headers = server_connection.request("pull_file", {
-                'session_token' : session_token,
-                'repository'    : config['repository'],
-                'path'          : fle['path']}, gen = True)
-
-            if headers['status'] != 'ok':
-                raise SystemExit('Failed to pull file')
-            else:
-                make_dirs_if_dont_exist(data_store.get_full_file_path(cpjoin(*fle['path'].split('/')[:-1]) + '/'))
-                data_store.fs_put(fle['path'], req_result)
-
-    # Files which have been deleted on server and need deleting on client
-    if changes['to_delete_on_client'] != []:
-        print('Removing files deleted on the server...')
-
-        for fle in changes['to_delete_on_client']:
-            print('Deleting file: ' + fle['path'])
-
-            try: data_store.fs_delete(fle['path'])
-            except OSError: print('Warning: remote deleted file does not exist locally.')
-
-            # Delete the folder if it is now empty
-            try: os.removedirs(os.path.dirname(data_store.get_full_file_path(fle['path'])))
-            except OSError as e:
-                if e.errno not in [errno.ENOTEMPTY, errno.ENOENT]: raise
+    # Pull and delete from remote to local. These are grouped into journaled transactions of
+    # up to 'update_batch_size' files, instead of one transaction per file.
+    pull_failed = False; emptied_dirs = []
+    data_store.begin_batch(config.get('update_batch_size', 1000))
+    try:
+        if changes['client_pull_files'] != []:
+            # Filter out pull ignore files
+            filtered_pull_files = []
+            for fle in changes['client_pull_files']:
+                # Files pulled before an earlier update was interrupted are already up to date
+                local = manifest['files'].get(fle['path'], {})
+                if local.get('hash') is not None and local.get('hash') == fle.get('hash'): continue
+
+                if not pull_ignore_filter.match(fle['path']):
+                    filtered_pull_files.append(fle)
+                else: # log ignored items to give the opportunity to pull them in the future
+                    with open(cpjoin(working_copy_base_path, '.shttpfs', 'pull_ignored_items'), 'a') as pull_ignore_log:
+                        pull_ignore_log.write(json.dumps((result['head'], fle)))
+                        pull_ignore_log.flush()
+
+            if filtered_pull_files != []:
+                print('Pulling files from server...')
+
+            #----------
+            downloads = pull_files(session_token, filtered_pull_files)
+            for fle, tmp_path in downloads:
+                print('Pulling file: ' + fle['path'])
+
+                if tmp_path is None:
+                    pull_failed = True; break
+                else:
+                    make_dirs_if_dont_exist(data_store.get_full_file_path(cpjoin(*fle['path'].split('/')[:-1]) + '/'))
+                    data_store.fs_put(fle['path'], lambda dest, src = tmp_path: shutil.move(src, dest), fle.get('hash'))
+            downloads.close()
+
+        # Files which have been deleted on server and need deleting on client
+        if changes['to_delete_on_client'] != [] and not pull_failed:
+            print('Removing files deleted on the server...')
+
+            for fle in changes['to_delete_on_client']:
+                print('Deleting file: ' + fle['path'])
+
+                try: data_store.fs_delete(fle['path'])
+                except OSError: print('Warning: remote deleted file does not exist locally.')
+                emptied_dirs.append(os.path.dirname(data_store.get_full_file_path(fle['path'])))
+
+        # Files pulled before a failure are kept
+        data_store.end_batch()
+    except:
+        # An operation which failed has already been rolled back, the files pulled before it are kept
+        data_store.end_batch(); raise
+
+    if pull_failed: raise SystemExit('Failed to pull file')
+
+    # Delete folders which are now empty. This must wait until the deletes are committed,
+    # as rolling them back moves the files back into these folders.
+    for dir_path in emptied_dirs:
+        try: os.removedirs(dir_path)
+        except OSError as e:
+            if e.errno not in [errno.ENOTEMPTY, errno.ENOENT]: raise
 
     # Files which are in conflict
     if changes['conflict_files'] != []:
@@ -213,18 +707,10 @@ def update(session_token: str, testing = False):
                 for fle in server_versions:
                     print('Pulling file: ' + fle['path'])
 
-                    result, headers = server_connection.request("pull_file", {
-                        'session_token' : session_token,
-                        'repository'    : config['repository'],
-                        'path'          : fle['path']}, gen = True)
-
-                    if headers['status'] != 'ok':
+                    make_dirs_if_dont_exist(cpjoin(conflict_comparison_file_dest, *fle['path'].split('/')[:-1]) + '/')
+                    if not pull_file(session_token, fle['path'], cpjoin(conflict_comparison_file_dest, fle['path'])):
                         errors.append(fle['path'])
 
-                    else:
-                        make_dirs_if_dont_exist(cpjoin(conflict_comparison_file_dest, *fle['path'].split('/')[:-1]) + '/')
-                        result(cpjoin(conflict_comparison_file_dest, fle['path']))
-
                 print('Server versions of conflicting files written to .shttpfs/conflict_files\n')
 
             pprint(errors)
@@ -238,9 +724,7 @@ def update(session_token: str, testing = False):
     # Update the latest revision in the manifest only if there are no conflicts
     else:
         data_store.begin()
-        manifest = data_store.read_local_manifest()
-        manifest['have_revision'] = result['head']
-        data_store.write_local_manifest(manifest)
+        data_store.set_have_revision(result['head'])
         data_store.commit()
 
         #delete the conflicts resolution file and recursively delete any conflict files downloaded for comparison
@@ -254,8 +738,8 @@ def update(session_token: str, testing = False):
 
 
 #===============================================================================
-def commit(session_token: str, commit_message = ''):
-    manifest, client_changes = find_local_changes()
+def commit(session_token: str, commit_message = '', dirty_paths: Optional[Set[str]] = None):
+    manifest, client_changes = find_local_changes(dirty_paths)
 
     changes = {'to_delete_on_server' : [], 'client_push_files' : []} # type: ignore
     for change in list(client_changes.values()):
@@ -274,38 +758,56 @@ def commit(session_token: str, commit_message = ''):
 
     if headers['status'] != 'ok': raise SystemExit(headers['msg'])
 
+    # Files are only sent compressed if the server says it can accept them
+    compress = config.get('compression', True) and 'deflate' in headers.get('accept-encoding', '')
+
     #======================
     errors: List[str] = []
     changes_made: List[Dict[str, str]] = []
 
-    # Files which have been deleted on the client and need deleting on server
-    if changes['to_delete_on_server'] != []:
-        for fle in changes['to_delete_on_server']:
-            print('Deleting: ' + fle['path'])
+    stop_heartbeat = start_heartbeat(session_token)
+    try:
+        # Files which have been deleted on the client and need deleting on server
+        if changes['to_delete_on_server'] != []:
+            for fle in changes['to_delete_on_server']:
+                print('Deleting: ' + fle['path'])
 
-        headers = server_connection.request("delete_files", {
-            'session_token' : session_token,
-            'repository'    : config['repository']
-            }, {
-                'files'         : json.dumps(changes['to_delete_on_server'])})[1] # Only care about headers
+            headers = server_connection.request("delete_files", {
+                'session_token' : session_token,
+                'repository'    : config['repository']
+                }, {
+                    'files'         : json.dumps(changes['to_delete_on_server'])})[1] # Only care about headers
 
-        if headers['status'] == 'ok': changes_made += [{'status' : 'deleted', 'path' : fle['path']} for fle in changes['to_delete_on_server']]
-        else:                         errors.append('Delete failed')
+            if headers['status'] == 'ok': changes_made += [{'status' : 'deleted', 'path' : fle['path']} for fle in changes['to_delete_on_server']]
+            else:                         errors.append('Delete failed')
 
 
-    # Push files
-    if changes['client_push_files'] != [] and errors == []:
-        for fle in changes['client_push_files']:
-            print('Sending: ' + fle['path'])
+        # Push files, only uploading those the server does not already have the contents of
+        if changes['client_push_files'] != [] and errors == []:
+            # The hash of each file is sent with it, so that the server can check what it receives
+            for fle in changes['client_push_files']: fle['hash'] = file_hashes.get(cpjoin(config['data_dir'], fle['path']))
+            file_hashes.save()
 
-            headers = server_connection.send_file("push_file", {
-                'session_token' : session_token,
-                'repository'    : config['repository'],
-                'path'          : fle['path'],
-            }, cpjoin(config['data_dir'], fle['path']))[1] # Only care about headers
+            to_push = push_known_files(session_token, changes['client_push_files'])
+
+            if to_push is None: errors.append('Push failed')
+            else:
+                need = {fle['path'] for fle in to_push}
+                for fle in changes['client_push_files']:
+                    if fle['path'] not in need:
+                        print('Already on server: ' + fle['path'])
+                        changes_made.append({'status' : 'new/changed', 'path' : fle['path'], 'hash' : fle['hash']})
+
+                uploads = push_files(session_token, to_push, compress)
+                for fle, accepted in uploads:
+                    print('Sent: ' + fle['path'])
+
+                    if accepted: changes_made.append({'status' : 'new/changed', 'path' : fle['path'], 'hash' : fle['hash']})
+                    else:        errors.append(fle['path']); break
+                uploads.close()
 
-            if headers['status'] == 'ok': changes_made.append({'status' : 'new/changed', 'path' : fle['path']})
-            else:                         errors.append(fle['path']); break
+    finally:
+        stop_heartbeat() # a heartbeat in progress holds the repository lock, which would cause the commit to be refused
 
     # commit and release the lock. If errors occurred roll back and release the lock
     mode = 'commit' if errors == [] else 'abort'
@@ -325,19 +827,23 @@ def commit(session_token: str, commit_message = ''):
 
         # Update the manifest
         data_store.begin()
-        manifest = data_store.read_local_manifest()
-        manifest['have_revision'] = headers['head']
+        data_store.set_have_revision(headers['head'])
 
         for change in changes_made:
             if change['status'] == 'deleted':
-                del manifest['files'][change['path']]
+                data_store.remove_manifest_entry(change['path'])
             elif change['status'] == 'new/changed':
-                manifest['files'][change['path']] = get_single_file_info(cpjoin(config['data_dir'], change['path']), change['path'])
+                f_path = cpjoin(config['data_dir'], change['path'])
+                file_info = get_single_file_info(f_path, change['path'])
+                file_info['hash'] = change['hash'] # type: ignore
+                data_store.set_manifest_entry(file_info)
 
-        data_store.write_local_manifest(manifest)
         data_store.commit()
+        file_hashes.save()
         return headers['head']
 
+    else: raise SystemExit('Commit failed: ' + headers['msg'])
+
 #===============================================================================
 def get_versions(session_token: str):
     req_result, headers = server_connection.request("list_versions", {
@@ -464,11 +970,30 @@ def run():
     #----------------------------
     elif args [0] == 'autosync':
         init(); session_token: str = None
+
+        # On Linux the working copy is watched with inotify so that each sync only needs to look
+        # at paths which have changed, and happens shortly after a change instead of once a minute.
+        watcher: Optional[tree_watcher] = None
+        try: watcher = tree_watcher(config['data_dir'], ignore_filter.match_dir)
+        except OSError as e: print('Could not watch working copy, falling back to periodic scans: ' + str(e))
+
         while True:
             session_token = authenticate(session_token)
-            update(session_token)
-            commit(session_token)
-            time.sleep(60)
+
+            if watcher is None:
+                update(session_token)
+                commit(session_token)
+                time.sleep(60)
+                continue
+
+            dirty_paths = watcher.take_dirty()
+            update(session_token, dirty_paths = dirty_paths)
+            commit(session_token, dirty_paths = dirty_paths)
+
+            # Anything which still differs from the manifest, such as files in conflict or which
+            # failed to upload, must be looked at again on the next cycle.
+            watcher.restore_dirty(set(find_local_changes(dirty_paths)[1].keys()))
+            watcher.wait(60)
 
     #----------------------------
     elif args [0] == 'list_versions':
@@ -1,29 +1,83 @@
-import os, json, urllib.parse
-from typing import Dict
+import os, json, urllib.parse, threading
+from typing import Dict, List, Tuple, Callable, Union, Any
 from shttpfs3.http_client import HTTPClient
 
+# Requests which do not change anything on the server, so can safely be sent
+# again if the connection fails before the responce has been received
+idempotent_requests = ['find_changed', 'pull_file', 'list_versions', 'list_changes', 'list_files',
+                       'upload_status', 'heartbeat', 'signature', 'pull_delta', 'pull_files']
+
+############################################################################################
+def parse_server_url(server_base_url: str) -> Tuple[str, int, bool]:
+    """ Split a server URL into the host name, port, and if TLS is used """
+
+    res = urllib.parse.urlparse(server_base_url)
+    scheme = res.scheme.lower()
+    port   = res.port
+
+    if scheme not in ['http', 'https']: raise SystemExit('unknown protocol: ' + scheme)
+
+    if port is None: port = 443 if scheme == 'https' else 80
+
+    return res.hostname, port, (scheme == 'https')
+
 class client_http_request:
+    """ Sends requests to a server, keeping a pool of persistent connections. Each request
+    takes an idle connection from the pool, or opens a new one, and returns it once the
+    responce has been read, so this may be used from several threads at once. Connections
+    closed by the server while idle are discarded before use, and idempotent requests are
+    retried once on a new connection if the connection fails. """
+
+############################################################################################
+    def __init__(self, server_base_url: str, max_idle: int = 8):
+        "Configure the servers base URL, connections are opened when first needed"
+
+        self.server_base_url, self.port, self.tls = parse_server_url(server_base_url)
+        self.max_idle = max_idle
+        self.idle: List[HTTPClient] = []
+        self.lock     = threading.Lock()
+
+############################################################################################
+    def connect(self) -> HTTPClient:
+        c = HTTPClient()
+        c.connect( self.server_base_url,
+                   port = self.port,
+                   tls  = self.tls)
+        return c
+
 ############################################################################################
-    def __init__(self, server_base_url: str):
-        "Configure the servers base URL"
+    def acquire(self) -> HTTPClient:
+        """ Take an idle connection from the pool, discarding any which the server
+        has closed, or open a new one if there are none """
 
-        res = urllib.parse.urlparse(server_base_url)
-        scheme               = res.scheme.lower()
-        server_base_url      = res.hostname
-        self.server_base_url = server_base_url
-        port                 = res.port
+        while True:
+            with self.lock:
+                if self.idle == []: break
+                conn = self.idle.pop()
 
-        if scheme not in ['http', 'https']: raise SystemExit('unknown protocol: ' + scheme)
+            if not conn.is_stale(): return conn
+            conn.close()
 
-        if port is None: port = 443 if scheme == 'https' else 80
+        return self.connect()
 
-        self.c = HTTPClient()
-        self.c.connect( server_base_url,
-                        port = port,
-                        tls  = (scheme == 'https'))
+############################################################################################
+    def release(self, conn: HTTPClient, headers: Dict[str, str]):
+        """ Return a connection to the pool, the responce must have been read completely """
+
+        if headers.get('connection', '').lower() != 'close':
+            with self.lock:
+                if len(self.idle) < self.max_idle: self.idle.append(conn); return
+        conn.close()
 
 ############################################################################################
-    def begin(self, url: str, body_length: int, add_headers: Dict[str, str], content_type: str):
+    def close(self):
+        """ Close all idle connections """
+
+        with self.lock: idle, self.idle = self.idle, []
+        for conn in idle: conn.close()
+
+############################################################################################
+    def begin(self, conn: HTTPClient, url: str, body_length: int, add_headers: Dict[str, str], content_type: str):
         headers = {
             'Accept-Encoding': 'identity',
             'Host'           : self.server_base_url,
@@ -34,42 +88,98 @@ class client_http_request:
         for k, v in add_headers.items(): headers[k] = v
 
         # ==
-        self.c.send_headers('/' + url, headers)
-        return self.c
+        conn.send_headers('/' + url, headers)
+
+############################################################################################
+    def send_request(self, url: str, headers: Dict[str, str], content_type: str, body_length: int,
+                     send_body: Callable[[HTTPClient], None], gen: bool = False) -> Tuple[HTTPClient, Dict[str, str], Any]:
+        """ Send a request and read the responce. Unless gen is set the body is read and the
+        connection returned to the pool, otherwise the body reader is returned and the caller
+        must release the connection once it has read it. The body of a responce whose status
+        is not ok is always read, as callers do not read it. """
+
+        retry = url in idempotent_requests
+        while True:
+            conn = self.acquire()
+            try:
+                self.begin(conn, url, body_length, headers, content_type)
+                send_body(conn)
+                parsed_preamble, body = conn.read_responce()
+                read_now = not gen or parsed_preamble['headers'].get('status') != 'ok'
+                if read_now: body = body.read_all()
+                break
+
+            except OSError:
+                conn.close()
+                if not retry: raise
+                retry = False
+
+            except:
+                conn.close(); raise
+
+        if read_now: self.release(conn, parsed_preamble['headers'])
+        return conn, parsed_preamble['headers'], body
 
 ############################################################################################
     def request(self, url, headers, data = None, gen = False):
-        jsn = json.dumps(data) if data is not None else '{}'
+        # Bytes are sent as they are, anything else as JSON
+        if isinstance(data, bytes): jsn, content_type = data, 'application/octet-stream'
+        else:                       jsn, content_type = (json.dumps(data) if data is not None else '{}').encode('utf8'), 'application/json'
 
-        conn = self.begin(url, len(jsn), headers, content_type = 'application/json')
-        conn.send(jsn.encode('utf8'))
-        parsed_preamble, body = conn.read_responce()
+        conn, responce_headers, body = self.send_request(url, headers, content_type, len(jsn),
+                                                         lambda conn: conn.send(jsn), gen)
 
         if gen is False:
-            return body.read_all(), parsed_preamble['headers']
+            return body, responce_headers
 
         else:
-            def writer(path):
-                with open(path, 'wb') as f:
-                    while True:
-                        chunk = body.read(1000 * 1000)
-                        if chunk is None: break
-                        f.write(chunk)
+            def writer(dest, append = False):
+                """ Write the body to the file at path 'dest', or pass it to 'dest' in pieces if it is callable """
+                if isinstance(body, (bytes, bytearray)): # already read, and the connection released
+                    if callable(dest): dest(body)
+                    else:
+                        with open(dest, 'ab' if append else 'wb') as f: f.write(body)
+                    return
+
+                try:
+                    if callable(dest): body.copy_to(dest)
+                    else:
+                        with open(dest, 'ab' if append else 'wb') as f: body.copy_to(f.write)
+                except:
+                    conn.close(); raise
+                self.release(conn, responce_headers)
+
+            return writer, responce_headers
 
-            return writer, parsed_preamble['headers']
+############################################################################################
+    def send_file(self, url, headers, file_path, offset = 0):
+        """ Send the contents of a file from 'offset' onwards as the request body """
+
+        size = os.stat(file_path).st_size - offset
+
+        _, responce_headers, body = self.send_request(url, headers, 'application/octet-stream', size,
+                                                      lambda conn: send_file_range(conn, file_path, offset, size))
+        return body, responce_headers
 
 ############################################################################################
-    def send_file(self, url, headers, file_path):
-        size = os.stat(file_path).st_size
+    def send_parts(self, url, headers, parts: List[Union[bytes, Tuple[str, int]]]):
+        """ Send a body made of parts one after another, each is either bytes, or the path
+        and length of a file of which that many bytes are sent from the start """
 
-        conn = self.begin(url, size, headers, content_type = 'application/octet-stream')
+        size = sum(len(part) if isinstance(part, bytes) else part[1] for part in parts)
 
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(1000 * 1000)
-                if chunk == b'': break
-                conn.send(chunk)
+        def send_body(conn):
+            for part in parts:
+                if isinstance(part, bytes): conn.send(part)
+                else:                       send_file_range(conn, part[0], 0, part[1])
+
+        _, responce_headers, body = self.send_request(url, headers, 'application/octet-stream', size, send_body)
+        return body, responce_headers
+
+############################################################################################
+def send_file_range(conn: HTTPClient, file_path: str, offset: int, length: int):
+    """ Send 'length' bytes of a file starting from 'offset' """
 
-        parsed_preamble, body = conn.read_responce()
-        return body.read_all(), parsed_preamble['headers']
-        
\ No newline at end of file
+    with open(file_path, 'rb') as f:
+        if conn.send_file(f, offset, length) < length:
+            raise IOError('File was truncated while being sent: ' + file_path)
@@ -1,5 +1,6 @@
-import os.path, hashlib, errno, copy
-from typing import List, Dict, Any, cast
+import os, os.path, hashlib, errno, copy, fnmatch, re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Set, Tuple, Optional, Any, BinaryIO, cast
 from typing_extensions import TypedDict
 from termcolor import colored
 
@@ -98,17 +99,114 @@ def hash_file(file_path: str, block_size: int = 65536) -> str:
     return sha.hexdigest()
 
 ############################################################################################
-def get_file_list(path: str) -> List[fileDetails]:
-    """ Recursively lists all files in a file system below 'path'. """
-    f_list = []
-    def recur_dir(path, newpath = os.path.sep):
-        files = os.listdir(path)
-        for fle in files:
-            f_path = cpjoin(path, fle)
-            if os.path.isdir(f_path): recur_dir(f_path, cpjoin(newpath, fle))
-            elif os.path.isfile(f_path): f_list.append(get_single_file_info(f_path, cpjoin(newpath, fle)))
+class hashing_writer:
+    """ Writes to a file while hashing the data written, so that the sha256 hash of
+    a file which is being received is known without reading it back afterwards """
 
-    recur_dir(path)
+    def __init__(self, f: BinaryIO):
+        self.f   = f
+        self.sha = hashlib.sha256()
+
+    def update(self, data: bytes):
+        """ Hash data which is already in the file """
+        self.sha.update(data)
+
+    def write(self, data: bytes):
+        self.sha.update(data); self.f.write(data)
+
+    def hexdigest(self) -> str:
+        return self.sha.hexdigest()
+
+############################################################################################
+class path_filter:
+    """ A list of UNIX wildcard filters compiled into a single regular expression, so that
+    checking a path does not require trying every filter in turn. """
+
+    def __init__(self, filters: List[str]):
+        filters = [flter for flter in filters if flter != '']
+
+        # As a trailing wildcard also matches '/', if a filter ending in one matches a directory
+        # path followed by a slash it also matches every path below that directory, allowing
+        # the whole directory to be skipped.
+        self.file_re = re.compile('|'.join(fnmatch.translate(flter) for flter in filters)) if filters else None
+        dir_filters  = [flter for flter in filters if flter.endswith('*')]
+        self.dir_re  = re.compile('|'.join(fnmatch.translate(flter) for flter in dir_filters)) if dir_filters else None
+
+    def match(self, path: str) -> bool:
+        """ Does any filter match a file path """
+        return self.file_re is not None and self.file_re.match(path) is not None
+
+    def match_dir(self, path: str) -> bool:
+        """ Does any filter match every path below a directory """
+        return self.dir_re is not None and self.dir_re.match(path + '/') is not None
+
+############################################################################################
+def scan_dir(f_path: str, int_path: str, flter: Optional[path_filter] = None) -> Tuple[List[fileDetails], List[Tuple[str, str]]]:
+    """ Lists a single directory, returning the details of the files within it and
+    the disk and internal paths of the directories within it. Uses the stat results
+    cached by scandir so that each file costs one stat call, and each directory none.
+    Files and directories matched by 'flter' are skipped. """
+    files = []; dirs = []
+    with os.scandir(f_path) as it:
+        for entry in it:
+            e_path = cpjoin(int_path, entry.name)
+            if entry.is_dir():
+                if flter is None or not flter.match_dir(e_path): dirs.append((entry.path, e_path))
+            elif entry.is_file():
+                if flter is not None and flter.match(e_path): continue
+                st = entry.stat()
+                files.append({'path'     : force_unicode(e_path),
+                              'created'  : st.st_ctime,
+                              'last_mod' : st.st_mtime})
+    return files, dirs
+
+############################################################################################
+def get_file_list(path: str, workers: int = 1, flter: Optional[path_filter] = None, int_path: str = os.path.sep) -> List[fileDetails]:
+    """ Recursively lists all files in a file system below 'path', which has the internal
+    path 'int_path'. If workers is greater than one sub directories are scanned concurrently
+    on a thread pool, which helps on network and other high latency file systems. Files
+    and directories matched by 'flter' are skipped without being looked at. """
+    f_list: List[fileDetails] = []
+
+    if workers <= 1:
+        pending = [(path, int_path)]
+        while pending:
+            files, dirs = scan_dir(*pending.pop(), flter)
+            f_list += files; pending += reversed(dirs)
+        return f_list
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        running = {executor.submit(scan_dir, path, int_path, flter)}
+        while running:
+            done, running = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                f_list += files
+                running |= {executor.submit(scan_dir, d_path, d_int_path, flter) for d_path, d_int_path in dirs}
+    return f_list
+
+############################################################################################
+def get_dirty_file_list(path: str, dirty_paths: Set[str], old_state: Dict[str, fileDetails],
+                        workers: int = 1, flter: Optional[path_filter] = None) -> List[fileDetails]:
+    """ Lists the files below 'path' given the internal paths of files and directories
+    which are known to have changed. Anything which is not within one of these is taken
+    from 'old_state' instead of being looked at on disk. """
+
+    def have_dirty_parent(int_path):
+        split = int_path.split('/')
+        return any('/'.join(split[:i]) in dirty_paths for i in range(2, len(split)))
+
+    f_list = [fle for fle in old_state.values()
+              if fle['path'] not in dirty_paths and not have_dirty_parent(fle['path'])
+              and (flter is None or not flter.match(fle['path']))]
+
+    for int_path in dirty_paths:
+        if have_dirty_parent(int_path): continue
+        f_path = cpjoin(path, int_path)
+        if os.path.isdir(f_path):
+            if flter is None or not flter.match_dir(int_path): f_list += get_file_list(f_path, workers, flter, int_path)
+        elif os.path.isfile(f_path):
+            if flter is None or not flter.match(int_path): f_list.append(get_single_file_info(f_path, int_path))
     return f_list
 
 ############################################################################################
@@ -0,0 +1,54 @@
+import zlib
+from typing import BinaryIO, Callable, Optional
+
+#===============================================================================
+# Optional deflate compression of file transfers. Request and responce bodies must
+# have a known length, so data is compressed into a temporary file before being
+# sent, and decompressed as it is received.
+#===============================================================================
+chunk_size = 1000 * 1000
+
+#===============================================================================
+def worth_compressing(f: BinaryIO, sample_size: int = 64 * 1024) -> bool:
+    """ Compress a sample from the current position of a file to see if compressing it
+    is worthwhile. Data which is already compressed, such as JPEG, PNG or MP4, does not
+    get any smaller and is sent as it is. The position of the file is not changed. """
+
+    pos = f.tell(); sample = f.read(sample_size); f.seek(pos)
+    if len(sample) < 1024: return False
+    return len(zlib.compress(sample, 1)) < len(sample) * 0.9
+
+#===============================================================================
+def compress_file(src: BinaryIO, dest: BinaryIO, length: Optional[int] = None, level: int = 1) -> None:
+    """ Compress up to length bytes from the current position of src into dest. A low
+    compression level is used by default so that it is not slower than the network. """
+
+    compressor = zlib.compressobj(level)
+    while length is None or length > 0:
+        data = src.read(chunk_size if length is None else min(chunk_size, length))
+        if data == b'': break
+        if length is not None: length -= len(data)
+        dest.write(compressor.compress(data))
+    dest.write(compressor.flush())
+
+#===============================================================================
+class inflater:
+    """ Wraps a write function, decompressing deflate data which is passed to it """
+
+    def __init__(self, write: Callable[[bytes], None]):
+        self.write = write
+        self.decompressor = zlib.decompressobj()
+
+    def __call__(self, data: bytes):
+        # Output is limited so that highly compressed data does not use lots of memory
+        try:
+            while data != b'':
+                self.write(self.decompressor.decompress(data, chunk_size))
+                data = self.decompressor.unconsumed_tail
+        except zlib.error as e: raise ValueError(str(e))
+
+    def finish(self):
+        """ Check that all of the compressed data has been received """
+
+        self.write(self.decompressor.flush())
+        if not self.decompressor.eof: raise ValueError('Compressed data is incomplete')
@@ -0,0 +1,227 @@
+import struct, zlib, hashlib
+from typing import BinaryIO, Callable, Dict, Optional, Tuple
+
+#===============================================================================
+# An rsync style delta encoding. The receiver of a file sends a signature of the
+# version it has, the weak (adler32) and strong (truncated sha256) checksums of
+# each block of it. The sender finds blocks of the new version which match the
+# signature, and sends a delta which copies those from the old version and
+# contains the rest of the data literally.
+#
+# signature: 'SHSG', block size, then (weak, strong) for each block
+# delta:     'SHDL', block size, then a sequence of operations
+#            'C' first block, count   copy blocks from the old version
+#            'L' length, data          literal data
+#            'E'                       end of the delta
+#===============================================================================
+sig_header   = struct.Struct('>4sI')
+sig_entry    = struct.Struct('>I16s')
+delta_header = struct.Struct('>4sI')
+copy_op      = struct.Struct('>cQQ')
+literal_op   = struct.Struct('>cI')
+
+max_literal = 1000 * 1000
+
+#===============================================================================
+def block_size_for(file_size: int) -> int:
+    """ Choose a block size for a file, as rsync does this is about the square root of
+    the file size, so that the signature grows slowly with the size of the file """
+
+    return min(max(int(file_size ** 0.5) // 8 * 8, 2048), 128 * 1024)
+
+#===============================================================================
+def strong_hash(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:16]
+
+#===============================================================================
+def signature(f: BinaryIO, block_size: int) -> bytes:
+    """ Generate the signature of a file """
+
+    res = [sig_header.pack(b'SHSG', block_size)]
+    while True:
+        block = f.read(block_size)
+        if block == b'': break
+        res.append(sig_entry.pack(zlib.adler32(block), strong_hash(block)))
+    return b''.join(res)
+
+#===============================================================================
+def parse_signature(sig: bytes) -> Tuple[int, Dict[int, Dict[bytes, int]]]:
+    """ Returns the block size and an index of the blocks by weak then strong checksum """
+
+    magic, block_size = sig_header.unpack_from(sig)
+    if magic != b'SHSG' or block_size == 0 or (len(sig) - sig_header.size) % sig_entry.size != 0:
+        raise ValueError('Invalid signature')
+
+    index: Dict[int, Dict[bytes, int]] = {}
+    for i, (weak, strong) in enumerate(sig_entry.iter_unpack(sig[sig_header.size:])):
+        index.setdefault(weak, {}).setdefault(strong, i)
+    return block_size, index
+
+#===============================================================================
+class delta_writer:
+    """ Writes delta operations, merging runs of consecutive copied blocks """
+
+    def __init__(self, out: BinaryIO, block_size: int):
+        self.out = out
+        self.copy_start = self.copy_count = 0
+        self.out.write(delta_header.pack(b'SHDL', block_size))
+
+    def flush_copy(self):
+        if self.copy_count > 0: self.out.write(copy_op.pack(b'C', self.copy_start, self.copy_count))
+        self.copy_count = 0
+
+    def copy(self, block: int):
+        if self.copy_count > 0 and block == self.copy_start + self.copy_count: self.copy_count += 1; return
+        self.flush_copy()
+        self.copy_start, self.copy_count = block, 1
+
+    def literal(self, data: bytes):
+        if len(data) == 0: return
+        self.flush_copy()
+        for i in range(0, len(data), max_literal):
+            chunk = data[i : i + max_literal]
+            self.out.write(literal_op.pack(b'L', len(chunk)) + chunk)
+
+    def close(self):
+        self.flush_copy()
+        self.out.write(b'E')
+
+#===============================================================================
+def make_delta(new: BinaryIO, sig: bytes, out: BinaryIO, read_size: int = 4 * 1000 * 1000) -> int:
+    """ Write a delta which turns the file the signature is of into 'new', returning the
+    number of bytes of literal data in it.
+
+    Blocks are first checked at the current position, which finds unchanged data quickly.
+    Otherwise the checksum is rolled one byte at a time through the next block to find data
+    which has moved. This is slow in python, so if several searches in a row find nothing the
+    data is assumed to be new and rolling searches are only made occasionally until a
+    block matches again. """
+
+    block_size, index = parse_signature(sig)
+    writer = delta_writer(out, block_size)
+
+    def find(window: bytes, weak: int) -> Optional[int]:
+        candidates = index.get(weak)
+        if candidates is None: return None
+        return candidates.get(strong_hash(window))
+
+    buf = bytearray(); eof = False
+    pos = lit = 0   # current position, and start of pending literal data, within buf
+    literal_bytes = 0
+    misses = 0; skipped = 0
+
+    while True:
+        # Keep enough data buffered for a rolling search through the next block
+        while not eof and len(buf) - pos < 2 * block_size:
+            data = new.read(read_size)
+            if data == b'': eof = True
+            buf += data
+
+        avail = len(buf) - pos
+        if avail == 0: break
+
+        n = min(block_size, avail)
+        window = bytes(buf[pos : pos + n])
+        weak   = zlib.adler32(window)
+        match  = find(window, weak)
+
+        # Search for a block starting within this one
+        shift = 0
+        if match is None and avail > block_size and (misses < 4 or skipped >= 16):
+            skipped = 0
+            a = weak & 0xffff; b = weak >> 16
+            for k in range(1, min(block_size, avail - block_size + 1)):
+                out_byte = buf[pos + k - 1]; in_byte = buf[pos + k - 1 + block_size]
+                a = (a - out_byte + in_byte) % 65521
+                b = (b - block_size * out_byte + a - 1) % 65521
+                if ((b << 16) | a) in index:
+                    window = bytes(buf[pos + k : pos + k + block_size])
+                    match = find(window, (b << 16) | a)
+                    if match is not None: shift = k; break
+
+            misses = 0 if match is not None else misses + 1
+        elif match is None:
+            skipped += 1
+
+        if match is not None:
+            literal_bytes += pos + shift - lit
+            writer.literal(bytes(buf[lit : pos + shift]))
+            writer.copy(match)
+            pos += shift + len(window); lit = pos
+            if shift == 0: misses = 0
+        else:
+            pos += n
+
+        # Drop data which has been written from the buffer
+        if pos - lit >= max_literal:
+            literal_bytes += pos - lit
+            writer.literal(bytes(buf[lit : pos])); lit = pos
+        if lit >= read_size:
+            del buf[:lit]; pos -= lit; lit = 0
+
+    literal_bytes += pos - lit
+    writer.literal(bytes(buf[lit : pos]))
+    writer.close()
+    return literal_bytes
+
+#===============================================================================
+class patcher:
+    """ Applies a delta to the old version of a file, the delta can be fed in pieces
+    as it is received and the new version is passed to 'write' as it is produced """
+
+    def __init__(self, base: BinaryIO, write: Callable[[bytes], None]):
+        self.base       = base
+        self.write      = write
+        self.buf        = bytearray()
+        self.block_size = None
+        self.literal    = 0
+        self.done       = False
+
+    def copy(self, start: int, count: int):
+        self.base.seek(start * self.block_size)
+        remaining = count * self.block_size
+        while remaining > 0:
+            data = self.base.read(min(remaining, max_literal))
+            if data == b'': break # the last block may be short
+            self.write(data); remaining -= len(data)
+
+    def feed(self, data: bytes):
+        self.buf += data
+        while True:
+            if self.literal > 0:
+                n = min(self.literal, len(self.buf))
+                if n == 0: return
+                self.write(bytes(self.buf[:n])); del self.buf[:n]
+                self.literal -= n
+
+            elif self.done:
+                if len(self.buf) > 0: raise ValueError('Data after the end of the delta')
+                return
+
+            elif self.block_size is None:
+                if len(self.buf) < delta_header.size: return
+                magic, self.block_size = delta_header.unpack_from(self.buf)
+                if magic != b'SHDL' or self.block_size == 0: raise ValueError('Invalid delta')
+                del self.buf[:delta_header.size]
+
+            elif len(self.buf) == 0: return
+
+            elif self.buf[0:1] == b'C':
+                if len(self.buf) < copy_op.size: return
+                _, start, count = copy_op.unpack_from(self.buf)
+                del self.buf[:copy_op.size]
+                self.copy(start, count)
+
+            elif self.buf[0:1] == b'L':
+                if len(self.buf) < literal_op.size: return
+                _, self.literal = literal_op.unpack_from(self.buf)
+                del self.buf[:literal_op.size]
+
+            elif self.buf[0:1] == b'E':
+                del self.buf[:1]; self.done = True
+
+            else: raise ValueError('Invalid delta')
+
+    def finish(self):
+        """ Check that the whole delta has been received """
+        if not self.done: raise ValueError('Delta is incomplete')
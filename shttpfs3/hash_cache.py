@@ -0,0 +1,52 @@
+import os, sqlite3 as db
+from typing import Optional
+
+from shttpfs3.common import hash_file
+
+class hash_cache:
+    """ Persistent cache of the sha256 hashes of files in the working copy, the same hash
+    that the server stores files under. An entry is only used while the inode, size,
+    modification and change times of the file are unchanged, so a file is only read
+    again after it has been written to. """
+
+#===============================================================================
+    def __init__(self, db_path: str):
+        self.conn = db.connect(db_path)
+        self.conn.execute('create table if not exists hashes (inode int primary key, size int, mtime_ns int, ctime_ns int, hash text)')
+
+#===============================================================================
+    def lookup(self, st: os.stat_result) -> Optional[str]:
+        """ Return the cached hash for a file with the given stat result, if there is one """
+
+        res = self.conn.execute('select hash from hashes where inode = ? and size = ? and mtime_ns = ? and ctime_ns = ?',
+                                (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)).fetchone()
+        return res[0] if res is not None else None
+
+#===============================================================================
+    def store(self, st: os.stat_result, file_hash: str) -> None:
+        """ Record the hash of a file with the given stat result """
+
+        self.conn.execute('insert or replace into hashes (inode, size, mtime_ns, ctime_ns, hash) values (?,?,?,?,?)',
+                          (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns, file_hash))
+
+#===============================================================================
+    def get(self, f_path: str) -> str:
+        """ Get the hash of the file at 'f_path', only reading the file if it is not cached """
+
+        st = os.stat(f_path)
+        file_hash = self.lookup(st)
+        if file_hash is not None: return file_hash
+
+        file_hash = hash_file(f_path)
+
+        # Don't cache the result if the file was modified while it was being read
+        st_after = os.stat(f_path)
+        if (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns) == (st_after.st_ino, st_after.st_size, st_after.st_mtime_ns, st_after.st_ctime_ns):
+            self.store(st, file_hash)
+        return file_hash
+
+#===============================================================================
+    def save(self) -> None:
+        """ Write any new entries to disk """
+
+        self.conn.commit()
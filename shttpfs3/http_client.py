@@ -1,7 +1,7 @@
-import socket, ssl
-from typing import Dict
+import socket, ssl, select
+from typing import Dict, BinaryIO
 
-from shttpfs3.http_common import read_body, generate_headers, parse_http_responce_preamble
+from shttpfs3.http_common import read_body, read_preamble, generate_headers, parse_http_responce_preamble
 
 #=====================================================================
 class HTTPClient:
@@ -11,7 +11,25 @@ class HTTPClient:
         self.s.connect((host,port))
 
     def send(self, data: bytes):
-        self.s.send(data)
+        self.s.sendall(data)
+
+    def send_file(self, f: BinaryIO, offset: int, length: int) -> int:
+        """ Send 'length' bytes of a file starting from 'offset', returning the number sent,
+        which is less if the file is shorter. On plain sockets sendfile is used so that the
+        data is not copied through user space, it cannot be used with TLS, where the data
+        has to be encrypted, so the file is read and sent in chunks instead. """
+
+        if length <= 0: return 0
+        if not isinstance(self.s, ssl.SSLSocket): return self.s.sendfile(f, offset, length)
+
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(1000 * 1000, remaining))
+            if chunk == b'': break
+            self.s.sendall(chunk)
+            remaining -= len(chunk)
+        return length - remaining
 
     def send_headers(self, uri: str, headers: Dict[str, str]):
         msg = b"POST " + uri.encode('utf8') + b" HTTP/1.1\r\n"
@@ -23,20 +41,22 @@ class HTTPClient:
 
     def read_responce(self):
         parsed_preamble, body_partial = self.read_headers()
-        body = read_body(self.s.recv, int(parsed_preamble['headers']['content-length']), body_partial)
+        body = read_body(self.s.recv, int(parsed_preamble['headers']['content-length']), body_partial, self.s.recv_into)
         return parsed_preamble, body
 
     def read_headers(self):
-        data = b""
+        received = read_preamble(self.s.recv)
+        if received is None: raise ConnectionError('Connection closed before the responce was received')
 
-        # read request preamble
-        while True:
-            data += self.s.recv(1024)
-            if b"\r\n\r\n" in data: break
-
-        preamble, body_partial = data.split(b"\r\n\r\n", 1)
+        preamble, body_partial = received
         parsed_preamble = parse_http_responce_preamble(preamble)
         return parsed_preamble, body_partial
 
+    def is_stale(self) -> bool:
+        """ Nothing should be readable from an idle connection, if something is the server
+        has either closed it or sent something unexpected, so it cannot be used """
+        try: return select.select([self.s], [], [], 0)[0] != []
+        except (OSError, ValueError): return True
+
     def close(self):
         self.s.close()
@@ -1,4 +1,4 @@
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Tuple, Optional
 from typing_extensions import TypedDict
 
 #=====================================================================
@@ -12,14 +12,43 @@ def generate_headers(headers: Dict[str, str]) -> bytes:
     return res
 
 #=====================================================================
-def parse_headers(headers_raw: List[bytes]) -> Dict[str, str]:
+def parse_headers(headers_raw: str) -> Dict[str, str]:
     headers = {}
-    for i in headers_raw:
-        split_header = i.split(b':', 1)
-        headers[split_header[0].strip().decode('utf8').lower()] = split_header[1].strip().decode('utf8')
+    if headers_raw == '': return headers
+
+    for i in headers_raw.split('\r\n'):
+        name, sep, value = i.partition(':')
+        if sep == '': raise ValueError('Badly formatted header')
+        headers[name.strip().lower()] = value.strip()
 
     return headers
 
+#=====================================================================
+max_preamble_size = 64 * 1024
+
+def read_preamble(reader, max_size: int = max_preamble_size, chunk_size: int = 64 * 1024) -> Optional[Tuple[bytes, bytes]]:
+    """ Read the preamble of a HTTP message, which ends with a blank line, returning it
+    and any of the body which was received with it. Data is collected in a bytearray
+    and only the newly received part is searched for the end of the preamble. Returns
+    None if the connection is closed before anything is received, raises ConnectionError
+    if it is closed part way through, and ValueError if it is longer than 'max_size'. """
+
+    data = bytearray()
+    while True:
+        chunk = reader(chunk_size)
+        if chunk == b'':
+            if len(data) == 0: return None
+            raise ConnectionError('Connection closed before the headers were received')
+
+        searched = max(len(data) - 3, 0) # the terminator may span two reads
+        data += chunk
+
+        end = data.find(b"\r\n\r\n", searched)
+        if end == -1 and len(data) <= max_size: continue
+        if end == -1 or end > max_size: raise ValueError('Headers are too large')
+
+        return bytes(data[:end]), bytes(data[end + 4:])
+
 #=====================================================================
 class httpResponcePreamble(TypedDict):
     protocol: bytes
@@ -28,16 +57,14 @@ class httpResponcePreamble(TypedDict):
 
 #=====================================================================
 def parse_http_responce_preamble(preamble: bytes) -> httpResponcePreamble:
-    split = preamble.split(b"\r\n")
-    statusline = split[0]
-    headers_raw = split[1:]
+    statusline, _, headers_raw = preamble.partition(b"\r\n")
 
-    split_status = statusline.split(b' ')
+    split_status = statusline.split(b' ', 2) # the reason phrase may contain spaces
     if len(split_status) != 3: raise Exception('Badly formatted status line')
 
     return {'protocol' : split_status[0],
             'status'   : split_status[1:2],
-            'headers'  : parse_headers(headers_raw)}
+            'headers'  : parse_headers(headers_raw.decode('utf8'))}
 
 #=====================================================================
 class httpRequestPreamble(TypedDict):
@@ -47,50 +74,125 @@ class httpRequestPreamble(TypedDict):
 
 #=====================================================================
 def parse_http_request_preamble(preamble: bytes) -> httpRequestPreamble:
-    split = preamble.split(b"\r\n")
-    statusline = split[0]
-    headers_raw = split[1:]
+    statusline, _, headers_raw = preamble.decode('utf8').partition("\r\n")
 
-    split_status = statusline.split(b' ')
+    split_status = statusline.split(' ')
     if len(split_status) != 3: raise Exception('Badly formatted request line')
 
-    return {'method'  : split_status[0].decode('utf8'),
-            'path'    : split_status[1].decode('utf8'),
+    return {'method'  : split_status[0],
+            'path'    : split_status[1],
             'headers'  : parse_headers(headers_raw)}
 
+#=====================================================================
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """ Parse a 'Range' header of a single byte range, returns the offset and length
+    of the range, or None if the range is unsupported or cannot be satisfied """
+
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec: return None
+
+    try:
+        start, _, end = spec.strip().partition('-')
+        if start == '': # suffix range, the last 'end' bytes
+            if not end.isdigit() or int(end) == 0 or size == 0: return None
+            offset = max(size - int(end), 0)
+            return offset, size - offset
+
+        offset = int(start)
+        last = size - 1 if end == '' else min(int(end), size - 1)
+    except ValueError: return None
+
+    if offset < 0 or offset > last: return None
+    return offset, last - offset + 1
+
 #=====================================================================
 class read_body:
-    def __init__ (self, reader, body_length: int, body_partial: bytes):
-        self.reader       = reader
-        self.body_length  = body_length
-        self.body_partial = body_partial
-        self.have_read    = 0
+    """ Reads a body of known length from a connection. 'reader' is a function like
+    socket.recv, and 'reader_into', if given, one like socket.recv_into, which lets
+    readinto() and copy_to() receive data into a buffer without allocating a new bytes
+    object each time. 'body_partial' is the start of the body which was received with
+    the preamble. """
+
+    max_preallocate = 64 * 1000 * 1000
+
+    def __init__ (self, reader, body_length: int, body_partial: bytes, reader_into = None):
+        self.reader         = reader
+        self.reader_into    = reader_into
+        self.body_length    = body_length
+        self.body_partial   = body_partial
+        self.partial_offset = 0
+        self.have_read      = 0
 
     def read(self, length = None) -> Union[bytes, None]:
         if self.have_read >= self.body_length: return None
 
-        if length is None: length = self.body_length - self.have_read
+        if length is None or length > self.body_length - self.have_read:
+            length = self.body_length - self.have_read
 
         retbuffer: bytes
-        if len(self.body_partial) > 0:
-            retbuffer = self.body_partial[0:length]
-            self.body_partial = self.body_partial[length:]
+        if self.partial_offset < len(self.body_partial):
+            retbuffer = self.body_partial[self.partial_offset : self.partial_offset + length]
+            self.partial_offset += len(retbuffer)
 
         else:
             retbuffer = self.reader(length)
+            if retbuffer == b'': raise ConnectionError('Connection closed before the body was received')
 
         self.have_read += len(retbuffer)
         return retbuffer
 
-    def read_all(self) -> bytes:
-        retbuffer: bytes = b''
+    def readinto(self, buf) -> int:
+        """ Read up to len(buf) bytes of the body into buf, which is a bytearray or writable
+        memoryview, returning the number read, which is zero at the end of the body """
 
-        while True:
-            chunk = self.read(1000 * 1000)
-            if chunk is None: break
-            retbuffer += chunk
+        length = min(len(buf), self.body_length - self.have_read)
+        if length <= 0: return 0
 
-        return retbuffer
+        if self.partial_offset < len(self.body_partial):
+            n = min(length, len(self.body_partial) - self.partial_offset)
+            with memoryview(self.body_partial) as partial:
+                buf[:n] = partial[self.partial_offset : self.partial_offset + n]
+            self.partial_offset += n
+
+        elif self.reader_into is not None:
+            with memoryview(buf) as view:
+                n = self.reader_into(view[:length])
+
+        else:
+            data = self.reader(length); n = len(data)
+            buf[:n] = data
+
+        if n == 0: raise ConnectionError('Connection closed before the body was received')
+        self.have_read += n
+        return n
+
+    def read_all(self) -> bytearray:
+        """ Read the rest of the body, which is returned as a bytearray to avoid copying it,
+        this can be used in most places bytes can, such as json.loads. As the length is
+        known the buffer is allocated once and filled in place, although in case the length
+        is wrong no more than 'max_preallocate' is allocated before data is received. """
+
+        buf = bytearray(min(self.body_length - self.have_read, self.max_preallocate))
+        filled = 0
+
+        while self.have_read < self.body_length:
+            if filled == len(buf): buf += bytes(min(len(buf), self.body_length - self.have_read))
+            with memoryview(buf) as view:
+                filled += self.readinto(view[filled:])
+
+        return buf
+
+    def copy_to(self, write, chunk_size: int = 1000 * 1000):
+        """ Pass the rest of the body to 'write' in pieces, such as the write method of a
+        file. Data is received into one buffer which is reused, so the pieces are memoryviews
+        which are only valid during the call. """
+
+        buf = bytearray(min(chunk_size, self.body_length - self.have_read))
+        with memoryview(buf) as view:
+            while True:
+                n = self.readinto(view)
+                if n == 0: break
+                write(view[:n])
 
     def dump(self):
         """ Read whole body and discard it """
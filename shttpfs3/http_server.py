@@ -1,10 +1,9 @@
 import json
 import os
-import socket
-from typing import Union
-import _thread
+import socket, threading, queue, traceback, signal, time
+from typing import Callable, Union, Optional, List, Tuple
 
-from shttpfs3.http_common import read_body, parse_http_request_preamble
+from shttpfs3.http_common import read_body, read_preamble, parse_http_request_preamble
 
 #=====================
 class Request:
@@ -20,99 +19,218 @@ class Request:
 
 #=====================
 class ServeFile:
-    def __init__ (self, path: str):
-        self.path = path
+    """ Send part or all of a file as the body of a responce, if only
+    part is sent the responce has status 206. If delete is set the file
+    is removed once it has been sent. """
+
+    def __init__ (self, path: str, offset: int = 0, length: Optional[int] = None, delete: bool = False):
+        self.path   = path
+        self.offset = offset
+        self.length = length
+        self.delete = delete
+
+    def get_length(self) -> int:
+        return self.length if self.length is not None else os.stat(self.path).st_size - self.offset
+
+    def is_partial(self) -> bool:
+        return self.offset != 0 or self.length is not None
 
 #=====================
 class Responce:
-    def __init__ (self, headers = None, body: Union[bytes, ServeFile] = b""):
+    """ The body may be a list of parts, which are sent one after another """
+
+    def __init__ (self, headers = None, body: Union[bytes, ServeFile, List[Union[bytes, ServeFile]]] = b""):
         if headers is None: headers = {}
         self.headers = headers
         self.body    = body
 
 #=============================================
-def HTTPServer(host, port, connection_handler):
-    def handle_connection(c, addr):
-        try:
-            while True:
-                data = b""
-
-                # read request preamble
-                while True:
-                    data += c.recv(1024)
-                    if b"\r\n\r\n" in data: break
-
-                preamble, body_partial = data.split(b"\r\n\r\n", 1)
-
-
-                # parse the header
-                request = parse_http_request_preamble(preamble)
+def responce_preamble(rsp: Responce, keep_alive: bool = True) -> Tuple[bytes, List[Union[bytes, ServeFile]]]:
+    """ Generate the status line and headers of a responce, returning them
+    with the parts of the body which are to be sent after them """
 
-                if request['method'].lower() != 'post':
-                    print('error parsing request')
-                    break
+    if isinstance(rsp.body, ServeFile) and rsp.body.is_partial():
+        responce_headers =  b"HTTP/1.1 206 Partial Content\r\n"
+    else:
+        responce_headers =  b"HTTP/1.1 200 OK\r\n"
+    responce_headers += b"Connection: Keep-Alive\r\n" if keep_alive else b"Connection: close\r\n"
 
-                request_headers = {k.lower() : v for k,v in dict(request['headers']).items()}
+    parts = rsp.body if isinstance(rsp.body, list) else [rsp.body]
+    responce_content_length: int = sum(part.get_length() if isinstance(part, ServeFile) else len(part)
+                                       for part in parts)
 
-                # handle the request
-                print('Connecction from:', addr[0], ':', addr[1],' ', request['path'])
+    responce_headers += b"Content-Length: " + bytes(str(responce_content_length), encoding='utf8') + b'\r\n'
 
-                body_length = int(request_headers['content-length'])
-                body_reader = read_body(c.recv, body_length, body_partial)
-                rq = Request(addr[0], addr[1], request['path'], request_headers, body_reader)
-                rsp: Responce = connection_handler(rq)
-                body_reader.dump() # as we are using persistant connections, we need to read any
-                                   # body from the socket
+    for k, v in rsp.headers.items():
+        if isinstance(k, str): k=k.encode('utf8')
+        if isinstance(v, str): v=v.encode('utf8')
+        responce_headers += k + b':' + v + b'\r\n'
 
-                # generate client responce
-                responce_headers =  b"HTTP/1.1 200 OK\r\n"
-                responce_headers += b"Connection: Keep-Alive\r\n"
+    responce_headers += b"\r\n"
+    return responce_headers, parts
 
-                responce_content_length: int
-
-                if isinstance(rsp.body, ServeFile):
-                    responce_content_length = os.stat(rsp.body.path).st_size
-                else:
-                    responce_content_length = len(rsp.body)
-
-                responce_headers += b"Content-Length: " + bytes(str(responce_content_length), encoding='utf8') + b'\r\n'
-
-                for k, v in rsp.headers.items():
-                    if isinstance(k, str): k=k.encode('utf8')
-                    if isinstance(v, str): v=v.encode('utf8')
-                    responce_headers += k + b':' + v + b'\r\n'
-
-                responce_headers += b"\r\n"
-                c.send(responce_headers)
-
-                if isinstance(rsp.body, ServeFile):
-                    c.sendfile(open(rsp.body.path, 'rb'), 0)
-                else:
-                    c.send(rsp.body)
-
-        except:
-            c.close()
-            raise
+#=============================================
+def handle_connection(c: socket.socket, addr, connection_handler, max_requests: int = 0, keep_alive_timeout: Optional[float] = None,
+                      request_timeout: Optional[float] = None):
+    """ Serve requests from a persistent connection until the client closes it, it has been
+    idle for 'keep_alive_timeout' seconds, or 'max_requests' have been served if not zero.
+    The connection is also closed if a read or write while handling a request stalls for
+    'request_timeout' seconds. """
 
+    try:
+        requests = 0
+        while True:
+            # read request preamble
+            c.settimeout(keep_alive_timeout)
+            try: received = read_preamble(c.recv)
+            except (socket.timeout, ConnectionError): return # idle, or the client closed the connection part way through
+            except ValueError:
+                print('request headers too large')
+                return
+            if received is None: return # the client closed the connection
+            c.settimeout(request_timeout)
+
+            preamble, body_partial = received
+
+            # parse the header
+            request = parse_http_request_preamble(preamble)
+
+            if request['method'].lower() != 'post':
+                print('error parsing request')
+                return
+
+            request_headers = {k.lower() : v for k,v in dict(request['headers']).items()}
+
+            # handle the request
+            print('Connecction from:', addr[0], ':', addr[1],' ', request['path'])
+
+            body_length = int(request_headers['content-length'])
+            body_reader = read_body(c.recv, body_length, body_partial, c.recv_into)
+            rq = Request(addr[0], addr[1], request['path'], request_headers, body_reader)
+            rsp: Responce = connection_handler(rq)
+            body_reader.dump() # as we are using persistant connections, we need to read any
+                               # body from the socket
+
+            # generate client responce
+            requests += 1
+            keep_alive = max_requests == 0 or requests < max_requests
+            responce_headers, parts = responce_preamble(rsp, keep_alive)
+            c.sendall(responce_headers)
+
+            try:
+                for part in parts:
+                    if isinstance(part, ServeFile):
+                        with open(part.path, 'rb') as f:
+                            c.sendfile(f, part.offset, part.get_length())
+                    else:
+                        c.sendall(part)
+            finally:
+                for part in parts:
+                    if isinstance(part, ServeFile) and part.delete: os.remove(part.path)
+
+            if not keep_alive: return
+
+    except socket.timeout:
+        print('request timed out:', addr[0], ':', addr[1])
+    except ConnectionError:
+        print('connection lost:', addr[0], ':', addr[1])
+    finally:
         c.close()
 
-    #============
+#=============================================
+def bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port: s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     s.bind((host, port))
-    print("socket bound to port", port)
+    print("socket bound to port", s.getsockname()[1])
+    return s
+
+#=============================================
+def listen_socket(host: str, port: int, backlog: int = 128, reuse_port: bool = False) -> socket.socket:
+    s = bind_socket(host, port, reuse_port)
 
     # put the socket into listening mode
-    s.listen(5)
+    s.listen(backlog)
     print("socket is listening")
+    return s
+
+#=============================================
+def serve(s: socket.socket, connection_handler, threads: int = 32, queue_size: int = 64,
+          max_requests: int = 1000, keep_alive_timeout: Optional[float] = 15, request_timeout: Optional[float] = 60):
+    """ Accept connections from a listening socket, which are served by a fixed pool of
+    'threads' worker threads. Accepted connections wait for a free worker in a queue of
+    up to 'queue_size', once it is full no more are accepted until one is taken, and
+    further clients wait in the listen backlog. Idle persistent connections are closed
+    after 'keep_alive_timeout', and stalled requests after 'request_timeout', so that
+    they do not hold workers indefinitely. """
+
+    connections: queue.Queue = queue.Queue(queue_size)
+
+    def worker():
+        while True:
+            c, addr = connections.get()
+            try: handle_connection(c, addr, connection_handler, max_requests, keep_alive_timeout, request_timeout)
+            except Exception: traceback.print_exc() # pylint: disable=broad-except
+
+    for _ in range(threads): threading.Thread(target = worker, daemon = True).start()
 
     try:
         while True:
-            c, addr = s.accept()
+            connections.put(s.accept())
+    finally:
+        s.close()
+
+#=============================================
+def prefork(s: socket.socket, workers: int, serve_worker: Callable[[socket.socket], None], backlog: int = 128):
+    """ Serve connections from 'workers' processes, so that handling requests is not limited
+    to one core by the GIL. 's' is bound with SO_REUSEPORT but not listening, which holds
+    the port, and each worker listens on its own socket bound to the same port, which
+    the kernel distributes connections between. 'serve_worker' is called in each worker
+    with its socket. Workers which exit are restarted, and they are all stopped when
+    this process is interrupted or sent SIGTERM. """
+
+    host, port = s.getsockname()[:2]
+    children = {}
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                s.close()
+                serve_worker(listen_socket(host, port, backlog, reuse_port = True))
+            except Exception: traceback.print_exc() # pylint: disable=broad-except
+            finally:
+                os._exit(1) # pylint: disable=protected-access
+        children[pid] = time.time()
+
+    def stop(signum, frame): raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
 
-            # Start a new thread and return its identifier
-            _thread.start_new_thread(handle_connection, (c, addr))
-    except:
+    try:
+        for _ in range(workers): start_worker()
+
+        while True:
+            pid, status = os.wait()
+            if pid not in children: continue
+            print('worker', pid, 'exited with status', status, ', restarting it')
+
+            # Avoid restarting continuously if workers fail as soon as they start
+            if time.time() - children.pop(pid) < 1: time.sleep(1)
+            start_worker()
+    finally:
+        for pid in children: os.kill(pid, signal.SIGTERM)
+        for pid in children: os.waitpid(pid, 0)
         s.close()
-        raise
 
-    s.close()
+#=============================================
+def HTTPServer(host, port, connection_handler, backlog: int = 128, workers: int = 0, **options):
+    """ Listen on host and port and serve connections, see serve() for the options. If
+    'workers' is given they are served by that many processes, see prefork(). """
+
+    if workers > 0:
+        prefork(bind_socket(host, port, reuse_port = True), workers,
+                lambda s: serve(s, connection_handler, **options), backlog)
+    else:
+        serve(listen_socket(host, port, backlog), connection_handler, **options)
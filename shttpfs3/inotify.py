@@ -0,0 +1,174 @@
+import os, ctypes, ctypes.util, errno, select, struct, time
+from typing import Callable, Dict, Set, Optional
+
+from shttpfs3.common import cpjoin
+
+#===============================================================================
+# Constants from <sys/inotify.h>
+#===============================================================================
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = 0o00004000
+IN_CLOEXEC     = 0o02000000
+
+watch_mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+event_header = struct.Struct('iIII') # wd, mask, cookie, len
+
+#===============================================================================
+def load_libc():
+    """ Find the inotify functions in libc, raising OSError if they are not available """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1; libc.inotify_add_watch; libc.inotify_rm_watch # pylint: disable=pointless-statement
+        return libc
+    except (OSError, AttributeError):
+        raise OSError(errno.ENOSYS, 'inotify is not available on this system')
+
+#===============================================================================
+class tree_watcher:
+    """ Watches every directory within a working copy using inotify, recording the
+    internal paths of anything which changes. This allows a sync to look at only the
+    paths which have changed instead of re-scanning the whole working copy. If the
+    kernel event queue overflows the next call to take_dirty() requests a full scan
+    instead, and if a directory could not be watched every call does. The first call
+    also requests a full scan, as changes made before the watcher started are not known. """
+
+#===============================================================================
+    def __init__(self, base_path: str, ignore_dir: Optional[Callable[[str], bool]] = None):
+        self.libc       = load_libc()
+        self.base_path  = base_path
+        self.ignore_dir = ignore_dir if ignore_dir is not None else lambda path: False
+        self.watches: Dict[int, str] = {}
+        self.dirty: Set[str] = set()
+        self.overflowed = True # changes made before the watches were added are not known
+        self.incomplete = False
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno(); raise OSError(err, os.strerror(err))
+
+        try: self.add_tree(os.path.sep)
+        except BaseException:
+            self.close(); raise
+
+#===============================================================================
+    def add_tree(self, int_path: str):
+        """ Add watches to a directory and all directories below it """
+
+        pending = [int_path]
+        while pending:
+            path = pending.pop()
+            if self.ignore_dir(path): continue
+
+            f_path = cpjoin(self.base_path, path)
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(f_path), watch_mask)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in [errno.ENOENT, errno.ENOTDIR]: continue # removed before we got to it
+                self.incomplete = True; raise OSError(err, os.strerror(err), f_path)
+            self.watches[wd] = path
+
+            try:
+                with os.scandir(f_path) as it:
+                    pending += [cpjoin(path, e.name) for e in it if e.is_dir(follow_symlinks=False)]
+            except OSError: pass
+
+#===============================================================================
+    def remove_tree(self, int_path: str):
+        """ Remove the watches on a directory which has been moved away, and all below it,
+        as their paths are no longer valid """
+
+        prefix = int_path + os.path.sep
+        for wd, path in list(self.watches.items()):
+            if path == int_path or path.startswith(prefix):
+                del self.watches[wd]
+                self.libc.inotify_rm_watch(self.fd, wd)
+
+#===============================================================================
+    def handle_events(self, data: bytes):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = event_header.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + event_header.size : offset + event_header.size + name_len].rstrip(b'\0'))
+            offset += event_header.size + name_len
+
+            if mask & IN_Q_OVERFLOW: self.overflowed = True; continue
+            if wd not in self.watches: continue
+
+            if mask & IN_IGNORED: del self.watches[wd]; continue
+
+            # The root of the working copy itself has been moved or deleted
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if self.watches[wd] == os.path.sep: self.overflowed = True
+                continue
+
+            path = cpjoin(self.watches[wd], name)
+            if mask & IN_ISDIR:
+                if self.ignore_dir(path): continue
+                if mask & IN_MOVED_FROM: self.remove_tree(path)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try: self.add_tree(path)
+                    except OSError: pass
+
+            self.dirty.add(path)
+
+#===============================================================================
+    def read_events(self, timeout: Optional[float]) -> bool:
+        """ Wait up to timeout seconds for events and process them, returns
+        true if any events were read """
+
+        if select.select([self.fd], [], [], timeout)[0] == []: return False
+
+        try: data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError: return False
+
+        self.handle_events(data)
+        return True
+
+#===============================================================================
+    def wait(self, timeout: float, settle: float = 2.0, max_wait: float = 30.0):
+        """ Block until something changes or the timeout expires. Once changes start arriving
+        keep collecting them until nothing has changed for 'settle' seconds, so that an
+        operation touching many files is handled as a group. """
+
+        if not self.read_events(timeout): return
+
+        deadline = time.time() + max_wait
+        while time.time() < deadline:
+            if not self.read_events(settle): break
+
+#===============================================================================
+    def take_dirty(self) -> Optional[Set[str]]:
+        """ Returns the internal paths which have changed since the last call and starts
+        collecting a new set. Returns None if a full scan of the working copy is required. """
+
+        while self.read_events(0): pass
+
+        dirty, self.dirty = self.dirty, set()
+        if self.overflowed or self.incomplete:
+            self.overflowed = False
+            return None
+        return dirty
+
+#===============================================================================
+    def restore_dirty(self, paths: Set[str]):
+        """ Return paths which could not be synchronised, so that they are looked at again """
+
+        self.dirty |= paths
+
+#===============================================================================
+    def close(self):
+        os.close(self.fd)
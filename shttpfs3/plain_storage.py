@@ -1,16 +1,161 @@
-import json
+import json, os, sqlite3 as db
 from shttpfs3.storage import storage
-from shttpfs3.common import cpjoin, get_single_file_info, file_or_default
+from shttpfs3.common import cpjoin, get_single_file_info, file_get_contents
 
 class plain_storage(storage):
-    """ Plain (non-versioned) data store used by the client """
+    """ Plain (non-versioned) data store used by the client. The manifest is stored in
+    an SQLite database so that changing a single entry does not require rewriting all
+    of it. Manifest changes are made in an SQLite transaction which is committed
+    together with the journal, see commit() and recover(). """
 
 #===============================================================================
     def __init__(self, data_dir):
         """ Setup and validate file system structure """
 
         storage.__init__(self, data_dir, '.shttpfs')
-        self.manifest_file = cpjoin('.shttpfs', 'manifest.json')
+        self.manifest_file = cpjoin('.shttpfs', 'manifest.json') # format version 2 manifest, migrated on first use
+        self.txn_id = None
+        self.batch_size = None
+        self.operation_start = 0
+        self.batch_count = 0
+
+        # Transactions are managed explicitly by begin() and commit()
+        self.conn = db.connect(self.get_full_file_path('.shttpfs', 'manifest.db'), isolation_level=None)
+        self.conn.execute('pragma journal_mode=wal')
+        self.conn.execute('pragma synchronous=full')
+        self.conn.execute('create table if not exists files (path text primary key, created real, last_mod real, hash text)')
+        self.conn.execute('create table if not exists meta (key text primary key, value text)')
+
+        # Resolve any transaction interrupted by a crash before the manifest is used
+        if os.path.isfile(self.j_file): self.recover()
+        self.migrate_json_manifest()
+
+#===============================================================================
+    def get_meta(self, key, default = None):
+        res = self.conn.execute('select value from meta where key = ?', (key,)).fetchone()
+        return res[0] if res is not None else default
+
+#===============================================================================
+    def set_meta(self, key, value):
+        self.conn.execute('insert or replace into meta (key, value) values (?,?)', (key, value))
+
+#===============================================================================
+    def migrate_json_manifest(self):
+        """ Import a format version 2 manifest.json into the database """
+
+        json_path = self.get_full_file_path(self.manifest_file)
+        if not os.path.isfile(json_path): return
+
+        # If the database already has a format version the import completed but
+        # the old manifest was not removed.
+        if self.get_meta('format_version') is None:
+            manifest = json.loads(file_get_contents(json_path))
+            if 'format_version' not in manifest or manifest['format_version'] < 2:
+                raise SystemExit('Please update the client manifest format')
+
+            self.conn.execute('begin')
+            self.conn.execute('delete from files')
+            for fle in manifest['files'].values(): self.set_manifest_entry(fle)
+            self.set_meta('root', manifest['root'])
+            self.set_meta('have_revision', manifest['have_revision'])
+            self.set_meta('format_version', '3')
+            self.conn.execute('commit')
+
+        os.remove(json_path)
+
+#===============================================================================
+    def begin(self):
+        """ Begin a transaction covering both the file system and the manifest """
+
+        if self.journal is None and os.path.isfile(self.j_file): self.recover()
+        storage.begin(self)
+
+        # The first journal item identifies the transaction, it is a no-op when rolled back
+        self.txn_id = os.urandom(16).hex()
+        self.do_action({'do' : ['txn', self.txn_id], 'undo' : ['txn', self.txn_id]})
+        self.conn.execute('begin')
+
+#===============================================================================
+    def commit(self, cont = False):
+        """ Commit the manifest then the journal. The id of the transaction is stored in the
+        manifest database as part of the same SQLite transaction, so if a crash happens
+        between the two commits recover() can tell that the transaction completed. """
+
+        if self.journal is None: raise Exception('Must call begin first')
+        self.set_meta('committed_txn', self.txn_id)
+        self.conn.execute('commit')
+        storage.commit(self, cont)
+
+#===============================================================================
+    def rollback(self):
+        if self.conn.in_transaction: self.conn.execute('rollback')
+        storage.rollback(self)
+
+#===============================================================================
+    def recover(self):
+        """ Resolve a transaction which was interrupted by a crash. If its manifest changes
+        were committed the file system changes are kept, otherwise they are rolled back. """
+
+        with open(self.j_file) as f: first_item = f.readline()
+        try: txn = json.loads(first_item)
+        except ValueError: txn = None
+
+        if txn is not None and txn[0] == 'txn' and txn[1] == self.get_meta('committed_txn'):
+            os.remove(self.j_file)
+            for itm in os.listdir(self.tmp_dir): os.remove(cpjoin(self.tmp_dir, itm))
+        else:
+            storage.rollback(self)
+
+#===============================================================================
+    def begin_batch(self, batch_size = 1000):
+        """ Group the following calls to fs_put(), fs_move() and fs_delete() into transactions
+        of up to batch_size operations, until end_batch() is called. Each transaction writes
+        the journal and manifest once, and a bounded size keeps rollback time predictable.
+        Should one of these operations raise it alone is rolled back, and the caller may keep
+        the operations before it with end_batch(), or roll them back with abort_batch(). """
+
+        self.begin()
+        self.batch_size = batch_size
+        self.batch_count = 0
+
+#===============================================================================
+    def end_batch(self):
+        """ Commit the operations done since the last batch transaction was committed """
+
+        self.batch_size = None
+        self.commit()
+
+#===============================================================================
+    def abort_batch(self):
+        """ Roll back the operations done since the last batch transaction was committed """
+
+        self.batch_size = None
+        self.rollback()
+
+#===============================================================================
+    def begin_operation(self):
+        if self.batch_size is None: self.begin(); return
+
+        # Mark the start of the operation so that it can be rolled back on its own
+        self.operation_start = self.journal_position()
+        self.conn.execute('savepoint operation')
+
+#===============================================================================
+    def commit_operation(self):
+        if self.batch_size is None: self.commit(); return
+
+        self.conn.execute('release operation')
+        self.batch_count += 1
+        if self.batch_count >= self.batch_size:
+            self.batch_count = 0
+            self.commit(True)
+
+#===============================================================================
+    def rollback_operation(self):
+        if self.batch_size is None: self.rollback(); return
+
+        self.conn.execute('rollback to operation'); self.conn.execute('release operation')
+        self.rollback_to(self.operation_start)
 
 #===============================================================================
     def get_single_file_info(self, rel_path):
@@ -21,21 +166,46 @@ class plain_storage(storage):
 
 #===============================================================================
     def read_local_manifest(self):
-        """ Read the file manifest, or create a new one if there isn't one already """
+        """ Read the whole file manifest """
 
-        manifest = json.loads(file_or_default(self.get_full_file_path(self.manifest_file), """{
-            "format_version" : 2,
-            "root"           : "/",
-            "have_revision"  : "root",
-            "files"          : {}}"""))
+        files = {}
+        for path, created, last_mod, file_hash in self.conn.execute('select path, created, last_mod, hash from files'):
+            files[path] = {'path' : path, 'created' : created, 'last_mod' : last_mod}
+            if file_hash is not None: files[path]['hash'] = file_hash
 
-        if 'format_version' not in manifest or manifest['format_version'] < 2:
-            raise SystemExit('Please update the client manifest format')
-        return manifest
+        return {'format_version' : 3,
+                'root'           : self.get_meta('root', '/'),
+                'have_revision'  : self.get_have_revision(),
+                'files'          : files}
 
 #===============================================================================
     def write_local_manifest(self, manifest):
-        self.file_put_contents(self.manifest_file, json.dumps(manifest).encode('utf8'))
+        """ Replace the whole file manifest """
+
+        self.conn.execute('delete from files')
+        for fle in manifest['files'].values(): self.set_manifest_entry(fle)
+        self.set_have_revision(manifest['have_revision'])
+
+#===============================================================================
+    def get_have_revision(self):
+        return self.get_meta('have_revision', 'root')
+
+#===============================================================================
+    def set_have_revision(self, revision):
+        self.set_meta('have_revision', revision)
+
+#===============================================================================
+    def set_manifest_entry(self, file_info):
+        """ Add or replace a single file in the manifest """
+
+        self.conn.execute('insert or replace into files (path, created, last_mod, hash) values (?,?,?,?)',
+                          (file_info['path'], file_info['created'], file_info['last_mod'], file_info.get('hash')))
+
+#===============================================================================
+    def remove_manifest_entry(self, rpath):
+        """ Remove a single file from the manifest """
+
+        self.conn.execute('delete from files where path = ?', (rpath,))
 
 #===============================================================================
     def remove_from_manifest(self, manifest, rpath):
@@ -44,22 +214,23 @@ class plain_storage(storage):
         return manifest
 
 #===============================================================================
-    def fs_put(self, rpath, data):
-        """ Add a file to the FS """
+    def fs_put(self, rpath, data, file_hash = None):
+        """ Add a file to the FS, if the hash of its contents is known it is
+        stored in the manifest """
         try:
-            self.begin()
+            self.begin_operation()
 
             # Add the file to the fs
             self.file_put_contents(rpath, data)
 
             # Add to the manifest
-            manifest = self.read_local_manifest()
-            manifest['files'][rpath] = self.get_single_file_info(rpath)
-            self.write_local_manifest(manifest)
+            file_info = self.get_single_file_info(rpath)
+            if file_hash is not None: file_info['hash'] = file_hash
+            self.set_manifest_entry(file_info)
 
-            self.commit()
+            self.commit_operation()
         except:
-            self.rollback(); raise
+            self.rollback_operation(); raise
 
 #===============================================================================
     def fs_get(self, rpath):
@@ -70,33 +241,30 @@ class plain_storage(storage):
 #===============================================================================
     def fs_move(self, r_src, r_dst):
         try:
-            self.begin()
+            self.begin_operation()
 
             # Move the file
             self.move_file(r_src, r_dst)
 
             # Rename the file in the manifest
-            manifest = self.read_local_manifest()
-            manifest['files'][r_dst] = self.get_single_file_info(r_dst)
-            self.write_local_manifest(manifest)
+            self.remove_manifest_entry(r_src)
+            self.set_manifest_entry(self.get_single_file_info(r_dst))
 
-            self.commit()
+            self.commit_operation()
         except:
-            self.rollback(); raise
+            self.rollback_operation(); raise
 
 #===============================================================================
     def fs_delete(self, rpath):
         try:
-            self.begin()
+            self.begin_operation()
 
             # Delete the file
             self.delete_file(rpath)
 
-            # Rename the file in the manifest
-            manifest = self.read_local_manifest()
-            del manifest['files'][rpath]
-            self.write_local_manifest(manifest)
+            # Remove the file from the manifest
+            self.remove_manifest_entry(rpath)
 
-            self.commit()
+            self.commit_operation()
         except:
-            self.rollback(); raise
+            self.rollback_operation(); raise
@@ -1,11 +1,15 @@
 import sqlite3 as db
-from typing import Dict, Callable, Union, Optional
-import fcntl, os, json, time, base64, re
+from typing import Dict, Callable, Union, Optional, List, Tuple
+import fcntl, os, json, time, base64, re, hashlib, tempfile
 import pysodium # type: ignore
 
 #====
 from shttpfs3.http_server import Request, Responce, ServeFile
-from shttpfs3.common import cpjoin, file_get_contents
+from shttpfs3.common import cpjoin, file_get_contents, ignore, hashing_writer
+from shttpfs3.http_common import parse_range
+from shttpfs3.delta import signature, make_delta, patcher, block_size_for
+from shttpfs3.compression import worth_compressing, compress_file, inflater
+from shttpfs3.bundle import pack_record_header, end_marker, unpacker
 from shttpfs3.versioned_storage import versioned_storage
 from shttpfs3.merge_client_and_server_changes import merge_client_and_server_changes
 
@@ -20,6 +24,12 @@ user_auth_fail_msg   = "Could not authenticate user"
 conflict_msg         = 'Please resolve conflicts'
 need_to_update_msg   = "Please update to latest revision"
 no_active_commit_msg = "A commit must be started before attempting this operation."
+upload_busy_msg      = 'Upload in progress'
+upload_offset_msg    = 'Upload offset is invalid or beyond the data received'
+bad_encoding_msg     = 'Unsupported or corrupt content encoding'
+hash_mismatch_msg    = 'File contents do not match the hash'
+partial_upload_lifetime = 60 * 60 * 24  # 1 day
+pull_files_max_batch    = 10000
 
 extend_session_duration = (60 * 60) * 2 # 2 hours
 
@@ -46,7 +56,7 @@ def endpoint(request: Request):
 
 
 #===============================================================================
-def server_responce(headers: Dict[str, str], body: Union[bytes, ServeFile]):
+def server_responce(headers: Dict[str, str], body: Union[bytes, ServeFile, List[Union[bytes, ServeFile]]]):
     return Responce(headers, body)
 
 
@@ -57,7 +67,7 @@ def fail(msg: str = ''):
 
 
 #===============================================================================
-def success(headers: Optional[Dict[str, str]] = None, data: Union[dict, bytes, ServeFile] = b''):
+def success(headers: Optional[Dict[str, str]] = None, data: Union[dict, bytes, ServeFile, List[Union[bytes, ServeFile]]] = b''):
     """ Generate success JSON to send to client """
     passed_headers: Dict[str, str] = {} if headers is None else headers
     if isinstance(data, dict): data = json.dumps(data).encode('utf8')
@@ -73,13 +83,14 @@ def success(headers: Optional[Dict[str, str]] = None, data: Union[dict, bytes, S
 # while a commit is in progress and this updates atomically. This uses flock
 # as a convenient way to synchronise across multiple processes.
 #===============================================================================
-def lock_access(repository_path: str, callback: Callable[[], Responce]):
+def lock_access(repository_path: str, callback: Callable[[], Responce], blocking: bool = False):
     """ Synchronise access to the user file between processes, this specifies
-    which user is allowed write access at the current time """
+    which user is allowed write access at the current time. If blocking is set
+    wait for the lock instead of failing, only use this for short operations. """
 
     with open(cpjoin(repository_path, 'lock_file'), 'w') as fd:
         try:
-            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
             returned = callback()
             fcntl.flock(fd, fcntl.LOCK_UN)
             return returned
@@ -135,6 +146,7 @@ def read_user_lock(repository_path: str):
 def varify_user_lock(repository_path: str, session_token: bytes):
     """ Verify that a returning user has a valid token and their lock has not expired """
 
+    if not os.path.isfile(cpjoin(repository_path, 'user_file')): return False
     with open(cpjoin(repository_path, 'user_file'), 'r') as fd2:
         content = fd2.read()
         if len(content) == 0: return False
@@ -335,7 +347,11 @@ def find_changed(request: Request) -> Responce:
 #===============================================================================
 @route('pull_file')
 def pull_file(request: Request) -> Responce:
-    """ Get a file from the server """
+    """ Get a file from the server. If the request has a 'range' header only that part of
+    the file is sent, allowing an interrupted download to be resumed. If the request also
+    has an 'if-range' header, holding the hash of the file the client has part of, the
+    range is only used if the file has not changed. The responce then has a 'content-range'
+    header, if it does not the whole file is sent. """
 
     session_token = request.headers['session_token'].encode('utf8')
     repository    = request.headers['repository']
@@ -350,7 +366,75 @@ def pull_file(request: Request) -> Responce:
     file_info = data_store.get_file_info_from_path(request.headers['path'])
 
     full_file_path: str = cpjoin(data_store.get_file_directory_path(file_info['hash']), file_info['hash'][2:])
-    return success({'file_info_json' : json.dumps(file_info)}, ServeFile(full_file_path))
+    headers = {'file_info_json' : json.dumps(file_info)}
+    offset, length = 0, None
+
+    if 'range' in request.headers and request.headers.get('if-range', file_info['hash']) == file_info['hash']:
+        size = os.stat(full_file_path).st_size
+        byte_range = parse_range(request.headers['range'], size)
+        if byte_range is not None:
+            offset, length = byte_range
+            headers['content-range'] = 'bytes %d-%d/%d' % (offset, offset + length - 1, size)
+
+    # If the client accepts it, and the file is compressible, the file is
+    # sent compressed. Any range applies to the uncompressed file.
+    if 'deflate' in request.headers.get('accept-encoding', ''):
+        with open(full_file_path, 'rb') as f:
+            f.seek(offset)
+            if worth_compressing(f):
+                repository_path = config['repositories'][repository]['path']
+                os.makedirs(cpjoin(repository_path, 'uploads'), exist_ok = True)
+                fd, tmp_path = tempfile.mkstemp(dir = cpjoin(repository_path, 'uploads'))
+                with os.fdopen(fd, 'wb') as out: compress_file(f, out, length)
+
+                # The sample may have compressed well while the rest of the file does not
+                if os.path.getsize(tmp_path) < ServeFile(full_file_path, offset, length).get_length():
+                    headers['content-encoding'] = 'deflate'
+                    return success(headers, ServeFile(tmp_path, delete = True))
+                os.remove(tmp_path)
+
+    return success(headers, ServeFile(full_file_path, offset, length))
+
+
+#===============================================================================
+@route('pull_files')
+def pull_files(request: Request) -> Responce:
+    """ Get many files in a single responce, which avoids a round trip per file when
+    there are many small files. The responce is a bundle, see bundle.py, containing
+    the requested files in order. Files larger than 'max_size' are sent without their
+    contents, with 'skipped' set in their file info, and should be got with pull_file. """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    body = request.get_json()
+    try:
+        paths: List[str] = json.loads(body['files'])
+        max_size = int(body['max_size'])
+    except (KeyError, TypeError, ValueError): return fail()
+    if not isinstance(paths, list) or len(paths) > pull_files_max_batch or max_size < 0: return fail()
+
+    data_store = versioned_storage(config['repositories'][repository]['path'])
+    try: file_infos = data_store.get_file_info_from_paths(paths)
+    except IOError: return fail()
+
+    parts: List[Union[bytes, ServeFile]] = []
+    for file_info in file_infos:
+        full_file_path: str = cpjoin(data_store.get_file_directory_path(file_info['hash']), file_info['hash'][2:])
+        size = os.path.getsize(full_file_path)
+
+        if size > max_size:
+            parts.append(pack_record_header(dict(file_info, skipped = True), 0))
+        else:
+            parts += [pack_record_header(file_info, size), ServeFile(full_file_path)]
+    parts.append(end_marker)
+
+    return success({}, parts)
 
 
 #===============================================================================
@@ -416,11 +500,9 @@ def begin_commit(request: Request) -> Responce:
     def with_exclusive_lock():
         # The commit is locked for a given time period to a given session token,
         # a client must hold this lock to use any of push_file(), delete_files() and commit().
-        # It does not matter if the user lock technically expires while a client is writing
-        # a large file, as the user lock is locked using flock for the duration of any
-        # operation and thus cannot be stolen by another client. It is updated to be in
-        # the future before returning to the client. The lock only needs to survive until
-        # the client owning the lock sends another request and re acquires the flock.
+        # Files are received without holding the flock, so while a client is sending a large
+        # file it calls heartbeat() periodically to keep the user lock from expiring. Every
+        # operation also updates the lock to be in the future before returning to the client.
         if not can_aquire_user_lock(repository_path, session_token): return fail(lock_fail_msg)
 
         # Commits can only take place if the committing user has the latest revision,
@@ -439,20 +521,75 @@ def begin_commit(request: Request) -> Responce:
         # client resume, I only see commits failing due to a network error and this is so
         # rare I don't think it's worth the trouble.
         if data_store.have_active_commit(): data_store.rollback()
+        gc_partial_uploads(repository_path)
 
         #------------
         data_store.begin()
         update_user_lock(repository_path, session_token)
 
-        return success()
+        # Tell the client that it may compress the files it pushes
+        return success({'accept-encoding' : 'deflate'})
     return lock_access(repository_path, with_exclusive_lock)
 
 
 
+#===============================================================================
+def is_valid_path(file_path: str) -> bool:
+    """ There is no valid reason for path traversal characters to be in a file path within this system """
+
+    return not any(True for item in re.split(r'\\|/', file_path) if item in ['..', '.'])
+
+
+#===============================================================================
+def partial_upload_path(repository_path: str, user: str, upload_id: str) -> str:
+    """ Get the path of the partial file of a resumable upload, uploads are private to a user """
+
+    return cpjoin(repository_path, 'uploads', hashlib.sha256(json.dumps([user, upload_id]).encode('utf8')).hexdigest())
+
+
+#===============================================================================
+def gc_partial_uploads(repository_path: str):
+    """ Remove partial uploads which have not been added to for a day """
+
+    upload_dir = cpjoin(repository_path, 'uploads')
+    if not os.path.isdir(upload_dir): return
+
+    for name in os.listdir(upload_dir):
+        f_path = cpjoin(upload_dir, name)
+        try:
+            if os.stat(f_path).st_mtime < time.time() - partial_upload_lifetime: os.remove(f_path)
+        except OSError: pass
+
+
+#===============================================================================
+@route('upload_status')
+def upload_status(request: Request) -> Responce:
+    """ Get how much of a resumable upload has been received """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+
+    try: offset = os.stat(partial_upload_path(repository_path, current_user['username'], request.headers['upload_id'])).st_size
+    except OSError: offset = 0
+
+    return success({'offset' : str(offset)})
+
+
 #===============================================================================
 @route('push_file')
 def push_file(request: Request) -> Responce:
-    """ Push a file to the server """ #NOTE beware that reading post data in flask causes hang until file upload is complete
+    """ Push a file to the server. If the client gives an 'upload_id' the upload can be
+    resumed should the connection fail, by sending the rest of the file with an 'offset'
+    header giving the amount already received, as reported by upload_status(). If the
+    request has a 'hash' header the file is rejected if its sha256 hash does not match. """
+    #NOTE beware that reading post data in flask causes hang until file upload is complete
 
     session_token = request.headers['session_token'].encode('utf8')
     repository    = request.headers['repository']
@@ -464,6 +601,127 @@ def push_file(request: Request) -> Responce:
     #===
     repository_path = config['repositories'][repository]['path']
 
+    file_path = request.headers['path']
+    if not is_valid_path(file_path): return fail()
+
+    # The file is received into its own temporary file without holding the repository lock,
+    # so that a client can upload several files of the same commit concurrently. The lock
+    # is only taken to add the received file to the active commit. As the user lock can
+    # expire while a file is being received, it is checked again once the lock is held.
+    if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
+    if not versioned_storage(repository_path).have_active_commit(): return fail(no_active_commit_msg)
+
+    try: offset = int(request.headers.get('offset', '0'))
+    except ValueError: return fail(upload_offset_msg)
+    if offset < 0: return fail(upload_offset_msg)
+
+    encoding = request.headers.get('content-encoding', 'identity')
+    if encoding not in ['identity', 'deflate']: return fail(bad_encoding_msg)
+
+    upload_dir = cpjoin(repository_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok = True)
+
+    # The partial file of a resumable upload is kept if the connection fails
+    upload_id = request.headers.get('upload_id')
+    if upload_id is None:
+        fd, tmp_path = tempfile.mkstemp(dir = upload_dir); os.close(fd)
+    else:
+        tmp_path = partial_upload_path(repository_path, current_user['username'], upload_id)
+
+    try:
+        with os.fdopen(os.open(tmp_path, os.O_RDWR | os.O_CREAT), 'r+b') as f:
+            # The request which was interrupted may not have noticed yet
+            try: fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError: return fail(upload_busy_msg)
+
+            if offset > os.fstat(f.fileno()).st_size: return fail(upload_offset_msg)
+
+            # Hash the data which has already been received, discarding anything past the offset
+            writer = hashing_writer(f)
+            while f.tell() < offset: writer.update(f.read(min(1000 * 1000, offset - f.tell())))
+            f.truncate()
+
+            # The body may be compressed, the offset applies to the uncompressed file
+            write = inflater(writer.write) if encoding == 'deflate' else writer.write
+
+            request.body.copy_to(write)
+            if isinstance(write, inflater): write.finish()
+            f.flush()
+
+            # A corrupt partial upload must not be resumed
+            if request.headers.get('hash', writer.hexdigest()) != writer.hexdigest():
+                ignore(os.remove, tmp_path); return fail(hash_mismatch_msg)
+
+            return add_uploads_to_commit(repository_path, session_token, [(tmp_path, file_path, writer.hexdigest())])
+
+    except ValueError: return fail(bad_encoding_msg)
+
+    finally:
+        if upload_id is None: ignore(os.remove, tmp_path)
+
+
+#===============================================================================
+@route('push_files')
+def push_files(request: Request) -> Responce:
+    """ Push many small files in a single request, which avoids a round trip per file. The
+    body is a bundle, see bundle.py, holding the path, optionally the hash, and contents of
+    each file. Files are hashed as they are received and are added to the active commit
+    together at the end, if any does not match its hash none of them are. """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+
+    # As with push_file, the files are received without holding the repository lock
+    if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
+    if not versioned_storage(repository_path).have_active_commit(): return fail(no_active_commit_msg)
+
+    upload_dir = cpjoin(repository_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok = True)
+
+    tmp_paths: List[str] = []
+    uploads: List[Tuple[str, str, str]] = []
+    current: dict = {}
+
+    def open_file(file_info):
+        if not is_valid_path(file_info.get('path', '')): raise ValueError('Invalid path')
+
+        fd, tmp_path = tempfile.mkstemp(dir = upload_dir); tmp_paths.append(tmp_path)
+        f = os.fdopen(fd, 'wb')
+        current.update(f = f, writer = hashing_writer(f), tmp_path = tmp_path)
+        return current['writer'].write
+
+    def close_file(file_info):
+        current['f'].close()
+        if file_info.get('hash', current['writer'].hexdigest()) != current['writer'].hexdigest(): raise ValueError(hash_mismatch_msg)
+        uploads.append((current['tmp_path'], file_info['path'], current['writer'].hexdigest()))
+        current.clear()
+
+    try:
+        bundle = unpacker(open_file, close_file)
+        request.body.copy_to(bundle.feed)
+        bundle.finish()
+
+        return add_uploads_to_commit(repository_path, session_token, uploads)
+
+    except ValueError: return fail()
+
+    finally:
+        if 'f' in current: current['f'].close()
+        for tmp_path in tmp_paths: ignore(os.remove, tmp_path)
+
+
+#===============================================================================
+def add_uploads_to_commit(repository_path: str, session_token: bytes, uploads: List[Tuple[str, str, str]]) -> Responce:
+    """ Add received files to the active commit, moving them into the object store. Each
+    upload is given as the path it was received to, the path of the file and its hash. """
+
     def with_exclusive_lock():
         if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
 
@@ -471,26 +729,194 @@ def push_file(request: Request) -> Responce:
         data_store = versioned_storage(repository_path)
         if not data_store.have_active_commit(): return fail(no_active_commit_msg)
 
-        # There is no valid reason for path traversal characters to be in a file path within this system
-        file_path = request.headers['path']
-        if any(True for item in re.split(r'\\|/', file_path) if item in ['..', '.']): return fail()
+        #===
+        data_store.fs_put_from_files([(tmp_path, {'path' : file_path}, file_hash) for tmp_path, file_path, file_hash in uploads])
+
+        # updates the user lock expiry
+        update_user_lock(repository_path, session_token)
+        return success()
+
+    return lock_access(repository_path, with_exclusive_lock, blocking = True)
+
+
+#===============================================================================
+@route('signature')
+def get_signature(request: Request) -> Responce:
+    """ Get the signature of the current version of a file, which a client
+    uses to send changes to the file with push_delta() """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    data_store = versioned_storage(config['repositories'][repository]['path'])
+    try: file_info = data_store.get_file_info_from_path(request.headers['path'])
+    except IOError: return fail()
+
+    full_file_path: str = cpjoin(data_store.get_file_directory_path(file_info['hash']), file_info['hash'][2:])
+    with open(full_file_path, 'rb') as f:
+        sig = signature(f, block_size_for(os.fstat(f.fileno()).st_size))
+
+    return success({'file_info_json' : json.dumps(file_info)}, sig)
+
+
+#===============================================================================
+@route('push_delta')
+def push_delta(request: Request) -> Responce:
+    """ Push a file to the server as a delta against the file with the hash
+    given in the 'base_hash' header, see delta.py. As with push_file the
+    result is checked against the 'hash' header if there is one. """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+
+    file_path = request.headers['path']
+    base_hash = request.headers['base_hash']
+    if not is_valid_path(file_path) or not re.fullmatch('[0-9a-f]{64}', base_hash): return fail()
+
+    # As with push_file() the file is reconstructed without holding the repository lock
+    if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
+    data_store = versioned_storage(repository_path)
+    if not data_store.have_active_commit(): return fail(no_active_commit_msg)
+    if not data_store.have_file_object(base_hash): return fail()
+
+    upload_dir = cpjoin(repository_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = upload_dir)
+
+    try:
+        with os.fdopen(fd, 'wb') as f, open(cpjoin(data_store.get_file_directory_path(base_hash), base_hash[2:]), 'rb') as base:
+            writer = hashing_writer(f)
+            p = patcher(base, writer.write)
+            request.body.copy_to(p.feed)
+            p.finish()
+
+        if request.headers.get('hash', writer.hexdigest()) != writer.hexdigest(): return fail(hash_mismatch_msg)
+        return add_uploads_to_commit(repository_path, session_token, [(tmp_path, file_path, writer.hexdigest())])
+
+    except ValueError: return fail()
+
+    finally:
+        ignore(os.remove, tmp_path)
+
+
+#===============================================================================
+@route('pull_delta')
+def pull_delta(request: Request) -> Responce:
+    """ Get a file from the server as a delta against the version the client has,
+    the signature of which is the request body, see delta.py """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+    data_store = versioned_storage(repository_path)
+    try: file_info = data_store.get_file_info_from_path(request.headers['path'])
+    except IOError: return fail()
+
+    upload_dir = cpjoin(repository_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok = True)
+    fd, tmp_path = tempfile.mkstemp(dir = upload_dir)
+
+    try:
+        full_file_path: str = cpjoin(data_store.get_file_directory_path(file_info['hash']), file_info['hash'][2:])
+        with os.fdopen(fd, 'wb') as out, open(full_file_path, 'rb') as f:
+            make_delta(f, request.body.read_all(), out)
+
+    except ValueError:
+        ignore(os.remove, tmp_path); return fail()
+
+    except:
+        ignore(os.remove, tmp_path); raise
+
+    return success({'file_info_json' : json.dumps(file_info)}, ServeFile(tmp_path, delete = True))
+
+
+#===============================================================================
+@route('push_known_files')
+def push_known_files(request: Request) -> Responce:
+    """ Add files to the active commit which the server already has the contents of, so
+    that they do not need to be uploaded. The client sends the path and sha256 hash of
+    each file it is about to push, and the responce lists the paths of the files which
+    still need to be sent with push_file(). """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+    try: files = json.loads(request.get_json()['files'])
+    except (KeyError, TypeError, ValueError): return fail()
+    if not isinstance(files, list): return fail()
+
+    # The hash is used as a path within the object store
+    if not all(isinstance(fle, dict) and isinstance(fle.get('path'), str) and isinstance(fle.get('hash'), str) and
+               is_valid_path(fle['path']) and re.fullmatch('[0-9a-f]{64}', fle['hash']) for fle in files): return fail()
+
+    def with_exclusive_lock():
+        if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
 
         #===
-        tmp_path = cpjoin(repository_path, 'tmp_file')
-        with open(tmp_path, 'wb') as f:
-            while True:
-                chunk = request.body.read(1000 * 1000)
-                if chunk is None: break
-                f.write(chunk)
+        data_store = versioned_storage(repository_path)
+        if not data_store.have_active_commit(): return fail(no_active_commit_msg)
 
         #===
-        data_store.fs_put_from_file(tmp_path, {'path' : file_path})
+        known, missing = [], []
+        for fle in files:
+            if data_store.have_file_object(fle['hash']): known.append({'path' : fle['path'], 'hash' : fle['hash']})
+            else:                                        missing.append(fle['path'])
+        data_store.fs_put_existing(known)
 
         # updates the user lock expiry
         update_user_lock(repository_path, session_token)
+        return success({}, {'missing' : missing})
+
+    return lock_access(repository_path, with_exclusive_lock, blocking = True)
+
+
+#===============================================================================
+@route('heartbeat')
+def heartbeat(request: Request) -> Responce:
+    """ Extend the user lock of a commit in progress. Clients send this periodically while
+    a commit is in progress, as the lock expires 30 seconds after the last request and
+    transferring a large file can take much longer. """
+
+    session_token = request.headers['session_token'].encode('utf8')
+    repository    = request.headers['repository']
+
+    #===
+    current_user = have_authenticated_user(request.remote_addr, repository, session_token)
+    if current_user is False: return fail(user_auth_fail_msg)
+
+    #===
+    repository_path = config['repositories'][repository]['path']
+
+    def with_exclusive_lock():
+        if not varify_user_lock(repository_path, session_token): return fail(lock_fail_msg)
+        update_user_lock(repository_path, session_token)
         return success()
 
-    return lock_access(repository_path, with_exclusive_lock)
+    return lock_access(repository_path, with_exclusive_lock, blocking = True)
 
 
 #===============================================================================
@@ -111,6 +111,32 @@ class storage:
         # Rollback is complete so delete the journal file
         os.remove(self.j_file)
 
+############################################################################################
+    def journal_position(self) -> int:
+        """ Position in the journal, which rollback_to() can undo the actions after """
+
+        if self.journal is None: raise Exception('Must call begin first')
+        return self.journal.tell()
+
+############################################################################################
+    def rollback_to(self, position: int):
+        """ Undo the actions journaled after 'position', the transaction remains open """
+
+        if self.journal is None: raise Exception('Must call begin first')
+        self.journal.close()
+
+        with open(self.j_file) as fle:
+            fle.seek(position)
+            journ_list = [json.loads(l) for l in fle]
+
+        for j_itm in reversed(journ_list):
+            try: self.do_action({'do' : j_itm}, False)
+            except IOError: pass
+
+        # Should this be interrupted, rolling back the whole transaction undoes any remaining items
+        with open(self.j_file, 'r+') as fle: fle.truncate(position)
+        self.journal = open(self.j_file, 'a')
+
 ############################################################################################
     def commit(self, cont: bool = False):
         """ Finish a transaction """
@@ -2,7 +2,7 @@ import json, hashlib, os, os.path, shutil
 from  collections import defaultdict
 from datetime import datetime
 
-from typing import List, Dict, Any, cast
+from typing import List, Dict, Any, Optional, Tuple, cast
 from typing_extensions import TypedDict
 
 import shttpfs3.common as sfs
@@ -152,6 +152,13 @@ class versioned_storage:
         return False
 
 
+#===============================================================================
+    def have_file_object(self, file_hash: str) -> bool:
+        """ Checks if a file with the given hash is in the object store """
+
+        return os.path.isfile(sfs.cpjoin(self.get_file_directory_path(file_hash), file_hash[2:]))
+
+
 #===============================================================================
     def get_head(self) -> str:
         """ Gets the hash associated with the current head commit """
@@ -194,36 +201,62 @@ class versioned_storage:
 
 
 #===============================================================================
-    def fs_put_from_file(self, source_file: str, file_info) -> None:
+    def fs_put_from_file(self, source_file: str, file_info, file_hash: Optional[str] = None) -> None:
+        """ Add a file to the active commit, moving it into the object store. If the sha256
+        hash of the file is already known it can be passed to avoid reading the file again,
+        files which are being received can be hashed as they are written with hashing_writer. """
+
+        self.fs_put_from_files([(source_file, file_info, file_hash)])
+
+
+#===============================================================================
+    def fs_put_from_files(self, files: List[Tuple[str, Dict[str, Any], Optional[str]]]) -> None:
+        """ Add many files to the active commit, each given as the source file, the file
+        info and optionally the hash, the staging files are only updated once """
+
         if not self.have_active_commit(): raise Exception()
-        file_info['hash'] = file_hash = sfs.hash_file(source_file)
 
-        target_base = sfs.cpjoin(self.base_path, 'files',file_hash[:2])
-        target = sfs.cpjoin(target_base, file_hash[2:])
-        if not os.path.isfile(target):
-            # log items which don't already exist so that we do not have to read the objects referenced in
-            # all existing commits to determine if the new objects are garbage in case of a commit roll back
-            self.gc_log_item('file', file_hash)
+        for source_file, file_info, file_hash in files:
+            if file_hash is None: file_hash = sfs.hash_file(source_file)
+            file_info['hash'] = file_hash
+
+            target_base = sfs.cpjoin(self.base_path, 'files',file_hash[:2])
+            target = sfs.cpjoin(target_base, file_hash[2:])
+            if not os.path.isfile(target):
+                # log items which don't already exist so that we do not have to read the objects referenced in
+                # all existing commits to determine if the new objects are garbage in case of a commit roll back
+                self.gc_log_item('file', file_hash)
+
+                # ---
+                sfs.make_dirs_if_dont_exist(target_base)
+                shutil.move(source_file, target)
+            else:
+                os.remove(source_file)
 
-            # ---
-            sfs.make_dirs_if_dont_exist(target_base)
-            shutil.move(source_file, target)
-        else:
-            os.remove(source_file)
+        self.fs_put_existing([file_info for source_file, file_info, file_hash in files])
+
+
+#===============================================================================
+    def fs_put_existing(self, file_infos: List[Dict[str, Any]]) -> None:
+        """ Add files whose contents are already in the object store to the active commit,
+        each file info must include the hash of the contents """
+
+        if not self.have_active_commit(): raise Exception()
 
         #=======================================================
         # Update commit changes
         #=======================================================
         def helper(contents):
-            file_info['status'] = 'changed' if file_info['path'] in contents else 'new'
-            return  contents + [file_info]
+            for file_info in file_infos:
+                file_info['status'] = 'changed' if file_info['path'] in contents else 'new'
+            return  contents + file_infos
         self.update_system_file('active_commit_changes', helper)
 
         #=======================================================
         # Update commit files
         #=======================================================
         def helper2(contents):
-            contents[file_info['path']] = file_info
+            for file_info in file_infos: contents[file_info['path']] = file_info
             return contents
         self.update_system_file('active_commit_files', helper2)
 
@@ -381,12 +414,24 @@ class versioned_storage:
 
 #===============================================================================
     def get_file_info_from_path(self, file_path: str):
+        return self.get_file_info_from_paths([file_path])[0]
+
+
+#===============================================================================
+    def get_file_info_from_paths(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """ Look up many files in the head revision, each tree object is only read once """
+
         head = self.get_head()
         if head == 'root': raise IOError('There are no commits!')
         tree_root = self.read_commit_index_object(head)['tree_root']
 
+        trees: Dict[str, Any] = {}
+        def read_tree(tree_hash):
+            if tree_hash not in trees: trees[tree_hash] = self.read_tree_index_object(tree_hash)
+            return trees[tree_hash]
+
         def helper(tree_root, path):
-            tree_contents = self.read_tree_index_object(tree_root)
+            tree_contents = read_tree(tree_root)
 
             if len(path) > 1:
                 if path[0] not in tree_contents['dirs']: raise IOError('No such file or directory')
@@ -397,11 +442,14 @@ class versioned_storage:
             else:
                 raise IOError('No such file or directory')
 
-        split_path = file_path.split('/')
-        split_path = split_path[1:] if split_path[0] == '' else split_path
-        result = helper(tree_root, split_path)
-        result['path'] = file_path
-        return result
+        results = []
+        for file_path in file_paths:
+            split_path = file_path.split('/')
+            split_path = split_path[1:] if split_path[0] == '' else split_path
+            result = dict(helper(tree_root, split_path))
+            result['path'] = file_path
+            results.append(result)
+        return results
 
 
 #===============================================================================
@@ -0,0 +1,189 @@
+import asyncio
+from unittest import TestCase
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_get_contents, file_put_contents
+from shttpfs3.async_client_http_request import async_client_http_request
+from shttpfs3.async_http_client import AsyncHTTPClient
+
+############################################################################################
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try: return loop.run_until_complete(coro)
+    finally: loop.close()
+
+############################################################################################
+class test_server:
+    """ Keep-alive server which echoes the request body, 'delay' is how long it
+    waits before responding and 'drop' the request numbers on which the connection
+    is closed instead. Responces have the status 'status' if it is set. """
+
+    def __init__(self, delay = 0, drop = None, status = None):
+        self.delay       = delay
+        self.status      = status
+        self.drop        = drop if drop is not None else []
+        self.requests    = 0
+        self.connections = 0
+        self.active      = 0
+        self.max_active  = 0
+        self.handlers    = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return 'http://127.0.0.1:' + str(self.server.sockets[0].getsockname()[1])
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.handlers.append(asyncio.current_task())
+        try:
+            while True:
+                try: preamble = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError: return
+                length = int([l for l in preamble.split(b'\r\n') if l.lower().startswith(b'content-length')][0].split(b':')[1])
+                body = await reader.readexactly(length)
+
+                self.requests += 1
+                if self.requests in self.drop: return
+
+                self.active += 1; self.max_active = max(self.active, self.max_active)
+                await asyncio.sleep(self.delay)
+                self.active -= 1
+
+                status = b'status: ' + self.status.encode('utf8') + b'\r\n' if self.status is not None else b''
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: ' + str(len(body)).encode('utf8') + b'\r\n' + status + b'\r\n' + body)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        """ Stop the server once the client has closed its connections """
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*self.handlers)
+
+
+class TestAsyncClientHttpRequest(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        make_data_dir()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_request(self):
+        """ Test requests, streamed downloads and file uploads """
+
+        async def test():
+            server = test_server()
+            conn = async_client_http_request(await server.start())
+
+            self.assertEqual(await conn.request('list_versions', {}, {'a' : 1}), (b'{"a": 1}', {'content-length' : '8'}))
+
+            writer, _ = await conn.request('pull_file', {}, {'b' : 2}, gen = True)
+            await writer(cpjoin(DATA_DIR, 'pulled'))
+            self.assertEqual(file_get_contents(cpjoin(DATA_DIR, 'pulled')), b'{"b": 2}')
+
+            file_put_contents(cpjoin(DATA_DIR, 'pushed'), b'x' * 3000000)
+            self.assertEqual(await conn.send_file('push_file', {}, cpjoin(DATA_DIR, 'pushed')), (b'x' * 3000000, {'content-length' : '3000000'}))
+
+            self.assertEqual(server.connections, 1)
+            conn.close(); await server.close()
+        run(test())
+
+############################################################################################
+    def test_concurrency(self):
+        """ Test that the number of requests in progress at once is bounded """
+
+        async def test():
+            server = test_server(delay = 0.05)
+            conn = async_client_http_request(await server.start(), max_connections = 4)
+
+            results = await asyncio.gather(*[conn.request('list_files', {}, i) for i in range(20)])
+            self.assertEqual([r[0] for r in results], [str(i).encode('utf8') for i in range(20)])
+            self.assertEqual(server.max_active, 4)
+            self.assertEqual(server.connections, 4)
+            conn.close(); await server.close()
+        run(test())
+
+############################################################################################
+    def test_cancel_and_retry(self):
+        """ Test that cancelled requests free their connection, and that idempotent requests are retried """
+
+        async def test():
+            server = test_server(delay = 0.05, drop = [2])
+            conn = async_client_http_request(await server.start(), max_connections = 1)
+
+            task = asyncio.ensure_future(conn.request('commit', {}))
+            await asyncio.sleep(0.01); task.cancel()
+            with self.assertRaises(asyncio.CancelledError): await task
+
+            self.assertEqual((await conn.request('find_changed', {}, 1))[0], b'1')
+            self.assertEqual(server.connections, 3)
+            conn.close(); await server.close()
+        run(test())
+
+############################################################################################
+    def test_stream(self):
+        """ Test that the body of a failed streamed request is read straight away, so its
+        connection slot is released even though callers do not read it """
+
+        async def test():
+            server = test_server(status = 'ok')
+            conn = async_client_http_request(await server.start(), max_connections = 1)
+
+            writer, _ = await conn.request('pull_file', {}, b'streamed', gen = True)
+            self.assertEqual(conn.idle, [])
+            received = []; await writer(received.append)
+            self.assertEqual((received, len(conn.idle)), ([b'streamed'], 1))
+
+            server.status = 'fail'
+            for _ in range(3):
+                writer, headers = await asyncio.wait_for(conn.request('pull_file', {}, b'failed', gen = True), 5)
+                self.assertEqual(headers['status'], 'fail')
+            received = []; await writer(received.append)
+            self.assertEqual(received, [b'failed'])
+
+            self.assertEqual(server.connections, 1)
+            conn.close(); await server.close()
+        run(test())
+
+############################################################################################
+    def test_stale(self):
+        """ Test detecting connections which the server has closed or sent something unexpected
+        on, and that checking does not affect connections which can be used """
+
+        async def test():
+            async def respond_then_close(reader, writer):
+                await reader.readuntil(b'\r\n\r\n'); await reader.readexactly(5)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'); await writer.drain()
+                await asyncio.sleep(0.05); writer.close()
+
+            async def send_junk(reader, writer):
+                writer.write(b'junk'); await writer.drain()
+
+            async def connect(handler):
+                server = await asyncio.start_server(handler, '127.0.0.1', 0)
+                conn = AsyncHTTPClient(); await conn.connect('127.0.0.1', server.sockets[0].getsockname()[1])
+                return server, conn
+
+            server, conn = await connect(respond_then_close)
+            self.assertFalse(await conn.is_stale())
+            await conn.send_headers('/test', {'Content-Length' : '5'}); await conn.send(b'hello')
+            _, body = await conn.read_responce()
+            self.assertEqual(await body.read_all(), b'ok')
+            self.assertFalse(await conn.is_stale())
+
+            # The server closes the connection
+            await asyncio.sleep(0.1)
+            self.assertTrue(await conn.is_stale())
+            conn.close(); server.close(); await server.wait_closed()
+
+            # Unexpected data
+            server, conn = await connect(send_junk)
+            await asyncio.sleep(0.05)
+            self.assertTrue(await conn.is_stale())
+            conn.close(); server.close(); await server.wait_closed()
+        run(test())
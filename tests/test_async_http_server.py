@@ -0,0 +1,81 @@
+import threading
+from unittest import TestCase
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_put_contents
+from shttpfs3.http_server import Responce, ServeFile, listen_socket
+from shttpfs3.async_http_server import serve_async
+from shttpfs3.http_client import HTTPClient
+
+############################################################################################
+def handler(request):
+    """ Echo the request body, or send part of a file if there is a 'path' header """
+
+    if 'path' in request.headers: return Responce({'status' : 'ok'}, ServeFile(request.headers['path'], 2, 3))
+    return Responce({'status' : 'ok'}, request.body.read_all())
+
+############################################################################################
+def start_server(**options) -> HTTPClient:
+    """ Start a server and return a connection to it """
+
+    s = listen_socket('127.0.0.1', 0)
+    threading.Thread(target = serve_async, args = (s, handler), kwargs = options, daemon = True).start()
+    conn = HTTPClient(); conn.connect('127.0.0.1', s.getsockname()[1])
+    return conn
+
+############################################################################################
+def request(conn: HTTPClient, headers, body = b''):
+    conn.send_headers('/test', dict(headers, **{'Content-Length' : str(len(body))}))
+    conn.send(body)
+    parsed_preamble, responce_body = conn.read_responce()
+    return parsed_preamble, responce_body.read_all()
+
+
+class TestAsyncHttpServer(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        make_data_dir()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_requests(self):
+        """ Test request bodies, which the handler reads from another thread, and sending files """
+
+        file_put_contents(cpjoin(DATA_DIR, 'test'), b'0123456789')
+        conn = start_server(threads = 2, max_requests = 3)
+
+        self.assertEqual(request(conn, {}, b'x' * 3000000)[1], b'x' * 3000000)
+
+        preamble, body = request(conn, {'path' : cpjoin(DATA_DIR, 'test')})
+        self.assertEqual((preamble['headers']['content-length'], body), ('3', b'234'))
+
+        preamble, body = request(conn, {}, b'last')
+        self.assertEqual((preamble['headers']['connection'], body), ('close', b'last'))
+        self.assertEqual(conn.s.recv(10), b'')
+        conn.close()
+
+############################################################################################
+    def test_keep_alive_timeout(self):
+        conn = start_server(keep_alive_timeout = 0.1)
+        self.assertEqual(request(conn, {}, b'a')[1], b'a')
+        self.assertEqual(conn.s.recv(10), b'')
+        conn.close()
+
+############################################################################################
+    def test_stalled_body(self):
+        """ Test that connections which stall part way through the body are closed without
+        taking up the thread """
+
+        conn = start_server(threads = 1, request_timeout = 0.2)
+        conn.send_headers('/test', {'Content-Length' : '100'}); conn.send(b'partial')
+        conn.s.settimeout(5)
+        try: self.assertEqual(conn.s.recv(10), b'')
+        except ConnectionResetError: pass
+
+        second = HTTPClient(); second.connect('127.0.0.1', conn.s.getpeername()[1])
+        self.assertEqual(request(second, {}, b'a')[1], b'a')
+        conn.close(); second.close()
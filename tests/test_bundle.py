@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from shttpfs3.bundle import pack_record_header, end_marker, unpacker
+
+############################################################################################
+def unpack(data: bytes, feed_size: int):
+    """ Unpack a bundle fed in pieces, returning the file info and contents of each record """
+
+    files = []
+    def open_file(file_info):
+        files.append((file_info, bytearray())); return files[-1][1].extend
+
+    bundle = unpacker(open_file, lambda file_info: None)
+    for i in range(0, len(data), feed_size): bundle.feed(data[i : i + feed_size])
+    bundle.finish()
+    return [(file_info, bytes(contents)) for file_info, contents in files]
+
+
+class TestBundle(TestCase):
+############################################################################################
+    def test_bundle(self):
+        """ Test that bundles are split into the files they contain """
+
+        records = [({'path' : '/a'}, b'contents of a'), ({'path' : '/empty'}, b''), ({'path' : '/c'}, bytes(range(256)) * 10)]
+        data = b''.join(pack_record_header(file_info, len(contents)) + contents for file_info, contents in records) + end_marker
+
+        for feed_size in [1, 7, len(data)]:
+            self.assertEqual(unpack(data, feed_size), records)
+
+############################################################################################
+    def test_invalid_bundle(self):
+        """ Test that truncated bundles, or data after the end, are rejected """
+
+        data = pack_record_header({'path' : '/a'}, 3) + b'abc' + end_marker
+        with self.assertRaises(ValueError): unpack(data[:-1], 100)
+        with self.assertRaises(ValueError): unpack(data + b'x', 100)
@@ -0,0 +1,214 @@
+import hashlib, json, os, threading, time
+from unittest import TestCase, mock
+
+from tests.helpers import DATA_DIR, delete_data_dir
+from tests.test_system import setup, setup_client
+from shttpfs3.common import file_get_contents, file_put_contents
+import shttpfs3.client as client
+
+############################################################################################
+def corrupt_downloads(count: int):
+    """ Make the next 'count' files sent by pull_file arrive corrupted, returns a list of
+    the pull_file requests made """
+
+    request = client.server_connection.request
+    pulls = []
+
+    def corrupting_request(url, headers, data = None, gen = False):
+        writer, responce_headers = request(url, headers, data, gen)
+        if url != 'pull_file': return writer, responce_headers
+
+        pulls.append(headers)
+        if len(pulls) > count: return writer, responce_headers
+        return (lambda dest, append = False: writer(lambda data: dest(bytes(len(data))))), responce_headers
+
+    client.server_connection.request = corrupting_request
+    return pulls
+
+
+class TestClient(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        setup(); setup_client('client1')
+        file_put_contents(DATA_DIR + 'client1/test', b'test content')
+        client.commit(client.authenticate(), 'test')
+
+        setup_client('client2')
+        client.config['compression'] = False
+        self.session_token = client.authenticate()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_pull_file_corrupted(self):
+        """ Test that a corrupted download is downloaded again in full """
+
+        pulls = corrupt_downloads(1)
+        dest = DATA_DIR + 'client2/.shttpfs/download'
+        self.assertTrue(client.pull_file(self.session_token, '/test', dest))
+        self.assertEqual(file_get_contents(dest), b'test content')
+
+        self.assertEqual(len(pulls), 2)
+        self.assertTrue('range' not in pulls[1])
+
+############################################################################################
+    def test_pull_file_always_corrupted(self):
+        """ Test that pull_file gives up if every download is corrupted """
+
+        client.config['pull_retries'] = 2
+        pulls = corrupt_downloads(10)
+        dest = DATA_DIR + 'client2/.shttpfs/download'
+        self.assertFalse(client.pull_file(self.session_token, '/test', dest))
+        self.assertFalse(os.path.exists(dest))
+        self.assertEqual(len(pulls), 3)
+
+############################################################################################
+    def test_pull_file_resumed(self):
+        """ Test that an interrupted download is resumed by appending the rest of the file,
+        and that the hash is checked over the whole file """
+
+        request = client.server_connection.request
+        pulls = []
+
+        def interrupting_request(url, headers, data = None, gen = False):
+            writer, responce_headers = request(url, headers, data, gen)
+            pulls.append((headers, responce_headers))
+            if len(pulls) > 1: return writer, responce_headers
+
+            def interrupted(dest, append = False):
+                writer(lambda data: dest(data[:5]))
+                raise ConnectionError('connection lost')
+            return interrupted, responce_headers
+
+        client.server_connection.request = interrupting_request
+        dest = DATA_DIR + 'client2/.shttpfs/download'
+        with mock.patch.object(client.time, 'sleep'):
+            self.assertTrue(client.pull_file(self.session_token, '/test', dest))
+        self.assertEqual(file_get_contents(dest), b'test content')
+
+        self.assertEqual(len(pulls), 2)
+        headers, responce_headers = pulls[1]
+        self.assertEqual((headers['range'], headers['if-range']), ('bytes=5-', hashlib.sha256(b'test content').hexdigest()))
+        self.assertEqual(responce_headers['content-range'], 'bytes 5-11/12')
+
+############################################################################################
+    def test_pull_file_resumed_corrupt_prefix(self):
+        """ Test that a download is started again if the part already received was corrupted """
+
+        request = client.server_connection.request
+        pulls = []
+
+        def interrupting_request(url, headers, data = None, gen = False):
+            writer, responce_headers = request(url, headers, data, gen)
+            pulls.append(headers)
+            if len(pulls) > 1: return writer, responce_headers
+
+            def interrupted(dest, append = False):
+                dest(b'XXXXX'); raise ConnectionError('connection lost')
+            return interrupted, responce_headers
+
+        client.server_connection.request = interrupting_request
+        dest = DATA_DIR + 'client2/.shttpfs/download'
+        with mock.patch.object(client.time, 'sleep'):
+            self.assertTrue(client.pull_file(self.session_token, '/test', dest))
+        self.assertEqual(file_get_contents(dest), b'test content')
+
+        self.assertEqual(len(pulls), 3)
+        self.assertTrue('range' in pulls[1] and 'range' not in pulls[2])
+
+############################################################################################
+    def test_update_interrupted(self):
+        """ Test that files pulled before an update is interrupted are kept, and are not
+        downloaded again by the next update """
+
+        setup_client('client1')
+        for name in ['a', 'b', 'c']: file_put_contents(DATA_DIR + 'client1/' + name, name.encode('utf8'))
+        client.commit(client.authenticate(), 'more files')
+
+        setup_client('client2')
+        client.config.update(pull_workers = 1, pull_batch_size = 1)
+        request = client.server_connection.request
+        pulled = []; interrupt = [True]
+
+        def interrupting_request(url, headers, data = None, gen = False):
+            if url == 'pull_files':
+                if interrupt[0] and len(pulled) == 2: raise KeyboardInterrupt()
+                pulled.extend(json.loads(data['files']))
+            return request(url, headers, data, gen)
+
+        client.server_connection.request = interrupting_request
+        with self.assertRaises(KeyboardInterrupt): client.update(client.authenticate())
+        self.assertEqual(sorted(client.data_store.read_local_manifest()['files'].keys()), sorted(pulled))
+
+        first = list(pulled); del pulled[:]; interrupt[0] = False
+        client.update(client.authenticate())
+        self.assertEqual(sorted(first + pulled), ['/a', '/b', '/c', '/test'])
+
+        for name in ['a', 'b', 'c']: self.assertEqual(file_get_contents(DATA_DIR + 'client2/' + name), name.encode('utf8'))
+
+############################################################################################
+    def test_commit_refused(self):
+        """ Test that a refused commit is reported and does not update the manifest """
+
+        setup_client('client1')
+        file_put_contents(DATA_DIR + 'client1/test', b'changed')
+        request = client.server_connection.request
+
+        def refusing_request(url, headers, data = None, gen = False):
+            if url == 'commit': return None, {'status' : 'fail', 'msg' : 'refused'}
+            return request(url, headers, data, gen)
+
+        client.server_connection.request = refusing_request
+        revision = client.data_store.get_have_revision()
+        with self.assertRaises(SystemExit) as cm: client.commit(client.authenticate(), 'refused')
+        self.assertEqual(str(cm.exception), 'Commit failed: refused')
+        self.assertEqual(client.data_store.get_have_revision(), revision)
+
+
+class TestMapConcurrently(TestCase):
+############################################################################################
+    def test_order(self):
+        """ Test that results are in the order of the items, even if later ones finish first """
+
+        def func(i):
+            time.sleep((10 - i) * 0.002); return i * 2
+        self.assertEqual(list(client.map_concurrently(func, range(10), 4)), [i * 2 for i in range(10)])
+        self.assertEqual(list(client.map_concurrently(func, range(10), 1)), [i * 2 for i in range(10)])
+
+############################################################################################
+    def test_failure(self):
+        """ Test that the first failure is raised, and that items which have not started are
+        not processed """
+
+        started = []; lock = threading.Lock()
+        def func(i):
+            with lock: started.append(i)
+            if i == 5: raise IOError('failed')
+            time.sleep(0.01)
+            return i
+
+        results = []
+        with self.assertRaises(IOError):
+            for result in client.map_concurrently(func, range(100), 2): results.append(result)
+
+        self.assertEqual(results, [0, 1, 2, 3, 4])
+        self.assertTrue(max(started) < 5 + 2 * 2 + 1, started) # only a bounded number run ahead
+
+############################################################################################
+    def test_close(self):
+        """ Test that closing the generator cancels work which has not started """
+
+        started = []; lock = threading.Lock()
+        def func(i):
+            with lock: started.append(i)
+            time.sleep(0.01); return i
+
+        results = client.map_concurrently(func, range(100), 2)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        results.close()
+        count = len(started); time.sleep(0.05)
+        self.assertEqual(len(started), count)
+        self.assertTrue(count <= 3 + 2 * 2, started)
@@ -0,0 +1,130 @@
+import socket, threading, time
+from unittest import TestCase
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_put_contents
+from shttpfs3.client_http_request import client_http_request
+
+############################################################################################
+class test_server:
+    """ Minimal keep-alive server, 'drop' is a list of the request numbers on which
+    the connection is closed instead of responding. Request bodies are kept in 'bodies',
+    and responces have the status 'status'. """
+
+    def __init__(self, drop = None, close_idle = False, status = 'ok'):
+        self.drop        = drop if drop is not None else []
+        self.close_idle  = close_idle
+        self.status      = status
+        self.requests    = 0
+        self.connections = 0
+        self.bodies      = []
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.bind(('127.0.0.1', 0))
+        self.s.listen(5)
+        self.port = self.s.getsockname()[1]
+        threading.Thread(target = self.serve, daemon = True).start()
+
+    def serve(self):
+        while True:
+            try: c = self.s.accept()[0]
+            except OSError: return
+            self.connections += 1
+            threading.Thread(target = self.handle, args = (c,), daemon = True).start()
+
+    def handle(self, c):
+        with c:
+            data = b''
+            while True:
+                while b'\r\n\r\n' not in data:
+                    chunk = c.recv(1024)
+                    if chunk == b'': return
+                    data += chunk
+
+                preamble, data = data.split(b'\r\n\r\n', 1)
+                length = int([l for l in preamble.split(b'\r\n') if l.lower().startswith(b'content-length')][0].split(b':')[1])
+                while len(data) < length: data += c.recv(1024)
+                self.bodies.append(data[:length]); data = data[length:]
+
+                self.requests += 1
+                if self.requests in self.drop: return
+                c.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nstatus: ' + self.status.encode('utf8') + b'\r\n\r\nok')
+                if self.close_idle: return
+
+    def close(self):
+        self.s.close()
+
+
+class TestClientHttpRequest(TestCase):
+############################################################################################
+    def test_connection_reuse(self):
+        """ Test that connections are reused between requests """
+
+        server = test_server()
+        conn = client_http_request('http://127.0.0.1:' + str(server.port))
+        for _ in range(3): self.assertEqual(conn.request('list_versions', {}), (b'ok', {'content-length' : '2', 'status' : 'ok'}))
+        self.assertEqual(server.connections, 1)
+        conn.close(); server.close()
+
+############################################################################################
+    def test_stale_connection(self):
+        """ Test that connections closed by the server while idle are not used """
+
+        server = test_server(close_idle = True)
+        conn = client_http_request('http://127.0.0.1:' + str(server.port))
+        for _ in range(3):
+            self.assertEqual(conn.request('commit', {})[0], b'ok')
+            time.sleep(0.1) # give the server time to close the connection
+        self.assertEqual(server.connections, 3)
+        conn.close(); server.close()
+
+############################################################################################
+    def test_retry(self):
+        """ Test that idempotent requests are retried if the connection fails, and others are not """
+
+        server = test_server(drop = [2, 4])
+        conn = client_http_request('http://127.0.0.1:' + str(server.port))
+        self.assertEqual(conn.request('find_changed', {})[0], b'ok')
+        self.assertEqual(conn.request('find_changed', {})[0], b'ok')
+        self.assertEqual(server.connections, 2)
+
+        with self.assertRaises(ConnectionError): conn.request('commit', {})
+        self.assertEqual(conn.request('commit', {})[0], b'ok')
+        conn.close(); server.close()
+
+############################################################################################
+    def test_stream(self):
+        """ Test that streamed responces release their connection once read, and that the body
+        of a failed request is read straight away as callers do not read it """
+
+        server = test_server()
+        conn = client_http_request('http://127.0.0.1:' + str(server.port))
+        writer, _ = conn.request('pull_file', {}, gen = True)
+        self.assertEqual(conn.idle, [])
+        received = []; writer(received.append)
+        self.assertEqual((received, len(conn.idle)), ([b'ok'], 1))
+
+        server.status = 'fail'
+        for _ in range(3):
+            writer, headers = conn.request('pull_file', {}, gen = True)
+            self.assertEqual((headers['status'], len(conn.idle)), ('fail', 1))
+        received = []; writer(received.append)
+        self.assertEqual(received, [b'ok'])
+
+        self.assertEqual(server.connections, 1)
+        conn.close(); server.close()
+
+############################################################################################
+    def test_send_parts(self):
+        """ Test sending a body made of bytes and parts of files """
+
+        delete_data_dir(); make_data_dir()
+        file_put_contents(cpjoin(DATA_DIR, 'a'), b'contents of a')
+        file_put_contents(cpjoin(DATA_DIR, 'b'), b'b' * 3000000)
+
+        server = test_server()
+        conn = client_http_request('http://127.0.0.1:' + str(server.port))
+        self.assertEqual(conn.send_parts('push_files', {}, [b'start', (cpjoin(DATA_DIR, 'a'), 8), (cpjoin(DATA_DIR, 'b'), 3000000), b'end'])[0], b'ok')
+        self.assertEqual(server.bodies, [b'startcontents' + b'b' * 3000000 + b'end'])
+
+        with self.assertRaises(IOError): conn.send_parts('push_files', {}, [(cpjoin(DATA_DIR, 'a'), 100)])
+        conn.close(); server.close(); delete_data_dir()
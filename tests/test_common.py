@@ -1,8 +1,9 @@
-import subprocess
+import os, subprocess, fnmatch
 from unittest import TestCase
 
 from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
-from shttpfs3.common import cpjoin, file_put_contents, hash_file, find_manifest_changes
+from shttpfs3.common import cpjoin, file_put_contents, hash_file, hashing_writer, find_manifest_changes, get_file_list, get_dirty_file_list, make_dirs_if_dont_exist, path_filter, scan_dir
+from shttpfs3 import common
 
 def get_state(path, last_mod):
     return {'path'     : path, 'last_mod' : last_mod}
@@ -22,6 +23,13 @@ class TestCommon(TestCase):
 
         self.assertEqual(expected_result, result, msg = 'Hashes are not the same')
 
+        # Hashing a file while it is written gives the same result
+        with open(cpjoin(DATA_DIR, 'test 2'), 'wb') as f:
+            writer = hashing_writer(f)
+            writer.write(b'some file '); writer.write(b'contents')
+        self.assertEqual(expected_result, writer.hexdigest())
+        self.assertEqual(expected_result, hash_file(cpjoin(DATA_DIR, 'test 2')))
+
         delete_data_dir()
 
 #===============================================================================
@@ -45,3 +53,91 @@ class TestCommon(TestCase):
         self.assertEqual(diff_5, {'/file_2': {'status': 'changed', 'path': '/file_2', 'last_mod': 20},
                                   '/file_1': {'status': 'deleted', 'path': '/file_1', 'last_mod': 20}})
 
+
+#===============================================================================
+    def test_get_file_list(self):
+        """ Test that sequential and parallel scans find the same files and times """
+
+        make_data_dir()
+
+        for path in ['/a', '/b/c', '/b/d/e', '/b/d/f', '/g/h/i/j']:
+            make_dirs_if_dont_exist(cpjoin(DATA_DIR, os.path.dirname(path)) + '/')
+            file_put_contents(cpjoin(DATA_DIR, path), b'test')
+        os.mkdir(cpjoin(DATA_DIR, 'empty'))
+
+        def to_dict(lst): return {f['path'] : f for f in lst}
+        sequential = to_dict(get_file_list(DATA_DIR))
+        parallel   = to_dict(get_file_list(DATA_DIR, workers = 4))
+
+        self.assertEqual(sorted(sequential.keys()), ['/a', '/b/c', '/b/d/e', '/b/d/f', '/g/h/i/j'])
+        self.assertEqual(sequential, parallel)
+        self.assertEqual(sequential['/b/d/e']['last_mod'], os.path.getmtime(cpjoin(DATA_DIR, 'b/d/e')))
+        self.assertEqual(sequential['/b/d/e']['created'],  os.path.getctime(cpjoin(DATA_DIR, 'b/d/e')))
+
+        delete_data_dir()
+
+#===============================================================================
+    def test_get_dirty_file_list(self):
+        """ Test that only dirty paths are looked at on disk """
+
+        make_data_dir()
+
+        for path in ['/a', '/b/c', '/b/d', '/e']:
+            make_dirs_if_dont_exist(cpjoin(DATA_DIR, os.path.dirname(path)) + '/')
+            file_put_contents(cpjoin(DATA_DIR, path), b'test')
+
+        def to_dict(lst): return {f['path'] : f for f in lst}
+        old_state = to_dict(get_file_list(DATA_DIR))
+        old_state['/deleted'] = get_state('/deleted', 10)
+        old_state['/b/deleted'] = get_state('/b/deleted', 10)
+        old_state['/e'] = get_state('/e', 10)
+
+        result = to_dict(get_dirty_file_list(DATA_DIR, {'/a', '/b', '/deleted'}, old_state))
+
+        self.assertEqual(sorted(result.keys()), ['/a', '/b/c', '/b/d', '/e'])
+        self.assertEqual(result['/e'], old_state['/e']) # not dirty so not looked at on disk
+
+        delete_data_dir()
+
+#===============================================================================
+    def test_path_filter(self):
+        """ Test that compiled filters match the same paths as fnmatch, and that directories
+        are only skipped when every path below them would be ignored """
+
+        filters = ['/.shttpfs*', '/build/*', '*.tmp', '/exact', '']
+        flter = path_filter(filters)
+
+        for path in ['/.shttpfs/manifest', '/build/a/b', '/a/b.tmp', '/exact', '/exact/file', '/buildx', '/a/b.tmp/c', '/keep']:
+            self.assertEqual(flter.match(path), any(fnmatch.fnmatch(path, f) for f in filters if f != ''), msg = path)
+
+        self.assertTrue(flter.match_dir('/.shttpfs'))
+        self.assertTrue(flter.match_dir('/build'))
+        self.assertTrue(flter.match_dir('/build/sub'))
+        self.assertFalse(flter.match_dir('/exact'))
+        self.assertFalse(flter.match_dir('/a.tmp'))
+        self.assertFalse(flter.match_dir('/other'))
+
+        self.assertFalse(path_filter([]).match('/a'))
+        self.assertFalse(path_filter([]).match_dir('/a'))
+
+#===============================================================================
+    def test_get_file_list_filtered(self):
+        """ Test that filtered files are skipped and filtered directories are not entered """
+
+        make_data_dir()
+
+        for path in ['/a', '/a.tmp', '/build/b', '/c/d.tmp', '/c/e']:
+            make_dirs_if_dont_exist(cpjoin(DATA_DIR, os.path.dirname(path)) + '/')
+            file_put_contents(cpjoin(DATA_DIR, path), b'test')
+        scanned = []
+        def recording_scan_dir(f_path, int_path, flter):
+            scanned.append(int_path); return scan_dir(f_path, int_path, flter)
+        common.scan_dir = recording_scan_dir
+
+        flter = path_filter(['/build/*', '*.tmp'])
+        self.assertEqual(sorted(f['path'] for f in get_file_list(DATA_DIR, flter = flter)), ['/a', '/c/e'])
+        self.assertEqual(sorted(f['path'] for f in get_file_list(DATA_DIR, 4, flter)), ['/a', '/c/e'])
+        self.assertTrue('/build' not in scanned)
+
+        common.scan_dir = scan_dir
+        delete_data_dir()
@@ -0,0 +1,46 @@
+import random, zlib
+from io import BytesIO
+from unittest import TestCase
+
+from shttpfs3.compression import worth_compressing, compress_file, inflater
+
+class TestCompression(TestCase):
+############################################################################################
+    def test_worth_compressing(self):
+        """ Test that compressible data is detected, and the file position is not changed """
+
+        rnd = random.Random(1)
+        f = BytesIO(bytes(rnd.getrandbits(8) for _ in range(100000)) + b'abc' * 100000)
+        self.assertFalse(worth_compressing(f))
+        f.seek(100000)
+        self.assertTrue(worth_compressing(f))
+        self.assertEqual(f.tell(), 100000)
+        self.assertFalse(worth_compressing(BytesIO(b'a' * 100)))
+
+############################################################################################
+    def test_round_trip(self):
+        """ Test compressing part of a file and decompressing it in pieces """
+
+        data = b''.join(str(i).encode('utf8') for i in range(1000000))
+        src = BytesIO(data); src.seek(1000)
+        compressed = BytesIO()
+        compress_file(src, compressed, 3000000)
+
+        result = BytesIO()
+        inflate = inflater(result.write)
+        c = compressed.getvalue()
+        for i in range(0, len(c), 777): inflate(c[i : i + 777])
+        inflate.finish()
+        self.assertEqual(result.getvalue(), data[1000 : 3001000])
+
+############################################################################################
+    def test_invalid(self):
+        """ Test that truncated or corrupt data is rejected """
+
+        c = zlib.compress(b'abc' * 1000)
+
+        inflate = inflater(lambda data: None)
+        inflate(c[:-4])
+        with self.assertRaises(ValueError): inflate.finish()
+
+        with self.assertRaises(ValueError): inflater(lambda data: None)(b'not compressed')
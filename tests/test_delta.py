@@ -0,0 +1,68 @@
+import random
+from io import BytesIO
+from unittest import TestCase
+
+from shttpfs3.delta import signature, make_delta, patcher, block_size_for
+
+############################################################################################
+def round_trip(old: bytes, new: bytes, block_size: int = 2048, feed_size: int = 1000):
+    """ Transfer 'new' as a delta against 'old', returning the result and amount of literal data """
+
+    sig = signature(BytesIO(old), block_size)
+    delta = BytesIO()
+    literal_bytes = make_delta(BytesIO(new), sig, delta, read_size = 10000)
+
+    result = BytesIO()
+    p = patcher(BytesIO(old), result.write)
+    data = delta.getvalue()
+    for i in range(0, len(data), feed_size): p.feed(data[i : i + feed_size])
+    p.finish()
+    return result.getvalue(), literal_bytes
+
+
+class TestDelta(TestCase):
+############################################################################################
+    def test_delta(self):
+        """ Test that deltas reproduce the new file, and only contain changed data """
+
+        rnd = random.Random(1)
+        old = bytes(rnd.getrandbits(8) for _ in range(100000))
+        new_data = bytes(rnd.getrandbits(8) for _ in range(5000))
+
+        cases = [
+            (old,                                       0),      # unchanged
+            (old[:50000] + new_data + old[50000:],      5000),   # inserted data, moving the rest
+            (old[:30001] + old[40000:],                 2048),   # removed data
+            (old[:60000] + new_data + old[65000:],      7048),   # replaced data
+            (old + new_data,                            5000),   # appended data
+            (new_data + old,                            5000),   # prepended data
+            (old[::-1],                                 100000), # nothing in common
+            (b'',                                       0)]
+
+        for new, max_literal in cases:
+            result, literal_bytes = round_trip(old, new)
+            self.assertEqual(result, new)
+            self.assertLessEqual(literal_bytes, max_literal + 2048)
+
+        # Against an empty file everything is literal
+        result, literal_bytes = round_trip(b'', old)
+        self.assertEqual((result, literal_bytes), (old, len(old)))
+
+############################################################################################
+    def test_invalid_delta(self):
+        """ Test that truncated or corrupt deltas are rejected """
+
+        sig = signature(BytesIO(b'abc' * 1000), 2048)
+        delta = BytesIO(); make_delta(BytesIO(b'abcd' * 1000), sig, delta)
+
+        p = patcher(BytesIO(b'abc' * 1000), lambda data: None)
+        p.feed(delta.getvalue()[:-1])
+        with self.assertRaises(ValueError): p.finish()
+
+        with self.assertRaises(ValueError): patcher(BytesIO(b''), lambda data: None).feed(b'SHDL\0\0\0\1X')
+
+############################################################################################
+    def test_block_size_for(self):
+        self.assertEqual(block_size_for(0), 2048)
+        self.assertEqual(block_size_for(1000 ** 3), 31616)
+        self.assertEqual(block_size_for(10 ** 12), 128 * 1024)
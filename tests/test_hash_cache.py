@@ -0,0 +1,40 @@
+import os
+from unittest import TestCase
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_put_contents, hash_file
+from shttpfs3.hash_cache import hash_cache
+
+class TestHashCache(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        make_data_dir()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_hash_cache(self):
+        """ Test that hashes are cached until a file is modified """
+
+        file_path = cpjoin(DATA_DIR, 'test')
+        file_put_contents(file_path, b'some file contents')
+
+        cache = hash_cache(cpjoin(DATA_DIR, 'hash_cache.db'))
+        self.assertEqual(cache.lookup(os.stat(file_path)), None)
+        self.assertEqual(cache.get(file_path), hash_file(file_path))
+        self.assertEqual(cache.lookup(os.stat(file_path)), hash_file(file_path))
+        cache.save()
+
+        # cached entries should persist
+        cache = hash_cache(cpjoin(DATA_DIR, 'hash_cache.db'))
+        self.assertEqual(cache.lookup(os.stat(file_path)), hash_file(file_path))
+
+        # Modifying the file or its times should invalidate the entry
+        os.utime(file_path, ns = (0, 0))
+        self.assertEqual(cache.lookup(os.stat(file_path)), None)
+
+        file_put_contents(file_path, b'other contents')
+        self.assertEqual(cache.get(file_path), hash_file(file_path))
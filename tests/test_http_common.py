@@ -0,0 +1,90 @@
+from io import BytesIO
+from unittest import TestCase
+
+from shttpfs3.http_common import parse_range, read_preamble, parse_http_request_preamble, read_body
+
+############################################################################################
+def reader(chunks):
+    """ Simulates socket.recv returning 'chunks' then end of file """
+    chunks = list(chunks)
+    return lambda length: chunks.pop(0) if chunks else b''
+
+############################################################################################
+def reader_into(data: bytes, max_read: int):
+    """ Simulates socket.recv_into, reading at most 'max_read' bytes at a time """
+    stream = BytesIO(data)
+    return lambda buf: stream.readinto(buf[:max_read])
+
+
+class TestHttpCommon(TestCase):
+############################################################################################
+    def test_read_preamble(self):
+        """ Test reading preambles which arrive in pieces """
+
+        # The terminator split between reads
+        self.assertEqual(read_preamble(reader([b'POST / HTTP/1.1\r\na: b\r', b'\n\r', b'\nbody'])),
+                         (b'POST / HTTP/1.1\r\na: b', b'body'))
+
+        self.assertEqual(read_preamble(reader([])), None)
+        with self.assertRaises(ConnectionError): read_preamble(reader([b'POST / HTTP/1.1\r\n']))
+        with self.assertRaises(ValueError): read_preamble(reader([b'a' * 60] * 10), max_size = 500)
+
+        # Body data past the size limit is allowed
+        self.assertEqual(read_preamble(reader([b'a' * 10 + b'\r\n\r\n' + b'b' * 1000]), max_size = 500)[0], b'a' * 10)
+
+############################################################################################
+    def test_parse_http_request_preamble(self):
+        self.assertEqual(parse_http_request_preamble(b'POST /push_file HTTP/1.1\r\nContent-Length: 10\r\npath: /a:b \xc3\xa9'),
+                         {'method'  : 'POST',
+                          'path'    : '/push_file',
+                          'headers' : {'content-length' : '10', 'path' : '/a:b \u00e9'}})
+
+        self.assertEqual(parse_http_request_preamble(b'POST / HTTP/1.1')['headers'], {})
+
+############################################################################################
+    def test_parse_range(self):
+        """ Test parsing of range headers """
+
+        self.assertEqual(parse_range('bytes=0-', 100),     (0, 100))
+        self.assertEqual(parse_range('bytes=10-', 100),    (10, 90))
+        self.assertEqual(parse_range('bytes=10-19', 100),  (10, 10))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 10))
+        self.assertEqual(parse_range('bytes=-30', 100),    (70, 30))
+        self.assertEqual(parse_range('bytes=-300', 100),   (0, 100))
+
+        # Unsatisfiable or unsupported ranges
+        self.assertEqual(parse_range('bytes=100-', 100),     None)
+        self.assertEqual(parse_range('bytes=20-10', 100),    None)
+        self.assertEqual(parse_range('bytes=0-1,5-6', 100),  None)
+        self.assertEqual(parse_range('lines=0-1', 100),      None)
+        self.assertEqual(parse_range('bytes=a-', 100),       None)
+        self.assertEqual(parse_range('bytes=--5', 10),       None)
+        self.assertEqual(parse_range('bytes=-0', 10),        None)
+        self.assertEqual(parse_range('bytes=-a', 10),        None)
+        self.assertEqual(parse_range('bytes=-', 10),         None)
+        self.assertEqual(parse_range('bytes=-5', 0),         None)
+
+############################################################################################
+    def test_read_body(self):
+        """ Test reading bodies, part of which was received with the preamble """
+
+        data = bytes(range(256)) * 100
+
+        # read_all, including when the buffer has to grow past 'max_preallocate'
+        for max_preallocate in [read_body.max_preallocate, 1000]:
+            body = read_body(None, len(data), data[:500], reader_into(data[500:], 777))
+            body.max_preallocate = max_preallocate
+            self.assertEqual(body.read(100), data[:100])
+            rest = body.read_all()
+            self.assertEqual((type(rest), rest), (bytearray, data[100:]))
+            self.assertEqual(body.read(), None)
+
+        # copy_to, with and without recv_into
+        for into in [reader_into(data[500:], 777), None]:
+            out = BytesIO()
+            read_body(BytesIO(data[500:]).read, len(data), data[:500], into).copy_to(out.write, 1000)
+            self.assertEqual(out.getvalue(), data)
+
+        # The connection closing early
+        body = read_body(None, len(data), data[:500], reader_into(data[500:1000], 777))
+        with self.assertRaises(ConnectionError): body.read_all()
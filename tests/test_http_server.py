@@ -0,0 +1,146 @@
+import multiprocessing, os, signal, socket, threading, time
+from unittest import TestCase, mock
+
+from shttpfs3.http_server import Responce, bind_socket, listen_socket, prefork, serve
+from shttpfs3.http_client import HTTPClient
+
+############################################################################################
+def start_server(**options) -> int:
+    """ Start a server which responds 'ok' to every request, returning its port """
+
+    s = listen_socket('127.0.0.1', 0)
+    threading.Thread(target = serve, args = (s, lambda request: Responce({'status' : 'ok'}, b'ok')),
+                     kwargs = options, daemon = True).start()
+    return s.getsockname()[1]
+
+############################################################################################
+def request(conn: HTTPClient):
+    conn.send_headers('/test', {'Content-Length' : '0'})
+    parsed_preamble, body = conn.read_responce()
+    return parsed_preamble['headers'], body.read_all()
+
+############################################################################################
+def connect(port: int) -> HTTPClient:
+    conn = HTTPClient(); conn.connect('127.0.0.1', port)
+    return conn
+
+
+class TestHttpServer(TestCase):
+############################################################################################
+    def test_max_requests(self):
+        """ Test that persistent connections are closed after 'max_requests' """
+
+        conn = connect(start_server(max_requests = 2))
+        self.assertEqual(request(conn)[0]['connection'], 'Keep-Alive')
+        headers, body = request(conn)
+        self.assertEqual((headers['connection'], body), ('close', b'ok'))
+        self.assertEqual(conn.s.recv(10), b'')
+        conn.close()
+
+############################################################################################
+    def test_keep_alive_timeout(self):
+        """ Test that idle connections are closed """
+
+        conn = connect(start_server(keep_alive_timeout = 0.1))
+        self.assertEqual(request(conn)[1], b'ok')
+        time.sleep(0.3)
+        self.assertTrue(conn.is_stale())
+        conn.close()
+
+############################################################################################
+    def test_incomplete_and_large_headers(self):
+        """ Test that connections which close part way through the headers, or send headers
+        which are too large, are closed without taking up the thread """
+
+        port = start_server(threads = 1, keep_alive_timeout = None)
+        conn = connect(port); conn.send(b'POST /test HTTP/1.1\r\nContent-'); conn.s.shutdown(socket.SHUT_WR)
+        self.assertEqual(conn.s.recv(10), b''); conn.close()
+
+        conn = connect(port); conn.send(b'POST /test HTTP/1.1\r\n' + b'a: b\r\n' * 20000)
+        try: self.assertEqual(conn.s.recv(10), b'')
+        except ConnectionResetError: pass # closed with unread data
+        conn.close()
+
+        conn = connect(port)
+        self.assertEqual(request(conn)[1], b'ok')
+        conn.close()
+
+############################################################################################
+    def test_stalled_body(self):
+        """ Test that connections which stall part way through the body are closed without
+        taking up the thread """
+
+        port = start_server(threads = 1, keep_alive_timeout = None, request_timeout = 0.2)
+        conn = connect(port); conn.send_headers('/test', {'Content-Length' : '100'}); conn.send(b'partial')
+        conn.s.settimeout(5)
+        try: self.assertEqual(conn.s.recv(10), b'')
+        except ConnectionResetError: pass
+        conn.close()
+
+        conn = connect(port)
+        self.assertEqual(request(conn)[1], b'ok')
+        conn.close()
+
+############################################################################################
+    def test_closed_part_way_through_body(self):
+        """ Test that connections closed part way through the body are closed without a traceback """
+
+        port = start_server(threads = 1, keep_alive_timeout = None)
+        with mock.patch('traceback.print_exc') as print_exc:
+            conn = connect(port); conn.send_headers('/test', {'Content-Length' : '100'}); conn.send(b'partial')
+            conn.close()
+
+            conn = connect(port)
+            self.assertEqual(request(conn)[1], b'ok')
+            conn.close()
+        print_exc.assert_not_called()
+
+############################################################################################
+    def test_bounded_threads(self):
+        """ Test that connections wait for a free thread """
+
+        port = start_server(threads = 1, keep_alive_timeout = None)
+        first = connect(port); second = connect(port)
+        self.assertEqual(request(first)[1], b'ok')
+
+        # The only thread is serving the first connection
+        second.send_headers('/test', {'Content-Length' : '0'})
+        second.s.settimeout(0.2)
+        with self.assertRaises(socket.timeout): second.s.recv(1, socket.MSG_PEEK)
+
+        second.s.settimeout(None)
+        first.close()
+        self.assertEqual(second.read_responce()[1].read_all(), b'ok')
+        second.close()
+
+############################################################################################
+    def test_prefork(self):
+        """ Test that connections are served by several processes, and that workers which
+        exit are restarted """
+
+        s = bind_socket('127.0.0.1', 0, reuse_port = True); port = s.getsockname()[1]
+        handler = lambda request: Responce({'status' : 'ok'}, str(os.getpid()).encode('utf8'))
+        supervisor = multiprocessing.get_context('fork').Process(
+            target = prefork, args = (s, 2, lambda s: serve(s, handler, keep_alive_timeout = None)))
+        supervisor.start(); s.close()
+
+        def worker_pids(count):
+            """ Make connections until 'count' different workers have responded """
+            pids: set = set(); deadline = time.time() + 5
+            while time.time() < deadline:
+                try:
+                    conn = connect(port)
+                    try: pids.add(int(request(conn)[1]))
+                    finally: conn.close()
+                except (ConnectionRefusedError, ConnectionResetError): # connections queued by a killed worker are reset
+                    time.sleep(0.01)
+                if len(pids) == count: return pids
+            raise AssertionError('Workers did not respond')
+
+        try:
+            pids = worker_pids(2)
+            os.kill(pids.pop(), signal.SIGKILL)
+            self.assertNotEqual(worker_pids(2) - pids, set())
+        finally:
+            supervisor.terminate(); supervisor.join()
+        self.assertRaises(ConnectionRefusedError, connect, port)
@@ -0,0 +1,92 @@
+import ctypes, errno, os, shutil
+from unittest import TestCase, mock
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_put_contents
+from shttpfs3.inotify import tree_watcher, load_libc
+
+class TestInotify(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        make_data_dir()
+        os.makedirs(cpjoin(DATA_DIR, 'dir/sub'))
+        os.makedirs(cpjoin(DATA_DIR, 'ignored'))
+        file_put_contents(cpjoin(DATA_DIR, 'dir/sub/file'), b'test')
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_first_scan(self):
+        """ Test that a full scan is requested first, as files may have changed before the
+        watcher started """
+
+        watcher = tree_watcher(DATA_DIR)
+        self.assertEqual(watcher.take_dirty(), None)
+        self.assertEqual(watcher.take_dirty(), set())
+        watcher.close()
+
+############################################################################################
+    def test_watch_failed(self):
+        """ Test that the inotify descriptor is closed if a directory cannot be watched """
+
+        libc = load_libc(); fds = []
+
+        class failing_libc:
+            def inotify_init1(self, flags):
+                fds.append(libc.inotify_init1(flags)); return fds[-1]
+
+            def inotify_add_watch(self, fd, path, mask):
+                if path.endswith(b'sub'): ctypes.set_errno(errno.ENOSPC); return -1
+                return libc.inotify_add_watch(fd, path, mask)
+
+        with mock.patch('shttpfs3.inotify.load_libc', failing_libc):
+            with self.assertRaises(OSError) as cm: tree_watcher(DATA_DIR)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+
+        with self.assertRaises(OSError) as cm: os.fstat(fds[0])
+        self.assertEqual(cm.exception.errno, errno.EBADF)
+
+############################################################################################
+    def test_dirty_paths(self):
+        """ Test that changes anywhere in the tree are recorded """
+
+        watcher = tree_watcher(DATA_DIR, lambda path: path.startswith('/ignored'))
+        watcher.take_dirty()
+        self.assertEqual(watcher.take_dirty(), set())
+
+        file_put_contents(cpjoin(DATA_DIR, 'dir/sub/file'), b'changed')
+        file_put_contents(cpjoin(DATA_DIR, 'new'), b'test')
+        file_put_contents(cpjoin(DATA_DIR, 'ignored/file'), b'test')
+        os.makedirs(cpjoin(DATA_DIR, 'new_dir'))
+        self.assertEqual(watcher.take_dirty(), {'/dir/sub/file', '/new', '/new_dir'})
+
+        # New directories should be watched
+        file_put_contents(cpjoin(DATA_DIR, 'new_dir/file'), b'test')
+        self.assertEqual(watcher.take_dirty(), {'/new_dir/file'})
+
+        # Moved directories should be watched at their new location
+        os.rename(cpjoin(DATA_DIR, 'dir'), cpjoin(DATA_DIR, 'moved'))
+        self.assertEqual(watcher.take_dirty(), {'/dir', '/moved'})
+        file_put_contents(cpjoin(DATA_DIR, 'moved/sub/file'), b'changed again')
+        self.assertEqual(watcher.take_dirty(), {'/moved/sub/file'})
+
+        shutil.rmtree(cpjoin(DATA_DIR, 'moved'))
+        self.assertTrue('/moved' in watcher.take_dirty())
+
+        watcher.restore_dirty({'/new'})
+        self.assertEqual(watcher.take_dirty(), {'/new'})
+        watcher.close()
+
+############################################################################################
+    def test_overflow(self):
+        """ Test that a full scan is requested after the event queue overflows """
+
+        watcher = tree_watcher(DATA_DIR)
+        watcher.take_dirty()
+        watcher.overflowed = True
+        self.assertEqual(watcher.take_dirty(), None)
+        self.assertEqual(watcher.take_dirty(), set())
+        watcher.close()
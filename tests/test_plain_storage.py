@@ -0,0 +1,128 @@
+import os, json
+from unittest import TestCase
+
+from tests.helpers import DATA_DIR, make_data_dir, delete_data_dir
+from shttpfs3.common import cpjoin, file_get_contents, file_put_contents, make_dirs_if_dont_exist
+from shttpfs3.plain_storage import plain_storage
+
+class TestPlainStorage(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        make_data_dir()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def test_manifest(self):
+        """ Test that manifest changes persist """
+
+        s = plain_storage(DATA_DIR)
+        self.assertEqual(s.read_local_manifest()['have_revision'], 'root')
+
+        s.fs_put('/hello', b'test content', 'abc')
+        s.fs_put('/hello2', b'test content')
+        s.fs_delete('/hello2')
+        s.begin(); s.set_have_revision('123'); s.commit()
+
+        manifest = plain_storage(DATA_DIR).read_local_manifest()
+        self.assertEqual(manifest['have_revision'], '123')
+        self.assertEqual(list(manifest['files'].keys()), ['/hello'])
+        self.assertEqual(manifest['files']['/hello']['hash'], 'abc')
+        self.assertEqual(manifest['files']['/hello']['last_mod'], os.path.getmtime(cpjoin(DATA_DIR, 'hello')))
+
+############################################################################################
+    def test_migrate_json_manifest(self):
+        """ Test that a format version 2 manifest is imported """
+
+        make_dirs_if_dont_exist(cpjoin(DATA_DIR, '.shttpfs') + '/')
+        file_put_contents(cpjoin(DATA_DIR, '.shttpfs', 'manifest.json'), json.dumps({
+            'format_version' : 2,
+            'root'           : '/',
+            'have_revision'  : '123',
+            'files'          : {'/hello' : {'path' : '/hello', 'created' : 1.0, 'last_mod' : 2.0}}}).encode('utf8'))
+
+        manifest = plain_storage(DATA_DIR).read_local_manifest()
+        self.assertEqual(manifest['have_revision'], '123')
+        self.assertEqual(manifest['files'], {'/hello' : {'path' : '/hello', 'created' : 1.0, 'last_mod' : 2.0}})
+        self.assertFalse(os.path.isfile(cpjoin(DATA_DIR, '.shttpfs', 'manifest.json')))
+
+############################################################################################
+    def test_crash_recovery(self):
+        """ Test that a crash before the manifest is committed rolls back the file system,
+        and that a crash after it is committed keeps the file system changes """
+
+        # Crash before the manifest commit
+        s = plain_storage(DATA_DIR)
+        s.begin()
+        s.file_put_contents('/hello', b'test content')
+        s.set_manifest_entry(s.get_single_file_info('/hello'))
+        s.journal.close(); s.conn.close()
+
+        s = plain_storage(DATA_DIR)
+        self.assertFalse(os.path.isfile(cpjoin(DATA_DIR, 'hello')))
+        self.assertEqual(s.read_local_manifest()['files'], {})
+
+        # Crash after the manifest commit but before the journal is removed
+        s.begin()
+        s.file_put_contents('/hello', b'test content')
+        s.set_manifest_entry(s.get_single_file_info('/hello'))
+        s.set_meta('committed_txn', s.txn_id)
+        s.conn.execute('commit')
+        s.journal.close(); s.conn.close()
+
+        s = plain_storage(DATA_DIR)
+        self.assertTrue(os.path.isfile(cpjoin(DATA_DIR, 'hello')))
+        self.assertEqual(list(s.read_local_manifest()['files'].keys()), ['/hello'])
+        self.assertFalse(os.path.isfile(s.j_file))
+
+############################################################################################
+    def test_batch(self):
+        """ Test that batched operations are committed in groups, and that aborting
+        a batch only rolls back the current group """
+
+        s = plain_storage(DATA_DIR)
+        s.fs_put('/existing', b'test content')
+
+        s.begin_batch(2)
+        s.fs_put('/hello1', b'test content 1')
+        s.fs_put('/hello2', b'test content 2')
+        s.fs_put('/hello3', b'test content 3')
+        s.abort_batch()
+
+        for path in ['existing', 'hello1', 'hello2']:
+            self.assertTrue(os.path.isfile(cpjoin(DATA_DIR, path)), msg = path)
+        self.assertFalse(os.path.isfile(cpjoin(DATA_DIR, 'hello3')))
+        self.assertEqual(sorted(s.read_local_manifest()['files'].keys()), ['/existing', '/hello1', '/hello2'])
+
+        s.begin_batch(2)
+        s.fs_put('/hello3', b'test content 3')
+        s.fs_put('/hello4', b'test content 4')
+        s.fs_delete('/existing')
+        s.end_batch()
+
+        self.assertFalse(os.path.isfile(cpjoin(DATA_DIR, 'existing')))
+        self.assertEqual(sorted(plain_storage(DATA_DIR).read_local_manifest()['files'].keys()), ['/hello1', '/hello2', '/hello3', '/hello4'])
+
+############################################################################################
+    def test_batch_failed_operation(self):
+        """ Test that an operation which fails within a batch is rolled back on its own """
+
+        def failing_write(path):
+            file_put_contents(path, b'partial'); raise IOError('failed')
+
+        s = plain_storage(DATA_DIR)
+        s.fs_put('/existing', b'test content')
+
+        s.begin_batch(10)
+        s.fs_put('/hello1', b'test content 1')
+        for path in ['/existing', '/hello2']:
+            with self.assertRaises(IOError): s.fs_put(path, failing_write)
+        s.fs_put('/hello3', b'test content 3')
+        s.end_batch()
+
+        self.assertEqual(file_get_contents(cpjoin(DATA_DIR, 'existing')), b'test content')
+        self.assertFalse(os.path.isfile(cpjoin(DATA_DIR, 'hello2')))
+        self.assertEqual(sorted(plain_storage(DATA_DIR).read_local_manifest()['files'].keys()), ['/existing', '/hello1', '/hello3'])
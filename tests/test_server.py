@@ -0,0 +1,281 @@
+import hashlib, json, os, threading, time, zlib
+from io import BytesIO
+from unittest import TestCase, mock
+
+from tests.helpers import DATA_DIR, delete_data_dir
+from tests.test_system import setup, setup_client, repo_name
+import shttpfs3.client as client
+import shttpfs3.server as server
+from shttpfs3.server import Request, Responce
+from shttpfs3.http_server import ServeFile, responce_preamble
+from shttpfs3.http_common import read_body
+from shttpfs3.bundle import pack_record_header, end_marker
+from shttpfs3.delta import signature, make_delta
+from shttpfs3.versioned_storage import versioned_storage
+
+############################################################################################
+def server_endpoint(url: str, headers: dict, body: bytes = b'', reader = None) -> Responce:
+    """ Pass a request directly to the server, returning the responce """
+
+    request = Request('0.0.0.0', 80, '/' + url, headers,
+                      read_body(reader if reader is not None else BytesIO(body).read, len(body), b''))
+    return server.endpoint(request)
+
+############################################################################################
+def server_request(url: str, headers: dict, body: bytes = b'', reader = None) -> dict:
+    """ Pass a request directly to the server, returning the responce headers """
+
+    return server_endpoint(url, headers, body, reader).headers
+
+############################################################################################
+def responce_body(rsp: Responce) -> bytes:
+    """ Read the body of a responce, which may be a file to be served """
+
+    if not isinstance(rsp.body, ServeFile): return rsp.body
+    with open(rsp.body.path, 'rb') as f:
+        f.seek(rsp.body.offset)
+        return f.read(rsp.body.get_length())
+
+
+class TestServer(TestCase):
+############################################################################################
+    def setUp(self):
+        delete_data_dir() # Ensure clean start
+        setup(); setup_client('client1')
+        self.data_store = versioned_storage(DATA_DIR + 'server')
+        self.auth = {'session_token' : client.authenticate().decode('utf8'), 'repository' : repo_name}
+        self.begin_commit()
+
+############################################################################################
+    def tearDown(self):
+        delete_data_dir()
+
+############################################################################################
+    def begin_commit(self):
+        headers = server_request('begin_commit', dict(self.auth, previous_revision = self.data_store.get_head()))
+        self.assertEqual(headers['status'], 'ok')
+
+############################################################################################
+    def assert_nothing_stored(self):
+        """ Check that no file was stored or left in the uploads directory """
+
+        self.assertEqual(os.listdir(DATA_DIR + 'server/uploads'), [])
+        self.assertEqual(os.listdir(DATA_DIR + 'server/files'), [])
+
+############################################################################################
+    def test_push_file_bad_offset(self):
+        """ Test that offsets which are not a positive number are rejected """
+
+        for offset in ['a', '-1']:
+            headers = server_request('push_file', dict(self.auth, path = '/test', upload_id = 'test', offset = offset), b'test')
+            self.assertEqual((headers['status'], headers['msg']), ('fail', server.upload_offset_msg))
+
+        # Beyond the data received
+        headers = server_request('push_file', dict(self.auth, path = '/test', offset = '10'), b'test')
+        self.assertEqual((headers['status'], headers['msg']), ('fail', server.upload_offset_msg))
+
+        self.assert_nothing_stored()
+
+############################################################################################
+    def test_resume_upload(self):
+        """ Test that an interrupted upload can be resumed from the amount received """
+
+        content = os.urandom(100000)
+        headers = dict(self.auth, path = '/test', upload_id = 'test', hash = hashlib.sha256(content).hexdigest())
+
+        body = BytesIO(content)
+        def interrupted_reader(length):
+            if body.tell() >= 40000: raise ConnectionError('connection lost')
+            return body.read(min(length, 40000 - body.tell()))
+
+        with self.assertRaises(ConnectionError): server_request('push_file', headers, content, interrupted_reader)
+
+        status = server_request('upload_status', dict(self.auth, upload_id = 'test'))
+        self.assertEqual((status['status'], status['offset']), ('ok', '40000'))
+
+        headers = server_request('push_file', dict(headers, offset = status['offset']), content[40000:])
+        self.assertEqual(headers['status'], 'ok')
+        self.assertEqual(server_request('upload_status', dict(self.auth, upload_id = 'test'))['offset'], '0')
+
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'test', mode = 'commit'))['status'], 'ok')
+        self.assertEqual(self.data_store.get_file_info_from_path('/test')['hash'], hashlib.sha256(content).hexdigest())
+
+############################################################################################
+    def test_heartbeat(self):
+        """ Test that heartbeats keep the commit lock from expiring """
+
+        setup_client('client2')
+        other = {'session_token' : client.authenticate().decode('utf8'), 'repository' : repo_name}
+        begin_other = dict(other, previous_revision = self.data_store.get_head())
+
+        now = time.time()
+        with mock.patch('shttpfs3.server.time') as server_time:
+            server_time.time.return_value = now + 25
+            self.assertEqual(server_request('heartbeat', self.auth)['status'], 'ok')
+
+            # Past the 30 second expiry of the lock taken by begin_commit
+            server_time.time.return_value = now + 45
+            headers = server_request('begin_commit', begin_other)
+            self.assertEqual((headers['status'], headers['msg']), ('fail', server.lock_fail_msg))
+
+            # Expired without a heartbeat
+            server_time.time.return_value = now + 60
+            self.assertEqual(server_request('begin_commit', begin_other)['status'], 'ok')
+            headers = server_request('heartbeat', self.auth)
+            self.assertEqual((headers['status'], headers['msg']), ('fail', server.lock_fail_msg))
+
+############################################################################################
+    def test_gc_partial_uploads(self):
+        """ Test that partial uploads are removed once they have not been added to for a while """
+
+        old = server.partial_upload_path(DATA_DIR + 'server', 'test', 'old')
+        new = server.partial_upload_path(DATA_DIR + 'server', 'test', 'new')
+        os.makedirs(DATA_DIR + 'server/uploads', exist_ok = True)
+        for path in [old, new]:
+            with open(path, 'wb') as f: f.write(b'partial')
+        stale = time.time() - server.partial_upload_lifetime - 10
+        os.utime(old, (stale, stale))
+
+        server.gc_partial_uploads(DATA_DIR + 'server')
+        self.assertEqual(os.listdir(DATA_DIR + 'server/uploads'), [os.path.basename(new)])
+
+############################################################################################
+    def test_pull_file_range(self):
+        """ Test that pull_file sends only the requested range, unless the file has changed """
+
+        content = os.urandom(10000); file_hash = hashlib.sha256(content).hexdigest()
+        self.assertEqual(server_request('push_file', dict(self.auth, path = '/test', hash = file_hash), content)['status'], 'ok')
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'test', mode = 'commit'))['status'], 'ok')
+
+        pull = dict(self.auth, path = '/test')
+        rsp = server_endpoint('pull_file', dict(pull, range = 'bytes=4000-', **{'if-range' : file_hash}))
+        self.assertEqual(rsp.headers['content-range'], 'bytes 4000-9999/10000')
+        self.assertEqual(responce_body(rsp), content[4000:])
+        self.assertEqual(responce_preamble(rsp, True)[0].split(b'\r\n')[0], b'HTTP/1.1 206 Partial Content')
+
+        rsp = server_endpoint('pull_file', dict(pull, range = 'bytes=-10'))
+        self.assertEqual((rsp.headers['content-range'], responce_body(rsp)), ('bytes 9990-9999/10000', content[-10:]))
+
+        # The whole file is sent if it has changed, or the range cannot be satisfied
+        for headers in [{'range' : 'bytes=4000-', 'if-range' : hashlib.sha256(b'old').hexdigest()},
+                        {'range' : 'bytes=10000-'}, {'range' : 'bytes=--5'}]:
+            rsp = server_endpoint('pull_file', dict(pull, **headers))
+            self.assertTrue('content-range' not in rsp.headers)
+            self.assertEqual(responce_body(rsp), content)
+
+############################################################################################
+    def test_pull_file_compression(self):
+        """ Test that files are only sent compressed if compressing them made them smaller """
+
+        compressible, incompressible = b'a' * 100000, os.urandom(100000)
+        for path, content in [('/compressible', compressible), ('/random', incompressible)]:
+            self.assertEqual(server_request('push_file', dict(self.auth, path = path), content)['status'], 'ok')
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'test', mode = 'commit'))['status'], 'ok')
+
+        rsp = server_endpoint('pull_file', dict(self.auth, path = '/compressible', **{'accept-encoding' : 'deflate'}))
+        self.assertEqual(rsp.headers['content-encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(responce_body(rsp)), compressible)
+        os.remove(rsp.body.path)
+
+        # The sample is taken to be compressible, but the whole file is not
+        with mock.patch.object(server, 'worth_compressing', return_value = True):
+            rsp = server_endpoint('pull_file', dict(self.auth, path = '/random', **{'accept-encoding' : 'deflate'}))
+        self.assertTrue('content-encoding' not in rsp.headers)
+        self.assertEqual(responce_body(rsp), incompressible)
+        self.assertEqual(os.listdir(DATA_DIR + 'server/uploads'), [])
+
+############################################################################################
+    def test_pull_files_bad_request(self):
+        """ Test that pull_files rejects a missing or malformed 'max_size' or list of files """
+
+        for body in [{'files' : '[]'}, {'files' : '[]', 'max_size' : 'a'}, {'files' : '[]', 'max_size' : '-1'},
+                     {'max_size' : '10'}, {'files' : '{', 'max_size' : '10'}, {'files' : '"/test"', 'max_size' : '10'}]:
+            self.assertEqual(server_request('pull_files', self.auth, json.dumps(body).encode('utf8'))['status'], 'fail')
+
+        self.assertEqual(server_request('push_file', dict(self.auth, path = '/test'), b'test')['status'], 'ok')
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'test', mode = 'commit'))['status'], 'ok')
+        body = json.dumps({'files' : '["/test"]', 'max_size' : '10'}).encode('utf8')
+        self.assertEqual(server_request('pull_files', self.auth, body)['status'], 'ok')
+
+############################################################################################
+    def test_push_known_files_bad_request(self):
+        """ Test that push_known_files rejects malformed entries in the list of files """
+
+        file_hash = hashlib.sha256(b'test').hexdigest()
+        for files in [[{'path' : '/test'}], [{'hash' : file_hash}], ['/test'], [{'path' : 1, 'hash' : file_hash}],
+                      [{'path' : '/test', 'hash' : 'abc'}], [{'path' : '/../test', 'hash' : file_hash}], {'path' : '/test'}]:
+            body = json.dumps({'files' : json.dumps(files)}).encode('utf8')
+            self.assertEqual(server_request('push_known_files', self.auth, body)['status'], 'fail')
+
+        self.assertEqual(server_request('push_known_files', self.auth, b'{}')['status'], 'fail')
+
+        body = json.dumps({'files' : json.dumps([{'path' : '/test', 'hash' : file_hash}])}).encode('utf8')
+        rsp = server_endpoint('push_known_files', self.auth, body)
+        self.assertEqual((rsp.headers['status'], json.loads(rsp.body)), ('ok', {'missing' : ['/test']}))
+
+############################################################################################
+    def test_hash_mismatch(self):
+        """ Test that files which do not match the hash sent with them are not stored """
+
+        wrong_hash = hashlib.sha256(b'something else').hexdigest()
+
+        for upload_id in [{}, {'upload_id' : 'test'}]:
+            headers = server_request('push_file', dict(self.auth, path = '/test', hash = wrong_hash, **upload_id), b'test')
+            self.assertEqual((headers['status'], headers['msg']), ('fail', server.hash_mismatch_msg))
+
+        body = (pack_record_header({'path' : '/good', 'hash' : hashlib.sha256(b'good').hexdigest()}, 4) + b'good' +
+                pack_record_header({'path' : '/bad',  'hash' : wrong_hash}, 3) + b'bad' + end_marker)
+        self.assertEqual(server_request('push_files', self.auth, body)['status'], 'fail')
+
+        self.assert_nothing_stored()
+
+############################################################################################
+    def test_push_delta_hash_mismatch(self):
+        """ Test that a delta which does not produce a file matching the hash is rejected """
+
+        base = os.urandom(10000); new = base + b'appended'
+        headers = server_request('push_file', dict(self.auth, path = '/test', hash = hashlib.sha256(base).hexdigest()), base)
+        self.assertEqual(headers['status'], 'ok')
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'base', mode = 'commit'))['status'], 'ok')
+        self.begin_commit()
+
+        delta = BytesIO()
+        make_delta(BytesIO(new), signature(BytesIO(base), 1024), delta)
+
+        headers = server_request('push_delta', dict(self.auth, path = '/test', base_hash = hashlib.sha256(base).hexdigest(),
+                                                    hash = hashlib.sha256(b'something else').hexdigest()), delta.getvalue())
+        self.assertEqual((headers['status'], headers['msg']), ('fail', server.hash_mismatch_msg))
+        self.assertEqual(os.listdir(DATA_DIR + 'server/uploads'), [])
+
+        # The correct hash is accepted
+        headers = server_request('push_delta', dict(self.auth, path = '/test', base_hash = hashlib.sha256(base).hexdigest(),
+                                                    hash = hashlib.sha256(new).hexdigest()), delta.getvalue())
+        self.assertEqual(headers['status'], 'ok')
+
+############################################################################################
+    def test_concurrent_push_file(self):
+        """ Test that files can be received concurrently, with both requests part way
+        through receiving their body at the same time """
+
+        contents = {'/test1' : os.urandom(100000), '/test2' : os.urandom(100000)}
+        barrier = threading.Barrier(2, timeout = 5)
+        results = {}
+
+        def push(path):
+            body = BytesIO(contents[path])
+            def reader(length):
+                if body.tell() > 0: barrier.wait() # both have started receiving
+                return body.read(min(length, 1000))
+
+            results[path] = server_request('push_file', dict(self.auth, path = path, hash = hashlib.sha256(contents[path]).hexdigest()),
+                                           contents[path], reader)
+
+        threads = [threading.Thread(target = push, args = (path,)) for path in contents]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual([results[path]['status'] for path in contents], ['ok', 'ok'])
+        self.assertEqual(server_request('commit', dict(self.auth, commit_message = 'test', mode = 'commit'))['status'], 'ok')
+        for path, content in contents.items():
+            self.assertEqual(self.data_store.get_file_info_from_path(path)['hash'], hashlib.sha256(content).hexdigest())
+        self.assertEqual(os.listdir(DATA_DIR + 'server/uploads'), [])
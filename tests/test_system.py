@@ -9,6 +9,7 @@ from shttpfs3.common import file_get_contents, file_put_contents, make_dirs_if_d
 import shttpfs3.client as client
 import shttpfs3.server as server
 from shttpfs3.server import Request, Responce
+from shttpfs3.http_common import read_body
 
 private_key = "bkUg07WLoxKcsWaupuVIyyMrVyWMdX8q8Zvta+wwKi6kmF7pCyklcIoNAOkfo1YR7O/Fb/Z0bJJ1j/lATtkKQ6c="
 public_key  = "mF7pCyklcIoNAOkfo1YR7O/Fb/Z0bJJ1j/lATtkKQ6c="
@@ -23,11 +24,13 @@ def setup():
             "server_domain"  : "none",
             "user"           : "test",
             "repository"     : repo_name,
-            "private_key"    : private_key}),  encoding='utf8'))
+            "private_key"    : private_key,
+            "pull_workers"   : 4, "push_workers" : 4}),  encoding='utf8'))
 
     make_client('client1')
     make_client('client2')
     make_dirs_if_dont_exist(DATA_DIR + 'server')
+    server.auth_db_initilised = False # the server directory is new
 
 ############################################################################################
 def setup_client(name):
@@ -54,7 +57,7 @@ def setup_client(name):
             headers_new = {}
             for k,v in headers.items():
                 if isinstance(v, bytes): v = v.decode('utf8')
-                headers_new[k] = v
+                headers_new[k.lower()] = v
 
             def real_reader(length = None):
                 if length == None:
@@ -69,7 +72,7 @@ def setup_client(name):
                               remote_port = 80,
                               uri         = '/' + url,
                               headers     = headers_new,
-                              body        = real_reader)
+                              body        = read_body(reader.read, len(reader.getvalue()), b''))
 
             return server.endpoint(request)
 
@@ -81,22 +84,38 @@ def setup_client(name):
             res = self.request_helper(url, headers, reader)
 
             if gen:
-                def writer(path):
-                    with open(res.body.path, 'rb') as sf:
-                        with open(path, 'wb') as df:
-                            df.write(sf.read())
+                def read_part(part):
+                    if isinstance(part, bytes): return part
+                    with open(part.path, 'rb') as sf:
+                        sf.seek(part.offset)
+                        data = sf.read(part.length)
+                    if part.delete: os.remove(part.path)
+                    return data
+
+                def writer(dest, append = False):
+                    data = b''.join(read_part(part) for part in (res.body if isinstance(res.body, list) else [res.body]))
+
+                    if callable(dest): dest(data); return
+                    with open(dest, 'ab' if append else 'wb') as df:
+                        df.write(data)
                 return writer, dict(res.headers)
 
             else:
                 return res.body, dict(res.headers)
 
-        def send_file(self, url, headers, file_path):
-            reader = BytesIO(file_get_contents(file_path))
+        def send_file(self, url, headers, file_path, offset = 0):
+            reader = BytesIO(file_get_contents(file_path)[offset:])
             res = self.request_helper(url, headers, reader)
             return res.body, dict(res.headers)
 
-    client.server_connection = test_connection()
+        def send_parts(self, url, headers, parts):
+            reader = BytesIO(b''.join(part if isinstance(part, bytes) else file_get_contents(part[0])[:part[1]] for part in parts))
+            res = self.request_helper(url, headers, reader)
+            return res.body, dict(res.headers)
+
+    client.client_http_request = lambda *a: test_connection()
     client.init()
+    client.server_connection = test_connection()
 
 
 def get_server_file_name(content):
@@ -193,6 +212,15 @@ class TestSystem(TestCase):
 
         time.sleep(0.5) # See above
 
+        #==================================================
+        # touch only changes should not be committed
+        #==================================================
+        os.utime(DATA_DIR + 'client1/test2', ns = (1, 1))
+        setup_client('client1')
+        self.assertEqual(client.commit(client.authenticate(), 'touch only'), None)
+        manifest = client.data_store.read_local_manifest()
+        self.assertEqual(manifest['files']['/test2']['last_mod'], 1e-9)
+
         #==================================================
         # setup for next test
         #==================================================
@@ -73,3 +73,32 @@ class TestVersionedStorage(TestCase):
 
         self.assertEqual(os.listdir(cpjoin(DATA_DIR, 'files')), ['9f'])
         self.assertEqual(os.listdir(cpjoin(DATA_DIR, 'files', '9f')), ['86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'])
+
+############################################################################################
+    def test_fs_put_existing(self):
+        """ Test adding files whose contents are already stored without re-sending them """
+
+        file_put_contents(cpjoin(DATA_DIR, 'test 1'), b'test')
+        test_hash = '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+        #==================
+        data_store = versioned_storage(DATA_DIR)
+        self.assertFalse(data_store.have_file_object(test_hash))
+
+        data_store.begin()
+        data_store.fs_put_from_file(cpjoin(DATA_DIR, 'test 1'), {'path' : '/test/path'})
+        data_store.commit('test msg', 'test user')
+        self.assertTrue(data_store.have_file_object(test_hash))
+
+        data_store.begin()
+        data_store.fs_put_existing([{'path' : '/copy/one', 'hash' : test_hash}, {'path' : '/copy/two', 'hash' : test_hash}])
+        data_store.commit('test msg', 'test user')
+
+        changes = data_store.get_changes_since('root', data_store.get_head())
+        self.assertEqual(sorted(changes.keys()), ['/copy/one', '/copy/two', '/test/path'])
+        self.assertEqual({fle['hash'] for fle in changes.values()}, {test_hash})
+
+        # Looking up many paths at once
+        infos = data_store.get_file_info_from_paths(['/copy/two', '/test/path'])
+        self.assertEqual([(i['path'], i['hash']) for i in infos], [('/copy/two', test_hash), ('/test/path', test_hash)])
+        with self.assertRaises(IOError): data_store.get_file_info_from_paths(['/copy/one', '/copy/three'])